@@ -0,0 +1,176 @@
+import io
+import tempfile
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.json as pj
+import pyarrow.parquet as pq
+import telemetry
+
+# Binance's short field names for each column of an aggregate trade.
+AGGTRADE_FIELDS = {
+    'agg_trade_id': ('a', np.int64),
+    'price': ('p', np.float64),
+    'quantity': ('q', np.float64),
+    'first_trade_id': ('f', np.int64),
+    'last_trade_id': ('l', np.int64),
+    'transact_time': ('T', np.int64),
+    'is_buyer_maker': ('m', np.bool_),
+    'is_best_match': ('M', np.bool_),
+}
+
+AGGTRADE_SCHEMA = pa.schema([
+    ('trading_pair', pa.string()),
+    ('agg_trade_id', pa.int64()),
+    ('price', pa.float64()),
+    ('quantity', pa.float64()),
+    ('first_trade_id', pa.int64()),
+    ('last_trade_id', pa.int64()),
+    ('transact_time', pa.int64()),
+    ('is_buyer_maker', pa.bool_()),
+    ('is_best_match', pa.bool_()),
+])
+
+# Binance's JSON types for each short field; prices and quantities arrive as strings.
+_AGGTRADE_JSON_SCHEMA = pa.schema([
+    ('a', pa.int64()), ('p', pa.string()), ('q', pa.string()), ('f', pa.int64()),
+    ('l', pa.int64()), ('T', pa.int64()), ('m', pa.bool_()), ('M', pa.bool_()),
+])
+
+# Buffered bytes per trade: six 8-byte columns and two booleans.
+AGGTRADE_ROW_BYTES = 50
+
+def get_aggtrades_blob_path(trading_pair: str, year: int, month: int, day: int) -> str:
+    return f"binance_aggtrades/{trading_pair}/{year}/{month:02d}/{day:02d}.parquet"
+
+class AggTradePage:
+    """
+    One aggTrades response as typed columns, in agg_trade_id order.
+    """
+
+    def __init__(self, columns: dict):
+        self.columns = columns
+
+    @classmethod
+    def from_body(cls, body: bytes) -> "AggTradePage":
+        """
+        Decode a response body with Arrow's JSON reader, without per-cell Python objects:
+        the array is cut into one object per line and parsed against a fixed schema, and
+        the price strings are cast to float64 in one vectorised pass.
+        """
+        text = body.translate(None, b" \t\r\n")
+        if len(text) <= 2:
+            return cls({name: np.empty(0, dtype=dtype) for name, (_, dtype) in AGGTRADE_FIELDS.items()})
+        lines = text[1:-1].replace(b"},{", b"}\n{")
+        table = pj.read_json(
+            io.BytesIO(lines),
+            read_options=pj.ReadOptions(use_threads=False, block_size=len(lines) + 1),
+            parse_options=pj.ParseOptions(explicit_schema=_AGGTRADE_JSON_SCHEMA, unexpected_field_behavior="ignore"),
+        )
+        columns = {}
+        for name, (key, dtype) in AGGTRADE_FIELDS.items():
+            column = table[key]
+            if column.type == pa.string():
+                column = pc.cast(column, pa.float64())
+            if column.null_count:
+                raise ValueError(f"Malformed aggTrades response: {column.null_count} trades without '{key}'")
+            columns[name] = column.to_numpy().astype(dtype, copy=False)
+        return cls(columns)
+
+    def __len__(self) -> int:
+        return len(self.columns['agg_trade_id'])
+
+    @property
+    def first_id(self) -> int:
+        return int(self.columns['agg_trade_id'][0])
+
+    @property
+    def last_id(self) -> int:
+        return int(self.columns['agg_trade_id'][-1])
+
+    def drop_from_time(self, end_ms: int) -> "AggTradePage":
+        """
+        Keep only the trades before end_ms.
+        """
+        kept = int(np.searchsorted(self.columns['transact_time'], end_ms, side="left"))
+        if kept == len(self):
+            return self
+        return AggTradePage({name: values[:kept] for name, values in self.columns.items()})
+
+class SpillingAggTradeWriter:
+    """
+    Encode aggregate trades into a Parquet file with memory bounded by `memory_bytes`.
+
+    Pages are buffered as typed columns up to a quarter of the bound and then written as
+    one row group; the flush briefly holds a concatenated copy of the buffer too. The file
+    goes to a SpooledTemporaryFile, which stays in memory up to half the bound and spills
+    to local disk past it. The peak is about buffer + copy + spool = `memory_bytes`, so a
+    heavy day costs disk, not memory.
+    """
+
+    def __init__(self, trading_pair: str, memory_bytes: int, compression: str = "zstd"):
+        self.trading_pair = trading_pair
+        self.memory_bytes = memory_bytes
+        self.buffer_bytes = memory_bytes // 4
+        self.spool_bytes = memory_bytes // 2
+        self.file = tempfile.SpooledTemporaryFile(max_size=self.spool_bytes, prefix="aggtrades-")
+        self.spilled = False
+        self.record_count = 0
+        self.first_id = None
+        self.last_id = None
+        self.first_time = None
+        self.last_time = None
+        self._pages = []
+        self._buffered_rows = 0
+        self._parquet_writer = pq.ParquetWriter(self.file, AGGTRADE_SCHEMA, compression=compression, write_statistics=True)
+
+    def _check_spill(self):
+        # The spool rolls over to disk once a write takes it past max_size.
+        self.spilled = self.spilled or self.file.tell() > self.spool_bytes
+
+    def write_page(self, page: AggTradePage):
+        if not len(page):
+            return
+        if self.first_id is None:
+            self.first_id = page.first_id
+            self.first_time = int(page.columns['transact_time'][0])
+        self.last_id = page.last_id
+        self.last_time = int(page.columns['transact_time'][-1])
+        self.record_count += len(page)
+        self._pages.append(page)
+        self._buffered_rows += len(page)
+        if self._buffered_rows * AGGTRADE_ROW_BYTES >= self.buffer_bytes:
+            self._flush()
+
+    def _flush(self):
+        if not self._pages:
+            return
+        with telemetry.span("serialize"):
+            columns = {name: np.concatenate([page.columns[name] for page in self._pages]) for name in AGGTRADE_FIELDS}
+            columns['trading_pair'] = pa.DictionaryArray.from_arrays(np.zeros(self._buffered_rows, dtype=np.int32), [self.trading_pair]).cast(pa.string())
+            self._parquet_writer.write_table(pa.Table.from_pydict(columns, schema=AGGTRADE_SCHEMA))
+        self._pages = []
+        self._buffered_rows = 0
+        self._check_spill()
+
+    def close(self):
+        """
+        Flush the last row group and the footer, and rewind the file for the upload.
+        """
+        self._flush()
+        self._parquet_writer.close()
+        self._check_spill()
+        self.file.seek(0)
+        return self.file
+
+    def discard(self):
+        self.file.close()
+
+def build_aggtrades_metadata(writer: SpillingAggTradeWriter) -> dict:
+    return {
+        "record_count": str(writer.record_count),
+        "first_agg_trade_id": str(writer.first_id),
+        "last_agg_trade_id": str(writer.last_id),
+        "first_transact_time": str(writer.first_time),
+        "last_transact_time": str(writer.last_time),
+    }
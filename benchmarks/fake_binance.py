@@ -0,0 +1,126 @@
+import json
+import math
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# Pipeline modules read BINANCE_API_BASE_URL at import time, so this module must not
+# import them: the server has to be listening before they are loaded.
+INTERVAL_UNIT_MS = {"m": 60_000, "h": 3_600_000, "d": 86_400_000, "w": 604_800_000}
+
+def parse_interval(interval: str) -> int:
+    return int(interval[:-1]) * INTERVAL_UNIT_MS[interval[-1]]
+
+def build_candle(open_time: int, interval_ms: int) -> list:
+    """
+    Deterministic candle for `open_time`: a slow sine wave plus a hash-derived wiggle,
+    formatted the way Binance returns it (strings with 8 decimals).
+    """
+    base = 30_000 + 2_000 * math.sin(open_time / 86_400_000)
+    wiggle = ((open_time // interval_ms) * 2654435761 % 1000) / 100
+    open_price = base + wiggle
+    close_price = base - wiggle / 2
+    high_price = max(open_price, close_price) + 5
+    low_price = min(open_price, close_price) - 5
+    volume = 10 + (open_time // interval_ms) % 97
+    trades = 100 + (open_time // interval_ms) % 53
+    return [
+        open_time, f"{open_price:.8f}", f"{high_price:.8f}", f"{low_price:.8f}", f"{close_price:.8f}",
+        f"{volume:.8f}", open_time + interval_ms - 1, f"{volume * close_price:.8f}", trades,
+        f"{volume / 2:.8f}", f"{volume * close_price / 2:.8f}", "0"
+    ]
+
+class FakeBinanceServer:
+    """
+    Local stand-in for GET /api/v3/klines.
+
+    latency_ms delays every response, page_limit caps the candles per page below what
+    the client asked for, and throttle_every answers every Nth request with a 429 and
+    Retry-After. Used weight is reported in X-MBX-USED-WEIGHT-1M like the real API.
+    """
+
+    def __init__(self, latency_ms: float = 0, page_limit: int = 1000, throttle_every: int = 0, retry_after_seconds: int = 1, host: str = "127.0.0.1", port: int = 0):
+        self.latency_ms = latency_ms
+        self.page_limit = page_limit
+        self.throttle_every = throttle_every
+        self.retry_after_seconds = retry_after_seconds
+        self.request_count = 0
+        self.throttled_count = 0
+        self._weight_window = 0
+        self._used_weight = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._build_handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _count_request(self, weight: int) -> tuple:
+        """
+        Returns (throttled, used_weight) for the request being served.
+        """
+        with self._lock:
+            self.request_count += 1
+            window = int(time.time() // 60)
+            if window != self._weight_window:
+                self._weight_window = window
+                self._used_weight = 0
+            self._used_weight += weight
+            throttled = bool(self.throttle_every) and self.request_count % self.throttle_every == 0
+            if throttled:
+                self.throttled_count += 1
+            return throttled, self._used_weight
+
+    def klines(self, query: dict) -> list:
+        interval_ms = parse_interval(query["interval"][0])
+        limit = min(int(query.get("limit", ["500"])[0]), 1000, self.page_limit)
+        start_ms = int(query["startTime"][0])
+        end_ms = int(query["endTime"][0]) if "endTime" in query else start_ms + interval_ms * limit - 1
+        first_open = -(-start_ms // interval_ms) * interval_ms
+        last_open = min(end_ms, first_open + interval_ms * (limit - 1))
+        return [build_candle(open_time, interval_ms) for open_time in range(first_open, last_open + 1, interval_ms)]
+
+    def _build_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status: int, body: bytes, headers: dict):
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                if server.latency_ms:
+                    time.sleep(server.latency_ms / 1000)
+                if url.path != "/api/v3/klines":
+                    self._send(404, b'{"code":-1,"msg":"Not found"}', {})
+                    return
+                throttled, used_weight = server._count_request(2)
+                headers = {"X-MBX-USED-WEIGHT-1M": str(used_weight)}
+                if throttled:
+                    self._send(429, b'{"code":-1003,"msg":"Too many requests"}', {**headers, "Retry-After": str(server.retry_after_seconds)})
+                    return
+                self._send(200, json.dumps(server.klines(parse_qs(url.query)), separators=(",", ":")).encode(), headers)
+
+        return Handler
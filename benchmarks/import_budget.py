@@ -0,0 +1,76 @@
+"""
+Import-time budget for the function app.
+
+Every cold start indexes function_app, which imports every blueprint module. This
+imports each of them in a fresh interpreter, reports the time and the heavy packages it
+pulled in, and exits non-zero if function_app is over budget or loads one of them.
+
+    python -m benchmarks.import_budget --budget-ms 600
+
+pandas, pyarrow, the storage SDK, requests and pyodbc belong in the activities that use
+them; import them there, on first use.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules function_app must not load while it is only being indexed.
+FORBIDDEN_MODULES = ("pandas", "numpy", "pyarrow", "azure.storage.blob", "azure.identity", "requests", "pyodbc")
+
+MODULES = (
+    "function_app", "http_starter", "daily_timer_trigger", "hybrid_orchestrator", "binance_month_activity",
+    "binance_aggtrades_activity", "kline_rollup", "kline_features", "kline_gaps", "kline_query", "log_manager", "partition_manifest",
+    "pair_universe", "synapse_automation", "synapse_load",
+)
+
+PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import {module}
+elapsed_ms = (time.perf_counter() - started) * 1000
+print(json.dumps({{"ms": elapsed_ms, "loaded": [name for name in {forbidden!r} if name in sys.modules]}}))
+"""
+
+def measure_import(module: str, repeat: int) -> dict:
+    """
+    Best of `repeat` cold imports of `module`, each in its own interpreter.
+    """
+    runs = []
+    for _ in range(repeat):
+        completed = subprocess.run(
+            [sys.executable, "-c", PROBE.format(module=module, forbidden=FORBIDDEN_MODULES)],
+            cwd=REPO_ROOT, capture_output=True, text=True, check=True
+        )
+        runs.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+    return {"module": module, "ms": round(min(run["ms"] for run in runs), 1), "loaded": runs[0]["loaded"]}
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--budget-ms", type=float, default=float(os.environ.get("IMPORT_BUDGET_MS", "600")), help="Allowed cold import time of function_app")
+    parser.add_argument("--repeat", type=int, default=3, help="Imports per module; the fastest counts")
+    parser.add_argument("--modules", help="Comma-separated modules to measure (default: function_app and every blueprint)")
+    return parser.parse_args(argv)
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    modules = [module.strip() for module in args.modules.split(",")] if args.modules else MODULES
+    results = [measure_import(module, args.repeat) for module in modules]
+
+    failures = []
+    for result in results:
+        print(f"{result['module']:<28} {result['ms']:>8.1f} ms  {', '.join(result['loaded']) or '-'}", flush=True)
+        if result["loaded"]:
+            failures.append(f"{result['module']} imports {', '.join(result['loaded'])}")
+        if result["module"] == "function_app" and result["ms"] > args.budget_ms:
+            failures.append(f"function_app takes {result['ms']:.0f} ms to import, over the {args.budget_ms:.0f} ms budget")
+
+    for failure in failures:
+        print(f"FAIL: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,199 @@
+"""
+Offline benchmark of the month ingestion path.
+
+Runs process_binance_month_activity against a local Binance stand-in and Azurite, then
+the tracking activities against an in-memory SQL stand-in, and prints one JSON
+document with throughput, request, memory and per-stage timings.
+
+    # Azurite must be listening, e.g. `npx azurite-blob --location /tmp/azurite`
+    python -m benchmarks.run_benchmark --pairs BTCUSDT,ETHUSDT --months 6 --fetch-concurrency 4 --output bench.json
+
+Compare the JSON of two runs to prove (or disprove) a performance change.
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from dateutil.relativedelta import relativedelta
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+from benchmarks.fake_binance import FakeBinanceServer
+from benchmarks.sql_stand_in import TrackingStore
+
+AZURITE_CONNECTION_STRING = (
+    "DefaultEndpointsProtocol=http;AccountName=devstoreaccount1;"
+    "AccountKey=Eby8vdM02xNOcqFlqUwJPLlFEtlCDXJ1OUzFT50uSRZ6IFsuFq2UVErCz4I6tq/K1SZFPTOtr/KBHBeksoGMGw==;"
+    "BlobEndpoint=http://127.0.0.1:10000/devstoreaccount1;"
+)
+
+def current_rss_mb() -> float:
+    with open("/proc/self/statm") as statm:
+        return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is reported in KiB on Linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--pairs", default="BTCUSDT", help="Comma-separated trading pairs")
+    parser.add_argument("--start-month", default="2021-01", help="First month to ingest (YYYY-MM)")
+    parser.add_argument("--months", type=int, default=3, help="Months per pair")
+    parser.add_argument("--parallel-months", type=int, default=1, help="Months processed at once, like the backfill fan-out")
+    parser.add_argument("--fetch-concurrency", type=int, default=1)
+    parser.add_argument("--output-format", choices=("csv", "parquet"), default="csv")
+    parser.add_argument("--latency-ms", type=float, default=0, help="Latency the fake Binance adds to every response")
+    parser.add_argument("--page-limit", type=int, default=1000, help="Candles per page the fake Binance returns at most")
+    parser.add_argument("--throttle-every", type=int, default=0, help="Answer every Nth request with 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After seconds sent with injected 429s")
+    parser.add_argument("--weight-limit", type=int, default=6000, help="BINANCE_WEIGHT_LIMIT_PER_MINUTE for the run")
+    parser.add_argument("--sql-latency-ms", type=float, default=0, help="Round trip the SQL stand-in adds per statement")
+    parser.add_argument("--storage-connection-string", default=os.environ.get("BENCHMARK_STORAGE_CONNECTION_STRING", AZURITE_CONNECTION_STRING))
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout")
+    return parser.parse_args(argv)
+
+def main(argv=None) -> dict:
+    args = parse_args(argv)
+    pairs = [pair.strip() for pair in args.pairs.split(",") if pair.strip()]
+    first_month = datetime.strptime(args.start_month, "%Y-%m").replace(tzinfo=timezone.utc)
+    months = [first_month + relativedelta(months=offset) for offset in range(args.months)]
+
+    server = FakeBinanceServer(args.latency_ms, args.page_limit, args.throttle_every, args.retry_after).start()
+    # Pipeline modules read these at import time, so they are set before the imports below.
+    os.environ["BINANCE_API_BASE_URL"] = server.base_url
+    os.environ["STORAGE_CONNECTION_STRING"] = args.storage_connection_string
+    os.environ["BINANCE_WEIGHT_LIMIT_PER_MINUTE"] = str(args.weight_limit)
+    os.environ["OUTPUT_FORMAT"] = args.output_format
+    # Every run measures real fetches; pages cached by an earlier run would skew it.
+    os.environ["PAGE_CACHE_DIR"] = ""
+    os.environ["PAGE_CACHE_BLOB_PREFIX"] = ""
+
+    import client_registry
+    from azure.core.exceptions import ResourceExistsError
+    from binance_month_activity import process_binance_month_activity
+    from log_manager import get_last_timestamps_activity, update_tracking_batch_activity
+
+    tracking_store = TrackingStore(args.sql_latency_ms)
+    client_registry.set_sql_connection_factory(tracking_store.connect)
+
+    # Every activity emits one telemetry record; per-stage timings come from there.
+    telemetry_file = tempfile.NamedTemporaryFile(prefix="benchmark-telemetry-", suffix=".jsonl", delete=False)
+    telemetry_file.close()
+    os.environ["TELEMETRY_JSONL_PATH"] = telemetry_file.name
+
+    container_client = client_registry.get_container_client("raw")
+    try:
+        container_client.create_container()
+    except ResourceExistsError:
+        pass
+    for pair in pairs:
+        # Every run starts from an empty prefix so results are comparable.
+        for blob in container_client.list_blobs(name_starts_with=f"binance/{pair}/"):
+            container_client.delete_blob(blob.name)
+
+    activity = process_binance_month_activity._function.get_user_function()
+
+    def run_month(pair: str, month: datetime) -> dict:
+        started = time.perf_counter()
+        result = activity({"trading_pair": pair, "start_timestamp": month.isoformat(), "fetch_concurrency": args.fetch_concurrency})
+        return {
+            "trading_pair": pair,
+            "month": f"{month.year}-{month.month:02d}",
+            "start_timestamp": month.isoformat(),
+            "seconds": round(time.perf_counter() - started, 4),
+            "record_count": result["record_count"],
+            "written": result.get("written", False),
+            "request_count": result.get("request_count", 0),
+            "retry_count": result.get("retry_count", 0),
+            "throttled_seconds": result.get("throttled_seconds", 0.0),
+            "rss_mb": round(current_rss_mb(), 1),
+        }
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.parallel_months) as executor:
+        month_results = list(executor.map(lambda job: run_month(*job), [(pair, month) for pair in pairs for month in months]))
+    ingest_seconds = time.perf_counter() - started
+
+    tracking_started = time.perf_counter()
+    watermark = (months[-1] + relativedelta(months=1)).isoformat()
+    update_tracking_batch_activity._function.get_user_function()([
+        {"trading_pair": pair, "last_processed_timestamp": watermark, "record_count": 0, "full_refresh": False} for pair in pairs
+    ])
+    watermarks = get_last_timestamps_activity._function.get_user_function()(pairs)
+    tracking_seconds = time.perf_counter() - tracking_started
+    server.stop()
+
+    with open(telemetry_file.name) as records:
+        telemetry_records = [json.loads(line) for line in records if line.strip()]
+    os.unlink(telemetry_file.name)
+    month_records = {
+        (record["trading_pair"], record["start_timestamp"]): record
+        for record in telemetry_records if record["function"] == "process_binance_month_activity"
+    }
+    for result in month_results:
+        record = month_records[(result["trading_pair"], result.pop("start_timestamp"))]
+        result["stage_seconds"] = record["spans_seconds"]
+        result["serialize_seconds"] = record["spans_seconds"].get("serialize", 0.0)
+        result["upload_seconds"] = record["spans_seconds"].get("upload", 0.0)
+        result["bytes_uploaded"] = record["counters"].get("bytes_uploaded", 0)
+        result["bytes_downloaded"] = record["counters"].get("bytes_downloaded", 0)
+
+    request_count = sum(result["request_count"] for result in month_results)
+    report = {
+        "benchmark": "month_ingestion",
+        "git_commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("storage_connection_string", "output")},
+        "totals": {
+            "months": len(month_results),
+            "records": sum(result["record_count"] for result in month_results),
+            "partitions_skipped": sum(not result["written"] for result in month_results),
+            "seconds": round(ingest_seconds, 4),
+            "months_per_second": round(len(month_results) / ingest_seconds, 4),
+            "requests": request_count,
+            "requests_per_second": round(request_count / ingest_seconds, 2),
+            "server_requests": server.request_count,
+            "injected_429s": server.throttled_count,
+            "retries": sum(result["retry_count"] for result in month_results),
+            "throttled_seconds": round(sum(result["throttled_seconds"] for result in month_results), 3),
+            "serialize_seconds": round(sum(result["serialize_seconds"] for result in month_results), 4),
+            "upload_seconds": round(sum(result["upload_seconds"] for result in month_results), 4),
+            "bytes_uploaded": sum(result["bytes_uploaded"] for result in month_results),
+            "bytes_downloaded": sum(result["bytes_downloaded"] for result in month_results),
+            "peak_rss_mb": round(peak_rss_mb(), 1),
+        },
+        "tracking": {
+            "seconds": round(tracking_seconds, 4),
+            "statements": tracking_store.statement_count,
+            "records": [record for record in telemetry_records if record["function"] != "process_binance_month_activity"],
+            "watermarks_match": all(watermarks[pair].startswith(watermark[:19]) for pair in pairs),
+        },
+        "months": month_results,
+    }
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as report_file:
+            report_file.write(output + "\n")
+    else:
+        print(output)
+    return report
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+import re
+import threading
+import time
+
+class TrackingStore:
+    """
+    In-memory logging.TrackingTable shared by every stand-in connection.
+    """
+
+    def __init__(self, latency_ms: float = 0):
+        # Simulated round trip per statement, to approximate a remote dedicated pool.
+        self.latency_ms = latency_ms
+        # {(table_name, trading_pair): (timestamp, record_count, update_time, full_refresh)}
+        self.rows = {}
+        self.statement_count = 0
+        self.lock = threading.Lock()
+
+    def connect(self):
+        return StandInConnection(self)
+
+class StandInCursor:
+    """
+    Understands exactly the statements log_manager issues against the tracking table;
+    anything else raises so the stand-in never silently diverges from the real schema.
+    """
+
+    def __init__(self, store: TrackingStore, session: dict):
+        self.store = store
+        self.session = session
+        self._results = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, query: str, params: tuple = ()):
+        statement = " ".join(query.split())
+        if self.store.latency_ms:
+            time.sleep(self.store.latency_ms / 1000)
+        with self.store.lock:
+            self.store.statement_count += 1
+            if statement == "SELECT 1":
+                self._results = [(1,)]
+            elif statement.startswith("SELECT Trading_Pair, Last_Processed_Timestamp FROM logging.TrackingTable"):
+                table_name, pairs = params[0], params[1:]
+                self._results = [(pair, self.store.rows[(table_name, pair)][0]) for pair in pairs if (table_name, pair) in self.store.rows]
+            elif statement.startswith("CREATE TABLE #TrackingUpdates"):
+                self.session["#TrackingUpdates"] = []
+            elif statement.startswith("INSERT INTO #TrackingUpdates"):
+                rows = self.session["#TrackingUpdates"]
+                for offset in range(0, len(params), 6):
+                    rows.append(tuple(params[offset:offset + 6]))
+            elif statement.startswith("MERGE logging.TrackingTable"):
+                for table_name, pair, timestamp, record_count, update_time, full_refresh in self.session["#TrackingUpdates"]:
+                    self.store.rows[(table_name, pair)] = (timestamp, record_count, update_time, full_refresh)
+            elif re.match(r"DROP TABLE #TrackingUpdates", statement):
+                self.session.pop("#TrackingUpdates", None)
+            else:
+                raise NotImplementedError(f"SQL stand-in does not understand: {statement[:80]}")
+        return self
+
+    def fetchall(self):
+        return self._results
+
+    def fetchone(self):
+        return self._results[0] if self._results else None
+
+class StandInConnection:
+    def __init__(self, store: TrackingStore):
+        self.store = store
+        self.session = {}
+
+    def cursor(self):
+        return StandInCursor(self.store, self.session)
+
+    def commit(self):
+        pass
+
+    def close(self):
+        pass
@@ -0,0 +1,200 @@
+import azure.functions as func
+import azure.durable_functions as df
+import logging
+import os
+import shutil
+import telemetry
+from datetime import datetime, timedelta, timezone
+from dateutil import parser
+from binance_client import FetchStats, get_fetch_concurrency, iter_aggtrade_pages
+from client_registry import get_container_client
+
+bp = func.Blueprint()
+
+# Table_Name of the aggTrades watermarks in logging.TrackingTable.
+AGGTRADES_TABLE = "RAW_AGGTRADES"
+
+# A pair without a watermark or an explicit default_timestamp starts this many closed days
+# back rather than at the klines' 2021 default, which would take hundreds of timer runs.
+DEFAULT_LOOKBACK_DAYS = 7
+
+def get_closed_days(last_processed_dt: datetime, current_utc_now: datetime) -> list:
+    """
+    Start of every day from the one holding last_processed_dt up to, but not including, today.
+    """
+    day = last_processed_dt.replace(hour=0, minute=0, second=0, microsecond=0)
+    today = current_utc_now.replace(hour=0, minute=0, second=0, microsecond=0)
+    days = []
+    while day < today:
+        days.append(day)
+        day += timedelta(days=1)
+    return days
+
+@bp.activity_trigger(input_name="params")
+def process_binance_aggtrades_day_activity(params: dict) -> dict:
+    """
+    Fetch one closed UTC day of aggregate trades and save it as a Parquet partition.
+    Memory stays within AGGTRADES_MEMORY_MB however heavy the day: trades are paged by
+    id into typed columns, and the encoded day spills to a local temporary file before
+    it is streamed to the blob.
+    """
+    trading_pair = params.get("trading_pair")
+    logging.info(f"Activity process_binance_aggtrades_day_activity: Starting for {trading_pair} on {params.get('day')}")
+    # Imported on first use rather than when function_app is indexed (see benchmarks/import_budget.py).
+    from azure.core.exceptions import ResourceNotFoundError
+    from aggtrade_storage import SpillingAggTradeWriter, build_aggtrades_metadata, get_aggtrades_blob_path
+    from kline_storage import BlockBlobWriter, get_write_conditions
+    fetch_stats = FetchStats()
+
+    with telemetry.invocation("process_binance_aggtrades_day_activity", trading_pair=trading_pair, day=params.get("day")) as invocation:
+        writer = None
+        try:
+            day = parser.isoparse(params.get("day")).replace(hour=0, minute=0, second=0, microsecond=0)
+            start_ms = int(day.timestamp() * 1000)
+            end_ms = int((day + timedelta(days=1)).timestamp() * 1000)
+            if end_ms > datetime.now(timezone.utc).timestamp() * 1000:
+                raise ValueError(f"{day.date()} has not closed yet; only complete days are ingested")
+
+            blob_path = get_aggtrades_blob_path(trading_pair, day.year, day.month, day.day)
+            blob_client = get_container_client("raw").get_blob_client(blob_path)
+            try:
+                properties = blob_client.get_blob_properties()
+                state = {"etag": properties.etag, **(properties.metadata or {})}
+            except ResourceNotFoundError:
+                state = None
+
+            memory_bytes = int(float(params.get("memory_mb") or os.environ.get("AGGTRADES_MEMORY_MB", "64")) * 2 ** 20)
+            writer = SpillingAggTradeWriter(trading_pair, memory_bytes)
+            pages = iter(iter_aggtrade_pages(trading_pair, start_ms, end_ms, concurrency=get_fetch_concurrency(params), stats=fetch_stats))
+            while True:
+                with telemetry.span("fetch"):
+                    page = next(pages, None)
+                if page is None:
+                    break
+                writer.write_page(page)
+            data_file = writer.close()
+            invocation.add("rows", writer.record_count)
+            logging.info(f"Activity process_binance_aggtrades_day_activity: Fetch stats for {trading_pair}: {fetch_stats.as_dict()}")
+
+            if writer.record_count == 0:
+                logging.warning(f"Activity process_binance_aggtrades_day_activity: No trades for {trading_pair} on {day.date()}")
+                return {"record_count": 0, "written": False, **fetch_stats.as_dict()}
+
+            # Trade ids never change, so the same id range and count means the same day.
+            metadata = build_aggtrades_metadata(writer)
+            written = state is None or any(state.get(key) != value for key, value in metadata.items())
+            if written:
+                sink = BlockBlobWriter(blob_client)
+                shutil.copyfileobj(data_file, sink, sink.block_size)
+                sink.close(metadata=metadata, **get_write_conditions(state))
+                logging.info(f"Activity process_binance_aggtrades_day_activity: Uploaded {writer.record_count} trades ({sink.bytes_written} bytes, spilled to disk: {writer.spilled}) to {blob_path}")
+            else:
+                logging.info(f"Activity process_binance_aggtrades_day_activity: {blob_path} already holds trades {writer.first_id}..{writer.last_id}. Skipped the upload.")
+            invocation.add("partitions_written" if written else "partitions_skipped")
+            invocation.set(record_count=writer.record_count, spilled=writer.spilled, written=written)
+            return {"record_count": writer.record_count, "last_agg_trade_id": writer.last_id, "spilled": writer.spilled, "written": written, **fetch_stats.as_dict()}
+        except Exception as e:
+            logging.error(f"Activity process_binance_aggtrades_day_activity: Error processing {trading_pair}: {str(e)}")
+            if params.get("return_errors", False):
+                invocation.status = "error"
+                invocation.set(error=str(e))
+                return {"record_count": -1, "error": str(e)}
+            raise
+        finally:
+            if writer is not None:
+                writer.discard()
+            fetch_stats.add_to_telemetry()
+
+@bp.orchestration_trigger(context_name="context")
+def aggtrades_orchestrator(context: df.DurableOrchestrationContext):
+    """
+    Ingest the closed days of a pair's aggregate trades since its RAW_AGGTRADES watermark,
+    `parallelism` days in flight, advancing the watermark over the contiguous prefix of
+    days that succeeded. Continues as new until the backlog or max_days is done.
+    Input: {"trading_pair": "BTCUSDT", "parallelism": 4, "max_days": 0, "defer_tracking": false,
+            "default_timestamp": null, "lookback_days": 7}
+    A pair without a watermark starts at default_timestamp, or lookback_days closed days back.
+    With defer_tracking the tracking update is returned to the caller, as hybrid_orchestrator does.
+    """
+    input_data = context.get_input()
+    trading_pair = input_data.get("trading_pair")
+    parallelism = input_data.get("parallelism", 4)
+    # Days left for this run across generations; 0 means the whole backlog.
+    max_days = input_data.get("max_days", 0)
+    defer_tracking = input_data.get("defer_tracking", False)
+    instance_id = context.instance_id
+
+    if not trading_pair:
+        logging.error(f"Orchestrator {instance_id}: No trading pair provided.")
+        return "Error: No trading pair provided."
+
+    try:
+        current_utc_now = context.current_utc_datetime.replace(tzinfo=timezone.utc)
+        last_processed_str = input_data.get("last_processed_timestamp")
+        if not last_processed_str:
+            lookback_start = current_utc_now.replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=input_data.get("lookback_days", DEFAULT_LOOKBACK_DAYS))
+            last_processed_str = yield context.call_activity("get_table_timestamp_activity", {
+                "trading_pair": trading_pair,
+                "table_name": AGGTRADES_TABLE,
+                "default_timestamp": input_data.get("default_timestamp") or lookback_start.isoformat()
+            })
+        days = get_closed_days(parser.isoparse(last_processed_str), current_utc_now)
+        batch_days = days[:input_data.get("batch_days", parallelism * 4)]
+        if max_days:
+            batch_days = batch_days[:max_days]
+        logging.info(f"Orchestrator {instance_id}: Ingesting {len(batch_days)} of {len(days)} days of aggTrades for {trading_pair} (parallelism {parallelism})")
+
+        results = [None] * len(batch_days)
+        in_flight = {}
+        next_index = 0
+        while next_index < len(batch_days) or in_flight:
+            while next_index < len(batch_days) and len(in_flight) < parallelism:
+                task = context.call_activity("process_binance_aggtrades_day_activity", {
+                    "trading_pair": trading_pair,
+                    "day": batch_days[next_index].isoformat(),
+                    "return_errors": True
+                })
+                in_flight[task] = next_index
+                next_index += 1
+            finished = yield context.task_any(list(in_flight))
+            results[in_flight.pop(finished)] = finished.result
+
+        completed = 0
+        # With defer_tracking only the last generation reports back, so it carries the earlier ones' rows.
+        completed_records = input_data.get("deferred_record_count", 0) if defer_tracking else 0
+        for result in results:
+            if not result or result.get("record_count", -1) < 0:
+                break
+            completed += 1
+            completed_records += result["record_count"]
+        watermark = (batch_days[completed - 1] + timedelta(days=1)).isoformat() if completed else last_processed_str
+
+        tracking_update = {
+            "table_name": AGGTRADES_TABLE,
+            "trading_pair": trading_pair,
+            "last_processed_timestamp": watermark,
+            "record_count": completed_records,
+            "full_refresh": False
+        }
+        if completed and not defer_tracking:
+            yield context.call_activity("update_tracking_activity", tracking_update)
+
+        if completed < len(batch_days):
+            failed_day = batch_days[completed]
+            logging.error(f"Orchestrator {instance_id}: aggTrades stopped at {failed_day.date()} for {trading_pair}: {results[completed]}")
+            message = f"Ingested {completed} days of aggTrades for {trading_pair}; failed at {failed_day.date()}."
+        elif completed < len(days) and (not max_days or completed < max_days):
+            logging.info(f"Orchestrator {instance_id}: Ingested {completed} days of aggTrades for {trading_pair}, continuing...")
+            context.continue_as_new({**input_data, "last_processed_timestamp": watermark, "max_days": max_days - completed if max_days else 0,
+                                     "deferred_record_count": completed_records if defer_tracking else 0})
+            return f"Ingested {completed} days of aggTrades for {trading_pair}, continuing..."
+        else:
+            message = f"aggTrades for {trading_pair} are up to date through {watermark}" if completed == len(days) else f"Ingested {completed} days of aggTrades for {trading_pair}; the rest is left for the next run."
+        logging.info(f"Orchestrator {instance_id}: {message}")
+        if defer_tracking:
+            return {"message": message, "tracking_update": tracking_update}
+        return message
+    except Exception as e:
+        error_message = f"Orchestrator {instance_id}: Unhandled exception caught: {str(e)}"
+        logging.error(error_message)
+        return f"Orchestration Failed: {error_message}"
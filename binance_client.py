@@ -0,0 +1,342 @@
+import logging
+import os
+import random
+import threading
+import time
+import telemetry
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from binance_rate_limiter import get_rate_limiter
+from client_registry import get_http_session
+from page_cache import get_page_cache, get_page_key, is_page_closed
+
+# BINANCE_API_BASE_URL lets benchmarks point the client at a local stand-in.
+BINANCE_API_BASE_URL = os.environ.get("BINANCE_API_BASE_URL", "https://api.binance.com").rstrip("/")
+BINANCE_KLINES_URL = f"{BINANCE_API_BASE_URL}/api/v3/klines"
+BINANCE_EXCHANGE_INFO_URL = f"{BINANCE_API_BASE_URL}/api/v3/exchangeInfo"
+BINANCE_AGGTRADES_URL = f"{BINANCE_API_BASE_URL}/api/v3/aggTrades"
+BINANCE_TICKER_24H_URL = f"{BINANCE_API_BASE_URL}/api/v3/ticker/24hr"
+
+# Binance caps a klines page at 1000 candles.
+PAGE_LIMIT = 1000
+
+# Request weight of a klines call with limit 1000.
+KLINES_WEIGHT = 2
+
+# Request weight of an exchangeInfo call for every symbol.
+EXCHANGE_INFO_WEIGHT = 20
+
+# Request weight of a 24h ticker call for every symbol.
+TICKER_24H_WEIGHT = 80
+
+# Request weight of an aggTrades call, which also returns at most 1000 trades.
+AGGTRADES_WEIGHT = 2
+
+# aggTrades rejects startTime/endTime windows of an hour or more.
+AGGTRADES_TIME_WINDOW_MS = 3_600_000
+
+INTERVAL_MS = {
+    "1m": 60_000,
+    "5m": 300_000,
+    "15m": 900_000,
+    "1h": 3_600_000,
+    "4h": 14_400_000,
+    "1d": 86_400_000,
+}
+
+RETRYABLE_STATUS_CODES = {418, 429, 500, 502, 503, 504}
+
+class BinanceAPIError(Exception):
+    def __init__(self, status_code: int, text: str):
+        super().__init__(f"Binance API error: {status_code} - {text}")
+        self.status_code = status_code
+
+class FetchStats:
+    """
+    Request and throttling counters for a single activity invocation.
+    """
+
+    def __init__(self):
+        self.request_count = 0
+        self.retry_count = 0
+        self.throttled_seconds = 0.0
+        self.bytes_downloaded = 0
+        self.cache_hits = 0
+        self.latency = telemetry.LatencyHistogram()
+        self._lock = threading.Lock()
+
+    def record(self, retries: int, throttled_seconds: float):
+        with self._lock:
+            self.request_count += 1 + retries
+            self.retry_count += retries
+            self.throttled_seconds += throttled_seconds
+
+    def record_cache_hit(self):
+        with self._lock:
+            self.cache_hits += 1
+
+    def observe_response(self, latency_seconds: float, bytes_downloaded: int):
+        self.latency.observe(latency_seconds)
+        with self._lock:
+            self.bytes_downloaded += bytes_downloaded
+
+    def add_to_telemetry(self):
+        """
+        Fold the counters into the current telemetry invocation, if there is one.
+        """
+        invocation = telemetry.current_invocation()
+        if invocation is None:
+            return
+        invocation.add("requests", self.request_count)
+        invocation.add("retries", self.retry_count)
+        invocation.add("throttled_seconds", self.throttled_seconds)
+        invocation.add("bytes_downloaded", self.bytes_downloaded)
+        invocation.add("page_cache_hits", self.cache_hits)
+        invocation.latency.merge(self.latency)
+
+    def as_dict(self) -> dict:
+        return {
+            "request_count": self.request_count,
+            "retry_count": self.retry_count,
+            "throttled_seconds": round(self.throttled_seconds, 3),
+            "page_cache_hits": self.cache_hits
+        }
+
+def get_fetch_concurrency(params: dict) -> int:
+    """
+    Resolve the page fetch concurrency from the activity params, falling back to
+    the BINANCE_FETCH_CONCURRENCY setting. A value of 1 keeps the sequential walk.
+    """
+    value = params.get("fetch_concurrency") or os.environ.get("BINANCE_FETCH_CONCURRENCY", "1")
+    return max(1, int(value))
+
+def build_page_windows(start_ms: int, end_ms: int, interval: str = "1m", limit: int = PAGE_LIMIT) -> list:
+    """
+    Split [start_ms, end_ms) into fixed sub-ranges of at most `limit` candles each.
+    Binance treats endTime as inclusive, so every window ends 1 ms before the next one starts.
+    """
+    step = INTERVAL_MS[interval] * limit
+    windows = []
+    window_start = start_ms
+    while window_start < end_ms:
+        window_end = min(window_start + step, end_ms)
+        windows.append((window_start, window_end - 1))
+        window_start = window_end
+    return windows
+
+def get_with_retries(session: "requests.Session", url: str, params: dict, weight: int, stats: FetchStats = None) -> "requests.Response":
+    """
+    GET through the shared rate limiter, retrying 429/418/5xx, connection errors and
+    timeouts with jittered exponential backoff. Other 4xx responses fail immediately.
+    """
+    import requests
+    limiter = get_rate_limiter()
+    max_retries = int(os.environ.get("BINANCE_MAX_RETRIES", "5"))
+    # Without a read timeout a half-open connection would hang until the function times out.
+    timeout = (float(os.environ.get("BINANCE_CONNECT_TIMEOUT_SECONDS", "5")), float(os.environ.get("BINANCE_READ_TIMEOUT_SECONDS", "30")))
+    throttled = 0.0
+    attempt = 0
+    while True:
+        throttled += limiter.acquire(weight)
+        started = time.perf_counter()
+        try:
+            response = session.get(url, params=params, timeout=timeout)
+        except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+            if attempt >= max_retries:
+                raise
+            logging.warning(f"Binance client: {type(e).__name__} on attempt {attempt + 1}: {str(e)}")
+            response = None
+        else:
+            limiter.record_response(response)
+            if stats is not None:
+                stats.observe_response(time.perf_counter() - started, len(response.content))
+            if response.status_code == 200:
+                if stats is not None:
+                    stats.record(attempt, throttled)
+                return response
+            if response.status_code not in RETRYABLE_STATUS_CODES or attempt >= max_retries:
+                if stats is not None:
+                    stats.record(attempt, throttled)
+                raise BinanceAPIError(response.status_code, response.text)
+            logging.warning(f"Binance client: Retryable status {response.status_code} on attempt {attempt + 1}")
+
+        # 418/429 are already held back by the limiter's Retry-After; back off the rest.
+        if response is None or response.status_code not in (418, 429):
+            delay = min(30.0, 0.5 * 2 ** attempt) * random.uniform(0.5, 1.0)
+            time.sleep(delay)
+            limiter.add_throttled_time(delay)
+            throttled += delay
+        attempt += 1
+
+def fetch_klines_page(session: "requests.Session", symbol: str, interval: str, start_ms: int, end_ms: int, limit: int = PAGE_LIMIT, stats: FetchStats = None) -> "KlinePage":
+    from kline_storage import KlinePage
+    # Closed pages never change, so one fetched by an earlier (failed) attempt is reused.
+    cache = get_page_cache() if limit == PAGE_LIMIT and is_page_closed(INTERVAL_MS[interval], end_ms) else None
+    cache_key = get_page_key(symbol, interval, start_ms, end_ms)
+    if cache is not None:
+        body = cache.get(cache_key)
+        if body is not None:
+            if stats is not None:
+                stats.record_cache_hit()
+            return KlinePage.from_body(body, symbol)
+
+    params_api = {
+        "symbol": symbol,
+        "interval": interval,
+        "startTime": start_ms,
+        "endTime": end_ms,
+        "limit": limit
+    }
+    try:
+        response = get_with_retries(session, BINANCE_KLINES_URL, params_api, KLINES_WEIGHT, stats)
+    except BinanceAPIError as e:
+        logging.error(f"Binance client: API error for {symbol}: {str(e)}")
+        raise
+    # Decoded straight from the body; response.json() would build 12 Python objects per candle.
+    page = KlinePage.from_body(response.content, symbol)
+    if cache is not None:
+        cache.put(cache_key, response.content)
+    return page
+
+def fetch_exchange_info(stats: FetchStats = None) -> dict:
+    """
+    Symbols, statuses and filters of every market, in one weight-20 request.
+    """
+    response = get_with_retries(get_http_session(), BINANCE_EXCHANGE_INFO_URL, {}, EXCHANGE_INFO_WEIGHT, stats)
+    return response.json()
+
+def fetch_24h_quote_volumes(stats: FetchStats = None) -> dict:
+    """
+    Rolling 24h quote volume of every symbol, in one weight-80 request.
+    """
+    response = get_with_retries(get_http_session(), BINANCE_TICKER_24H_URL, {"type": "MINI"}, TICKER_24H_WEIGHT, stats)
+    return {ticker["symbol"]: float(ticker["quoteVolume"]) for ticker in response.json()}
+
+def iter_kline_pages_sequential(symbol: str, start_ms: int, end_ms: int, interval: str = "1m", stats: FetchStats = None):
+    """
+    Walk the window one page at a time, resuming after the last close_time received.
+    A short page does not end the walk: Binance can return fewer candles than the
+    limit mid-range, so only an empty page or reaching end_ms stops it.
+    """
+    session = get_http_session()
+    current_start = start_ms
+    while current_start < end_ms:
+        klines = fetch_klines_page(session, symbol, interval, current_start, end_ms - 1, stats=stats)
+        if not klines:
+            break
+
+        yield klines
+        current_start = klines.last_close_time + 1
+
+def fetch_window_pages(session: "requests.Session", symbol: str, interval: str, start_ms: int, end_ms: int, stats: FetchStats = None) -> "KlinePage":
+    """
+    Fetch one page window [start_ms, end_ms]. If Binance returns a short page that stops
+    before the window end, the rest of the window is fetched from after its last candle,
+    as the sequential walk does, so no candles of the window are skipped.
+    """
+    from kline_storage import KlinePage
+    pages = []
+    current_start = start_ms
+    while current_start <= end_ms:
+        page = fetch_klines_page(session, symbol, interval, current_start, end_ms, stats=stats)
+        if not page:
+            break
+        pages.append(page)
+        if len(page) >= (end_ms - current_start) // INTERVAL_MS[interval] + 1:
+            break
+        current_start = page.last_close_time + 1
+    return KlinePage.concat(pages, symbol)
+
+def iter_kline_pages_concurrent(symbol: str, start_ms: int, end_ms: int, concurrency: int, interval: str = "1m", stats: FetchStats = None):
+    """
+    Fetch the page windows of [start_ms, end_ms) in parallel over the shared session
+    and yield them in window order. At most 2 x concurrency pages are held at once.
+    """
+    session = get_http_session(concurrency)
+    windows = build_page_windows(start_ms, end_ms, interval)
+    logging.info(f"Binance client: Fetching {len(windows)} pages for {symbol} with concurrency {concurrency}")
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        in_flight = deque()
+        for window in windows:
+            in_flight.append(executor.submit(fetch_window_pages, session, symbol, interval, window[0], window[1], stats=stats))
+            if len(in_flight) >= 2 * concurrency:
+                yield in_flight.popleft().result()
+        while in_flight:
+            yield in_flight.popleft().result()
+
+def iter_kline_pages(symbol: str, start_ms: int, end_ms: int, interval: str = "1m", concurrency: int = 1, stats: FetchStats = None):
+    """
+    Yield pages in open_time order, dropping any candle at or before the last one
+    already yielded so pages stitch together without duplicates.
+    """
+    if concurrency > 1:
+        pages = iter_kline_pages_concurrent(symbol, start_ms, end_ms, concurrency, interval, stats)
+    else:
+        pages = iter_kline_pages_sequential(symbol, start_ms, end_ms, interval, stats)
+
+    last_open_time = None
+    for page in pages:
+        if last_open_time is not None:
+            page = page.drop_through(last_open_time)
+        if len(page):
+            last_open_time = page.last_open_time
+            yield page
+
+def fetch_klines(symbol: str, start_ms: int, end_ms: int, interval: str = "1m", concurrency: int = 1, stats: FetchStats = None) -> "KlinePage":
+    from kline_storage import KlinePage
+    return KlinePage.concat(list(iter_kline_pages(symbol, start_ms, end_ms, interval, concurrency, stats)), symbol)
+
+def fetch_aggtrades_page(session: "requests.Session", symbol: str, params: dict, stats: FetchStats = None) -> "AggTradePage":
+    from aggtrade_storage import AggTradePage
+    response = get_with_retries(session, BINANCE_AGGTRADES_URL, {"symbol": symbol, "limit": PAGE_LIMIT, **params}, AGGTRADES_WEIGHT, stats)
+    return AggTradePage.from_body(response.content)
+
+def find_first_aggtrade_id(session: "requests.Session", symbol: str, from_ms: int, until_ms: int, stats: FetchStats = None) -> int:
+    """
+    Id of the first aggregate trade at or after from_ms, searched an hour at a time up
+    to until_ms. None if there is none in that range.
+    """
+    window_start = from_ms
+    while window_start < until_ms:
+        window_end = min(window_start + AGGTRADES_TIME_WINDOW_MS, until_ms)
+        page = fetch_aggtrades_page(session, symbol, {"startTime": window_start, "endTime": window_end - 1, "limit": 1}, stats)
+        if len(page):
+            return page.first_id
+        window_start = window_end
+    return None
+
+def iter_aggtrade_pages(symbol: str, start_ms: int, end_ms: int, concurrency: int = 1, stats: FetchStats = None):
+    """
+    Yield the aggregate trades of [start_ms, end_ms) in id order, paging by fromId.
+    Ids are consecutive, so once the first ids at start_ms and at end_ms are known the
+    range is split into fixed id windows and fetched like klines pages. If no trade
+    follows end_ms yet, the range is walked page by page until it passes end_ms.
+    """
+    session = get_http_session(concurrency)
+    first_id = find_first_aggtrade_id(session, symbol, start_ms, end_ms, stats)
+    if first_id is None:
+        return
+    end_id = find_first_aggtrade_id(session, symbol, end_ms, end_ms + 24 * AGGTRADES_TIME_WINDOW_MS, stats)
+
+    if end_id is None:
+        from_id = first_id
+        while True:
+            page = fetch_aggtrades_page(session, symbol, {"fromId": from_id}, stats).drop_from_time(end_ms)
+            if not len(page):
+                return
+            yield page
+            if len(page) < PAGE_LIMIT:
+                return
+            from_id = page.last_id + 1
+
+    windows = [(window_start, min(PAGE_LIMIT, end_id - window_start)) for window_start in range(first_id, end_id, PAGE_LIMIT)]
+    logging.info(f"Binance client: Fetching {len(windows)} aggTrades pages for {symbol} with concurrency {concurrency}")
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        in_flight = deque()
+        for window_start, limit in windows:
+            in_flight.append(executor.submit(fetch_aggtrades_page, session, symbol, {"fromId": window_start, "limit": limit}, stats))
+            if len(in_flight) >= 2 * concurrency:
+                yield in_flight.popleft().result()
+        while in_flight:
+            yield in_flight.popleft().result()
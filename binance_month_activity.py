@@ -1,135 +1,248 @@
 import azure.functions as func
 import azure.durable_functions as df
 import logging
-import requests
-import pandas as pd
-import os
 import io
+import os
+import telemetry
 from datetime import datetime, timezone
-from azure.storage.blob import BlobServiceClient
 from dateutil import parser
 from dateutil.relativedelta import relativedelta # Import relativedelta
+from binance_client import FetchStats, get_fetch_concurrency, iter_kline_pages
+from client_registry import get_container_client
+from kline_archive import get_archive_source, iter_archive_pages, iter_archive_then_rest, load_month_archive
+from page_cache import get_page_cache
+from partition_manifest import get_partition_key, update_manifest_partition
 
 bp = func.Blueprint()
 
+def stream_pages_to_partition(writer: "PartitionWriter", pages, trading_pair: str, batch_pages: int) -> int:
+    """
+    Encode pages into the partition writer a batch at a time. Returns the number of rows written.
+    Parquet partitions are typed; CSV rows keep Binance's original strings.
+    """
+    written = 0
+    batch = []
+    pages = iter(pages)
+    while True:
+        # Time spent here is waiting on Binance (or on the rate limiter).
+        with telemetry.span("fetch"):
+            page = next(pages, None)
+        if page is None:
+            break
+        batch.append(page)
+        if len(batch) >= batch_pages:
+            written += write_batch(writer, batch, trading_pair)
+            batch = []
+    if batch:
+        written += write_batch(writer, batch, trading_pair)
+    telemetry.add("rows", written)
+    return written
+
+def write_batch(writer: "PartitionWriter", batch: list, trading_pair: str) -> int:
+    from kline_storage import KlinePage
+    with telemetry.span("build_frame"):
+        page = KlinePage.concat(batch, trading_pair)
+    writer.write_page(page)
+    return len(page)
+
 @bp.activity_trigger(input_name="params")
 def process_binance_month_activity(params: dict) -> dict:
     """
     Fetch data from Binance API and save to ADLS.
-    Handles regeneration by deleting existing files.
+    Regeneration rewrites the month up to now; incremental mode appends only the
+    candles closed since the last persisted close_time.
     """
     trading_pair = params.get("trading_pair")
     # This timestamp tells us which month to process.
     start_timestamp_str = params.get("start_timestamp")
     is_regeneration = params.get("is_regeneration", False)
+    is_incremental = params.get("incremental", False)
     
     logging.info(f"Activity process_binance_month_activity: Starting for {trading_pair} with reference timestamp {start_timestamp_str}")
+    # Imported on first use rather than when function_app is indexed (see benchmarks/import_budget.py).
+    import pyarrow.parquet as pq
+    from azure.core import MatchConditions
+    from kline_storage import (
+        BlockBlobWriter, PartitionWriter, build_partition_metadata, combine_digests, format_digest,
+        get_appendable_blocks, get_blob_path, get_output_format, get_write_conditions, is_partition_unchanged,
+        read_partition_state
+    )
+    fetch_stats = FetchStats()
 
-    try:
-        # --- LOGIC CHANGE ---
-        # The timestamp from the orchestrator now simply indicates the month to be processed.
-        ref_dt = parser.isoparse(start_timestamp_str)
+    with telemetry.invocation("process_binance_month_activity", trading_pair=trading_pair, start_timestamp=start_timestamp_str) as invocation:
+        try:
+            # --- LOGIC CHANGE ---
+            # The timestamp from the orchestrator now simply indicates the month to be processed.
+            ref_dt = parser.isoparse(start_timestamp_str)
 
-        # For a normal monthly run, we process the entire month indicated by ref_dt.
-        # For regeneration, we process from the start of the month up to the current time.
-        start_of_month = ref_dt.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-        
-        if is_regeneration:
-            # For regeneration, the end time is now.
-            end_of_period = datetime.now(timezone.utc)
-        else:
-            # For a historical month, the end time is the start of the *next* month.
-            end_of_period = start_of_month + relativedelta(months=1)
-
-        logging.info(f"Activity process_binance_month_activity: Calculated processing window for {trading_pair}: {start_of_month.isoformat()} to {end_of_period.isoformat()}")
-        # --- END LOGIC CHANGE ---
-
-        # Blob Storage Configuration
-        storage_account_name = os.environ.get("STORAGE_ACCOUNT_NAME")
-        storage_account_key = os.environ.get("STORAGE_ACCOUNT_KEY")
-        connection_string = f"DefaultEndpointsProtocol=https;AccountName={storage_account_name};AccountKey={storage_account_key};EndpointSuffix=core.windows.net"
-        
-        blob_service_client = BlobServiceClient.from_connection_string(connection_string )
-        container_name = "raw"
-        
-        blob_path = f"binance/{trading_pair}/{start_of_month.year}/{start_of_month.month:02d}.csv"
-        
-        if is_regeneration:
-            logging.info(f"Activity process_binance_month_activity: Regeneration mode for {trading_pair}. Deleting existing blob at {blob_path}")
-            try:
-                blob_client = blob_service_client.get_blob_client(container=container_name, blob=blob_path)
-                if blob_client.exists():
-                    blob_client.delete_blob()
-                    logging.info(f"Activity process_binance_month_activity: Successfully deleted {blob_path}")
-            except Exception as e:
-                logging.warning(f"Activity process_binance_month_activity: Failed to delete blob {blob_path}: {str(e)}")
-
-        # Fetch data from Binance
-        all_klines = []
-        # Use the calculated start and end times
-        current_start = int(start_of_month.timestamp() * 1000)
-        end_ms = int(end_of_period.timestamp() * 1000)
-        
-        logging.info(f"Activity process_binance_month_activity: Fetching data from Binance for {trading_pair}")
-        
-        while current_start < end_ms:
-            url = "https://api.binance.com/api/v3/klines"
-            params_api = {
-                "symbol": trading_pair,
-                "interval": "1m",
-                "startTime": current_start,
-                "endTime": end_ms, # Use end_ms, which is the start of the next month
-                "limit": 1000
-            }
-            
-            response = requests.get(url, params=params_api )
-            if response.status_code != 200:
-                logging.error(f"Activity process_binance_month_activity: Binance API error for {trading_pair}: {response.text}")
-                raise Exception(f"Binance API error: {response.status_code} - {response.text}")
-                
-            klines = response.json()
-            if not klines:
-                break
-                
-            all_klines.extend(klines)
-            current_start = klines[-1][6] + 1
-            
-            if len(klines) < 1000:
-                break
-
-        if not all_klines:
-            logging.warning(f"Activity process_binance_month_activity: No new data found for {trading_pair} in the month of {start_of_month.year}-{start_of_month.month:02d}")
-            # We still return a success so the orchestrator can proceed to the next month
-            return {"record_count": 0}
-
-        # Process into DataFrame
-        columns = [
-            'open_time', 'open_price', 'high_price', 'low_price', 'close_price', 
-            'volume', 'close_time', 'quote_asset_volume', 'number_of_trades', 
-            'taker_buy_base_asset_volume', 'taker_buy_quote_asset_volume', 'ignore'
-        ]
-        df_data = pd.DataFrame(all_klines, columns=columns)
-        df_data['trading_pair'] = trading_pair
-        
-        final_cols = [
-            'trading_pair', 'open_time', 'open_price', 'high_price', 'low_price', 
-            'close_price', 'volume', 'close_time', 'quote_asset_volume', 
-            'number_of_trades', 'taker_buy_base_asset_volume', 'taker_buy_quote_asset_volume'
-        ]
-        df_data = df_data[final_cols]
+            # For a normal monthly run, we process the entire month indicated by ref_dt.
+            # For regeneration, we process from the start of the month up to the current time.
+            start_of_month = ref_dt.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
         
-        # Upload to ADLS
-        csv_buffer = io.StringIO()
-        df_data.to_csv(csv_buffer, index=False)
-        
-        logging.info(f"Activity process_binance_month_activity: Uploading {len(df_data)} records for {trading_pair} to {blob_path}")
+            if is_regeneration or is_incremental:
+                # For regeneration, the end time is now.
+                end_of_period = datetime.now(timezone.utc)
+            else:
+                # For a historical month, the end time is the start of the *next* month.
+                end_of_period = start_of_month + relativedelta(months=1)
+
+            logging.info(f"Activity process_binance_month_activity: Calculated processing window for {trading_pair}: {start_of_month.isoformat()} to {end_of_period.isoformat()}")
+            # --- END LOGIC CHANGE ---
+
+            # Blob Storage Configuration
+            container_client = get_container_client("raw")
         
-        blob_client = blob_service_client.get_blob_client(container=container_name, blob=blob_path)
-        blob_client.upload_blob(csv_buffer.getvalue(), overwrite=True)
+            output_format = get_output_format(params)
+            blob_path = get_blob_path(trading_pair, start_of_month.year, start_of_month.month, output_format)
+            blob_client = container_client.get_blob_client(blob_path)
+
+            # Use the calculated start and end times
+            current_start = int(start_of_month.timestamp() * 1000)
+            end_ms = int(end_of_period.timestamp() * 1000)
+            if is_regeneration or is_incremental:
+                # Stop at the start of the current minute so the still-open candle is never persisted.
+                end_ms -= end_ms % 60_000
+            fetch_concurrency = get_fetch_concurrency(params)
+            batch_pages = int(params.get("upload_batch_pages") or os.environ.get("UPLOAD_BATCH_PAGES", "10"))
+
+            # --- INCREMENTAL APPEND ---
+            # Resume after the last persisted close_time and append to the existing partition
+            # with an ETag-conditional commit, so the blob never disappears mid-run.
+            with telemetry.span("plan"):
+                # Full rewrites only need the metadata, to compare against and to condition the commit on.
+                existing_state = read_partition_state(blob_client, output_format, metadata_only=not is_incremental)
+            state = existing_state if is_incremental else None
+            committed_blocks = None
+            existing_frame = None
+            if state is not None:
+                if output_format == "csv":
+                    with telemetry.span("plan"):
+                        committed_blocks = get_appendable_blocks(blob_client)
+                    if committed_blocks is None or state["record_count"] is None or state["content_digest"] is None:
+                        logging.info(f"Activity process_binance_month_activity: {blob_path} cannot be appended to in place. Rewriting the month.")
+                        state = None
+                        committed_blocks = None
+                else:
+                    # Parquet has a footer, so the month is re-encoded; only the new candles are fetched.
+                    with telemetry.span("download"):
+                        data = blob_client.download_blob(etag=state["etag"], match_condition=MatchConditions.IfNotModified).readall()
+                    telemetry.add("bytes_downloaded", len(data))
+                    with telemetry.span("deserialize"):
+                        existing_frame = pq.read_table(io.BytesIO(data)).to_pandas()
+
+            if state is not None:
+                current_start = state["last_close_time"] + 1
+                logging.info(f"Activity process_binance_month_activity: Incremental mode for {trading_pair}. Resuming after close_time {state['last_close_time']} ({state['record_count']} records persisted)")
+                if current_start >= end_ms:
+                    logging.info(f"Activity process_binance_month_activity: {blob_path} is already up to date.")
+                    return {"record_count": state["record_count"], "appended_count": 0, "last_close_time": state["last_close_time"], "written": False, **fetch_stats.as_dict()}
+            # --- END INCREMENTAL APPEND ---
+
+            # Fetch data from Binance and stream it to the blob a batch of pages at a time.
+            # A rewrite that turns out identical to the partition is staged but never committed.
+            sink = BlockBlobWriter(blob_client, committed_blocks=committed_blocks)
+            writer = PartitionWriter(sink, output_format, include_header=committed_blocks is None)
+            if existing_frame is not None:
+                writer.write_frame(existing_frame)
+            base_count = state["record_count"] if state is not None else 0
         
-        logging.info(f"Activity process_binance_month_activity: Successfully uploaded {trading_pair} data.")
+            # A closed month rewritten from scratch comes from the monthly archive where there is one;
+            # REST only fills in what the archive does not cover.
+            archive = None
+            source_counts = {}
+            archive_source = get_archive_source() if params.get("use_archive", True) else None
+            if archive_source is not None and state is None and not (is_regeneration or is_incremental):
+                with telemetry.span("download"):
+                    archive = load_month_archive(archive_source, trading_pair, start_of_month.year, start_of_month.month)
+            if archive is not None:
+                archive_name, archive_data = archive
+                logging.info(f"Activity process_binance_month_activity: Importing {archive_name} ({len(archive_data)} bytes) from {archive_source} and streaming to {blob_path}")
+                pages = iter_archive_then_rest(iter_archive_pages(archive_data, archive_name, trading_pair), trading_pair, current_start, end_ms, "1m", fetch_concurrency, fetch_stats, source_counts)
+            else:
+                logging.info(f"Activity process_binance_month_activity: Fetching data from Binance for {trading_pair} (concurrency {fetch_concurrency}) and streaming to {blob_path}")
+                pages = iter_kline_pages(trading_pair, current_start, end_ms, interval="1m", concurrency=fetch_concurrency, stats=fetch_stats)
+            appended_count = stream_pages_to_partition(writer, pages, trading_pair, batch_pages)
+            archive_count = source_counts.get("archive", 0)
+            invocation.add("archive_rows", archive_count)
+            logging.info(f"Activity process_binance_month_activity: Fetch stats for {trading_pair}: {fetch_stats.as_dict()}, {archive_count} rows from the archive")
+            page_cache = get_page_cache()
+
+            # Pages are de-duplicated and in order, so any shortfall against the 1m grid is missing minutes.
+            missing_minutes = (end_ms - current_start) // 60_000 - appended_count if state is None else None
+            if missing_minutes:
+                logging.warning(f"Activity process_binance_month_activity: {blob_path} is missing {missing_minutes} minutes. Run the repair orchestrator to refetch only the gaps.")
+
+            # A full historical month is final; the current month keeps growing.
+            is_complete = not (is_regeneration or is_incremental)
+            partition_key = get_partition_key(start_of_month.year, start_of_month.month)
+
+            if appended_count == 0:
+                # Nothing new was committed, so the existing blob (if any) is left untouched.
+                logging.warning(f"Activity process_binance_month_activity: No new data found for {trading_pair} in the month of {start_of_month.year}-{start_of_month.month:02d}")
+                if is_complete:
+                    # Record the empty month (e.g. before the pair was listed) so planning moves past it.
+                    update_manifest_partition(container_client, trading_pair, partition_key, {
+                        "path": None, "format": output_format, "record_count": 0, "complete": True
+                    })
+                if page_cache is not None:
+                    page_cache.discard(trading_pair, "1m", current_start, end_ms)
+                # We still return a success so the orchestrator can proceed to the next month
+                return {
+                    "record_count": base_count,
+                    "appended_count": 0,
+                    "last_close_time": state["last_close_time"] if state is not None else None,
+                    "written": False,
+                    **fetch_stats.as_dict()
+                }
+
+            # Committing the block list publishes the month atomically. Appends only commit
+            # if nobody else changed the blob since its state was read.
+            record_count = base_count + appended_count
+            if committed_blocks is not None:
+                # Appended blocks extend what is already in the blob.
+                first_open_time = state["first_open_time"]
+                content_digest = combine_digests(state["content_digest"], writer.content_digest)
+            else:
+                first_open_time = writer.first_open_time
+                content_digest = writer.content_digest
+            writer.close()
+            written = not (state is None and is_partition_unchanged(existing_state, record_count, content_digest))
+            if written:
+                sink.close(metadata=build_partition_metadata(record_count, first_open_time, writer.last_open_time, writer.last_close_time, content_digest), **get_write_conditions(existing_state))
+                logging.info(f"Activity process_binance_month_activity: Successfully uploaded {appended_count} new records ({sink.bytes_written} bytes in {len(sink.block_ids)} blocks) for {trading_pair} to {blob_path}. Partition now holds {record_count} records.")
+                size = (state["size"] if committed_blocks is not None else 0) + sink.bytes_written
+            else:
+                sink.discard()
+                logging.info(f"Activity process_binance_month_activity: {blob_path} already holds these {record_count} records (digest {format_digest(content_digest)}). Skipped the upload.")
+                size = existing_state["size"]
+            invocation.add("partitions_written" if written else "partitions_skipped")
+
+            with telemetry.span("manifest"):
+                update_manifest_partition(container_client, trading_pair, partition_key, {
+                    "path": blob_path,
+                    "format": output_format,
+                    "record_count": record_count,
+                    "min_open_time": first_open_time,
+                    "max_open_time": writer.last_open_time,
+                    "max_close_time": writer.last_close_time,
+                    "size": size,
+                    "checksum": format_digest(content_digest),
+                    "missing_minutes": missing_minutes,
+                    "complete": is_complete
+                })
+            # The month is committed, so the pages staged for a retry are no longer needed.
+            if page_cache is not None:
+                page_cache.discard(trading_pair, "1m", current_start, end_ms)
         
-        return {"record_count": len(df_data)}
-    except Exception as e:
-        logging.error(f"Activity process_binance_month_activity: Error processing {trading_pair}: {str(e)}")
-        raise
+            invocation.set(record_count=record_count, appended_count=appended_count, output_format=output_format, written=written)
+            return {"record_count": record_count, "appended_count": appended_count, "archive_count": archive_count, "last_close_time": writer.last_close_time, "missing_minutes": missing_minutes, "written": written, **fetch_stats.as_dict()}
+        except Exception as e:
+            logging.error(f"Activity process_binance_month_activity: Error processing {trading_pair}: {str(e)}")
+            if params.get("return_errors", False):
+                # Fan-out callers inspect each month's result instead of failing the whole batch.
+                invocation.status = "error"
+                invocation.set(error=str(e))
+                return {"record_count": -1, "error": str(e)}
+            raise
+        finally:
+            fetch_stats.add_to_telemetry()
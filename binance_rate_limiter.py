@@ -0,0 +1,95 @@
+import logging
+import os
+import threading
+import time
+
+# Binance resets request weight on each wall-clock minute.
+WEIGHT_WINDOW_SECONDS = 60
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+class BinanceRateLimiter:
+    """
+    Weight budget shared by every fetcher in this worker.
+
+    Binance counts weight per IP, so the X-MBX-USED-WEIGHT-1M header on each response
+    already includes what other workers on the same host spent; the limiter folds it
+    into its own count so they all back off together.
+    """
+
+    def __init__(self, weight_limit: int = 6000, budget_ratio: float = 0.8):
+        self.weight_budget = int(weight_limit * budget_ratio)
+        self.used_weight = 0
+        self.window_start = self._current_window()
+        self.banned_until = 0.0
+        self.throttled_seconds = 0.0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _current_window() -> float:
+        now = time.time()
+        return now - (now % WEIGHT_WINDOW_SECONDS)
+
+    def _roll_window(self):
+        window = self._current_window()
+        if window != self.window_start:
+            self.window_start = window
+            self.used_weight = 0
+
+    def acquire(self, weight: int) -> float:
+        """
+        Block until `weight` fits in the current minute's budget and no Retry-After
+        is pending. Returns the seconds spent waiting.
+        """
+        waited = 0.0
+        while True:
+            with self._lock:
+                self._roll_window()
+                now = time.time()
+                if now < self.banned_until:
+                    delay = self.banned_until - now
+                elif self.used_weight + weight <= self.weight_budget:
+                    self.used_weight += weight
+                    self.throttled_seconds += waited
+                    return waited
+                else:
+                    delay = self.window_start + WEIGHT_WINDOW_SECONDS - now
+            delay = max(delay, 0.05)
+            logging.info(f"Binance rate limiter: Throttling for {delay:.2f}s (used weight {self.used_weight}/{self.weight_budget})")
+            time.sleep(delay)
+            waited += delay
+
+    def record_response(self, response) -> None:
+        """
+        Reconcile the budget with the weight Binance reports and honour Retry-After
+        on 429 (rate limited) and 418 (IP banned) responses.
+        """
+        used_header = response.headers.get("X-MBX-USED-WEIGHT-1M")
+        with self._lock:
+            self._roll_window()
+            if used_header is not None:
+                self.used_weight = max(self.used_weight, int(used_header))
+
+            if response.status_code in (418, 429):
+                retry_after = response.headers.get("Retry-After")
+                delay = float(retry_after) if retry_after else WEIGHT_WINDOW_SECONDS
+                self.banned_until = max(self.banned_until, time.time() + delay)
+                logging.warning(f"Binance rate limiter: Received {response.status_code}, backing off for {delay:.0f}s")
+
+    def add_throttled_time(self, seconds: float) -> None:
+        with self._lock:
+            self.throttled_seconds += seconds
+
+def get_rate_limiter() -> BinanceRateLimiter:
+    """
+    Process-wide limiter, sized from BINANCE_WEIGHT_LIMIT_PER_MINUTE and BINANCE_WEIGHT_BUDGET_RATIO.
+    """
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            _limiter = BinanceRateLimiter(
+                weight_limit=int(os.environ.get("BINANCE_WEIGHT_LIMIT_PER_MINUTE", "6000")),
+                budget_ratio=float(os.environ.get("BINANCE_WEIGHT_BUDGET_RATIO", "0.8"))
+            )
+        return _limiter
@@ -0,0 +1,159 @@
+import logging
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+import telemetry
+
+# Clients cached for the lifetime of the worker process so warm invocations skip
+# TLS/TDS handshakes and AAD token round trips. The SDKs behind them are imported on
+# first use, so function_app can be indexed without loading any of them.
+
+MANAGEMENT_SCOPE = "https://management.azure.com/.default"
+
+# Tokens are refreshed this many seconds before they expire.
+TOKEN_REFRESH_MARGIN_SECONDS = 300
+
+# Pooled ODBC connections idle for longer than this are health-checked before reuse.
+SQL_HEALTH_CHECK_IDLE_SECONDS = 60
+
+_lock = threading.Lock()
+# Token refreshes are network round trips, so they never hold _lock.
+_token_lock = threading.Lock()
+_http_session = None
+_http_pool_size = 0
+_blob_service_client = None
+_container_clients = {}
+_credential = None
+_tokens = {}
+_sql_pool = queue.LifoQueue()
+_sql_connection_factory = None
+
+def get_http_session(pool_size: int = 10) -> "requests.Session":
+    """
+    Keep-alive session shared by every Binance fetch in this worker, with room for at
+    least `pool_size` concurrent connections. A caller asking for more than the current
+    session holds gets a new, larger one; sessions already handed out keep working.
+    """
+    global _http_session, _http_pool_size
+    with _lock:
+        if _http_session is None or pool_size > _http_pool_size:
+            import requests
+            from requests.adapters import HTTPAdapter
+            pool_maxsize = max(pool_size, _http_pool_size, int(os.environ.get("BINANCE_FETCH_CONCURRENCY", "1")), 10)
+            session = requests.Session()
+            session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize))
+            _http_session = session
+            _http_pool_size = pool_maxsize
+        return _http_session
+
+def get_blob_service_client() -> "BlobServiceClient":
+    global _blob_service_client
+    with _lock:
+        if _blob_service_client is None:
+            from azure.storage.blob import BlobServiceClient
+            # STORAGE_CONNECTION_STRING points the pipeline at another endpoint, e.g. Azurite.
+            connection_string = os.environ.get("STORAGE_CONNECTION_STRING")
+            if not connection_string:
+                storage_account_name = os.environ.get("STORAGE_ACCOUNT_NAME")
+                storage_account_key = os.environ.get("STORAGE_ACCOUNT_KEY")
+                connection_string = f"DefaultEndpointsProtocol=https;AccountName={storage_account_name};AccountKey={storage_account_key};EndpointSuffix=core.windows.net"
+            _blob_service_client = BlobServiceClient.from_connection_string(connection_string)
+        return _blob_service_client
+
+def get_container_client(container_name: str):
+    service_client = get_blob_service_client()
+    with _lock:
+        if container_name not in _container_clients:
+            _container_clients[container_name] = service_client.get_container_client(container_name)
+        return _container_clients[container_name]
+
+def get_credential():
+    global _credential
+    with _lock:
+        if _credential is None:
+            # Imported here so workers that never talk to Azure management skip the import.
+            from azure.identity import DefaultAzureCredential
+            _credential = DefaultAzureCredential()
+        return _credential
+
+def get_access_token(scope: str = MANAGEMENT_SCOPE) -> str:
+    """
+    Bearer token for `scope`, reused until shortly before it expires.
+    """
+    token = _tokens.get(scope)
+    if token is not None and token.expires_on - TOKEN_REFRESH_MARGIN_SECONDS > time.time():
+        return token.token
+    credential = get_credential()
+    with _token_lock:
+        # Another thread may have refreshed it while this one waited.
+        token = _tokens.get(scope)
+        if token is None or token.expires_on - TOKEN_REFRESH_MARGIN_SECONDS <= time.time():
+            token = credential.get_token(scope)
+            _tokens[scope] = token
+        return token.token
+
+def set_sql_connection_factory(factory) -> None:
+    """
+    Open SQL connections with `factory()` instead of pyodbc. The benchmark harness uses
+    this to run the tracking activities against a local stand-in.
+    """
+    global _sql_connection_factory
+    _sql_connection_factory = factory
+
+def _sql_connection_is_healthy(conn) -> bool:
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT 1")
+            cursor.fetchone()
+        return True
+    except Exception as e:
+        logging.warning(f"Client registry: Discarding unhealthy SQL connection: {str(e)}")
+        return False
+
+def _checkout_sql_connection():
+    while True:
+        try:
+            conn, returned_at = _sql_pool.get_nowait()
+        except queue.Empty:
+            break
+        if time.time() - returned_at < SQL_HEALTH_CHECK_IDLE_SECONDS or _sql_connection_is_healthy(conn):
+            return conn
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    if _sql_connection_factory is not None:
+        return _sql_connection_factory()
+
+    conn_str = os.getenv("SYNAPSE_CONNECTION_STRING")
+    if not conn_str:
+        raise ValueError("SYNAPSE_CONNECTION_STRING environment variable is not set.")
+    # Imported here so workers that never touch Synapse don't need the ODBC driver loaded.
+    import pyodbc
+    return pyodbc.connect(conn_str)
+
+@contextmanager
+def sql_connection():
+    """
+    Check out a pooled ODBC connection. It is committed and returned to the pool on
+    success, and closed on error so a broken session is never reused.
+    """
+    with telemetry.span("sql_connect"):
+        conn = _checkout_sql_connection()
+    try:
+        with telemetry.span("sql"):
+            yield conn
+            conn.commit()
+    except Exception:
+        try:
+            conn.close()
+        except Exception:
+            pass
+        raise
+    if _sql_pool.qsize() < int(os.environ.get("SQL_POOL_SIZE", "4")):
+        _sql_pool.put((conn, time.time()))
+    else:
+        conn.close()
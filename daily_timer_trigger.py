@@ -2,6 +2,9 @@ import azure.functions as func
 import azure.durable_functions as df
 import logging
 import datetime
+import os
+from dateutil import parser
+from binance_client import KLINES_WEIGHT, PAGE_LIMIT
 
 bp = func.Blueprint()
 
@@ -10,16 +13,11 @@ bp = func.Blueprint()
 async def daily_timer_trigger(timer: func.TimerRequest, client: df.DurableOrchestrationClient) -> None:
     """
     Automated daily timer trigger at 06:30 AM UTC (12:00 PM IST).
-    Processes all configured trading pairs.
+    Processes every pair of the trading-pair universe (see pair_universe).
     """
     if timer.past_due:
         logging.info("The timer is running late!")
 
-    # --- CORRECTED LINE ---
-    # Changed "MATIUSDT" to the correct symbol "MATICUSDT"
-    trading_pairs = ["BTCUSDT", "ETHUSDT", "SOLUSDT", "LINKUSDT", "MATICUSDT"]
-    # --------------------
-
     instance_id_prefix = "daily-timer"
     
     main_instance_id = f"{instance_id_prefix}-main"
@@ -29,49 +27,190 @@ async def daily_timer_trigger(timer: func.TimerRequest, client: df.DurableOrches
         logging.warning(f"Previous timer execution {main_instance_id} is still running. Skipping this run.")
         return
 
-    await client.start_new("timer_main_orchestrator", main_instance_id, {"trading_pairs": trading_pairs})
+    await client.start_new("timer_main_orchestrator", main_instance_id, {
+        "backfill_parallelism": int(os.environ.get("BACKFILL_PARALLELISM", "1")),
+        "max_concurrent_pairs": int(os.environ.get("MAX_CONCURRENT_PAIRS", "8")),
+        "weight_budget": int(os.environ.get("RUN_WEIGHT_BUDGET", "100000")),
+        "load_synapse": os.environ.get("SYNAPSE_LOAD_ENABLED", "true").lower() == "true",
+        "load_parallelism": int(os.environ.get("SYNAPSE_LOAD_PARALLELISM", "4")),
+        "aggtrades_pairs": [pair.strip().upper() for pair in os.environ.get("AGGTRADES_PAIRS", "").split(",") if pair.strip()],
+        "aggtrades_max_days": int(os.environ.get("AGGTRADES_MAX_DAYS_PER_RUN", "7")),
+        "aggtrades_lookback_days": int(os.environ.get("AGGTRADES_LOOKBACK_DAYS", "7"))
+    })
     
     logging.info(f"Started daily timer orchestration with ID = '{main_instance_id}'.")
 
+def estimate_backlog_weight(last_processed_str: str, current_utc_now: datetime.datetime) -> int:
+    """
+    Binance request weight needed to catch a pair up from its watermark: one klines
+    page per PAGE_LIMIT minutes behind.
+    """
+    minutes_behind = max(0, int((current_utc_now - parser.isoparse(last_processed_str)).total_seconds() // 60))
+    return -(-minutes_behind // PAGE_LIMIT) * KLINES_WEIGHT
+
+def plan_pair_schedule(watermarks: dict, current_utc_now: datetime.datetime, weight_budget: int, guarantee_progress: bool = True) -> tuple:
+    """
+    Order pairs largest backlog first and admit them while their estimated weight fits
+    the remaining budget. Pairs that don't fit are deferred to the next run. With
+    guarantee_progress the largest pair is admitted regardless, so a backlog bigger than
+    the whole budget still progresses.
+    Returns (scheduled [(pair, weight)], deferred [pair], weight left).
+    """
+    backlog = sorted(((pair, estimate_backlog_weight(watermark, current_utc_now)) for pair, watermark in watermarks.items()),
+                     key=lambda item: (-item[1], item[0]))
+    scheduled, deferred = [], []
+    for pair, weight in backlog:
+        if weight <= weight_budget or (guarantee_progress and not scheduled):
+            scheduled.append((pair, weight))
+            weight_budget -= weight
+        else:
+            deferred.append(pair)
+    return scheduled, deferred, weight_budget
+
+def run_pair_window(context: df.DurableOrchestrationContext, pair_inputs: list, max_concurrent: int, companion_task=None, orchestrator_name: str = "hybrid_orchestrator"):
+    """
+    Run orchestrator_name for every input with at most max_concurrent in flight, starting
+    the next one as soon as any finishes. companion_task, if given, is awaited alongside.
+    Use with `yield from`; returns (results in input order, companion result).
+    """
+    results = [None] * len(pair_inputs)
+    in_flight = {}
+    next_index = 0
+    companion_result = None
+    while next_index < len(pair_inputs) or in_flight or companion_task is not None:
+        while next_index < len(pair_inputs) and len(in_flight) < max_concurrent:
+            in_flight[context.call_sub_orchestrator(orchestrator_name, pair_inputs[next_index])] = next_index
+            next_index += 1
+        waiting = list(in_flight) + ([companion_task] if companion_task is not None else [])
+        finished = yield context.task_any(waiting)
+        if finished is companion_task:
+            companion_result = finished.result
+            companion_task = None
+        else:
+            results[in_flight.pop(finished)] = finished.result
+    return results, companion_result
+
 @bp.orchestration_trigger(context_name="context")
 def timer_main_orchestrator(context: df.DurableOrchestrationContext):
     """
-    Main orchestrator for timer trigger to handle sequential steps:
-    Resume Synapse -> Process all pairs in parallel -> Pause Synapse
+    Main orchestrator for the timer trigger:
+    Resolve the pair universe -> Plan from the partition manifests -> (Resume Synapse || Ingest pending pairs) -> Batch tracking update -> Load changed months -> Pause Synapse
+    Fetching and uploading don't need the pool, so they run while it resumes; only the
+    tracking writes and the fact table load wait for it to come Online. On days with
+    nothing to ingest the pool is never resumed. Pairs run largest backlog first, at most
+    max_concurrent_pairs at a time, until the run's Binance weight budget is spent.
+    The aggtrades_pairs then get up to aggtrades_max_days days of aggTrades each; a new
+    one starts aggtrades_lookback_days closed days back.
     """
     input_data = context.get_input()
-    trading_pairs = input_data.get("trading_pairs", [])
+    backfill_parallelism = input_data.get("backfill_parallelism", 1)
+    # At least one pair has to be in flight, or run_pair_window would wait forever.
+    max_concurrent_pairs = max(1, int(input_data.get("max_concurrent_pairs", 8)))
+    weight_budget = input_data.get("weight_budget", 100000)
+    load_synapse = input_data.get("load_synapse", True)
+    load_parallelism = input_data.get("load_parallelism", 4)
+    aggtrades_pairs = input_data.get("aggtrades_pairs") or []
+    aggtrades_max_days = input_data.get("aggtrades_max_days", 7)
+    aggtrades_lookback_days = input_data.get("aggtrades_lookback_days", 7)
     instance_id = context.instance_id
 
-    logging.info(f"Timer Orchestrator {instance_id}: Starting daily process for {len(trading_pairs)} pairs.")
-
+    synapse_resumed = False
     try:
-        # 1. Resume Synapse SQL Pool
-        logging.info(f"Timer Orchestrator {instance_id}: Resuming Synapse SQL Pool.")
-        resume_status = yield context.call_activity("resume_synapse_activity", None)
-        
+        trading_pairs = input_data.get("trading_pairs")
+        if not trading_pairs:
+            trading_pairs = yield context.call_activity("get_trading_pair_universe_activity", {})
+
+        logging.info(f"Timer Orchestrator {instance_id}: Starting daily process for {len(trading_pairs)} pairs.")
+
+        current_utc_now = context.current_utc_datetime.replace(tzinfo=datetime.timezone.utc)
+        # The newest candle that can be closed by now opened a minute before the current minute.
+        last_closed_open = current_utc_now.replace(second=0, microsecond=0) - datetime.timedelta(minutes=1)
+
+        # 1. Plan from the blob manifests. Pairs without a manifest still need the tracking table.
+        manifest_watermarks = yield context.call_activity("get_manifest_watermarks_activity", trading_pairs)
+        unplanned_pairs = [pair for pair in trading_pairs if not manifest_watermarks.get(pair)]
+        pending_watermarks = {pair: manifest_watermarks[pair] for pair in trading_pairs
+                              if manifest_watermarks.get(pair) and parser.isoparse(manifest_watermarks[pair]) <= last_closed_open}
+
+        if not unplanned_pairs and not pending_watermarks and not aggtrades_pairs:
+            logging.info(f"Timer Orchestrator {instance_id}: Every pair is up to date according to its manifest. Leaving Synapse paused.")
+            return "Success: nothing to ingest"
+
+        scheduled, deferred_pairs, weight_budget = plan_pair_schedule(pending_watermarks, current_utc_now, weight_budget)
+
+        # 2. Resume Synapse SQL Pool and, in parallel, ingest every pair the manifests say is behind.
+        logging.info(f"Timer Orchestrator {instance_id}: Resuming Synapse SQL Pool while ingesting {len(scheduled)} pairs ({len(deferred_pairs)} deferred by the weight budget).")
+        resume_task = context.call_sub_orchestrator("synapse_pool_orchestrator", {"target_status": "Online"})
+        synapse_resumed = True
+        pair_inputs = [{
+            "trading_pair": pair,
+            "backfill_parallelism": backfill_parallelism,
+            "last_processed_timestamp": pending_watermarks[pair],
+            "planning_source": "manifest",
+            "defer_tracking": True
+        } for pair, _ in scheduled]
+
+        results, resume_status = yield from run_pair_window(context, pair_inputs, max_concurrent_pairs, resume_task)
+
         if resume_status != "Online":
             logging.error(f"Timer Orchestrator {instance_id}: Synapse resume failed. Status: {resume_status}. Aborting.")
+            yield context.call_sub_orchestrator("synapse_pool_orchestrator", {"target_status": "Paused"})
             return f"Failed: Synapse resume failed ({resume_status})"
 
-        # 2. Process all trading pairs
-        tasks = []
-        for pair in trading_pairs:
-            tasks.append(context.call_sub_orchestrator("hybrid_orchestrator", {"trading_pair": pair}))
-        
-        yield context.task_all(tasks)
-        logging.info(f"Timer Orchestrator {instance_id}: All trading pairs processed.")
+        # 3. Pairs without a manifest are planned from the tracking table, read in one query,
+        # and scheduled against whatever budget is left.
+        if unplanned_pairs:
+            watermarks = yield context.call_activity("get_last_timestamps_activity", unplanned_pairs)
+            unplanned_scheduled, unplanned_deferred, weight_budget = plan_pair_schedule(watermarks, current_utc_now, weight_budget, guarantee_progress=not scheduled)
+            deferred_pairs.extend(unplanned_deferred)
+            logging.info(f"Timer Orchestrator {instance_id}: Running hybrid orchestrator for {len(unplanned_scheduled)} pairs without a manifest.")
+            unplanned_inputs = [{
+                "trading_pair": pair,
+                "backfill_parallelism": backfill_parallelism,
+                "last_processed_timestamp": watermarks[pair],
+                "defer_tracking": True
+            } for pair, _ in unplanned_scheduled]
+            unplanned_results, _ = yield from run_pair_window(context, unplanned_inputs, max_concurrent_pairs)
+            results.extend(unplanned_results)
+        if aggtrades_pairs:
+            # aggTrades watermarks live in the tracking table under RAW_AGGTRADES, so they wait for the pool too.
+            logging.info(f"Timer Orchestrator {instance_id}: Ingesting up to {aggtrades_max_days} days of aggTrades for {len(aggtrades_pairs)} pairs.")
+            aggtrades_inputs = [{
+                "trading_pair": pair,
+                "parallelism": backfill_parallelism,
+                "max_days": aggtrades_max_days,
+                "lookback_days": aggtrades_lookback_days,
+                "defer_tracking": True
+            } for pair in aggtrades_pairs]
+            aggtrades_results, _ = yield from run_pair_window(context, aggtrades_inputs, max_concurrent_pairs, orchestrator_name="aggtrades_orchestrator")
+            results.extend(aggtrades_results)
+        if deferred_pairs:
+            logging.warning(f"Timer Orchestrator {instance_id}: Weight budget spent; deferred {len(deferred_pairs)} pairs to the next run: {', '.join(deferred_pairs)}")
+        logging.info(f"Timer Orchestrator {instance_id}: All scheduled trading pairs processed.")
+
+        tracking_updates = [result["tracking_update"] for result in results if isinstance(result, dict) and result.get("tracking_update")]
+        if tracking_updates:
+            logging.info(f"Timer Orchestrator {instance_id}: Writing {len(tracking_updates)} tracking updates in one batch.")
+            yield context.call_activity("update_tracking_batch_activity", tracking_updates)
+
+        # 4. The pool is Online anyway: swap the months the uploads changed into the fact table.
+        if load_synapse:
+            load_summary = yield context.call_sub_orchestrator("synapse_load_orchestrator", {"parallelism": load_parallelism})
+            logging.info(f"Timer Orchestrator {instance_id}: Loaded {load_summary['loaded_months']} months ({load_summary['loaded_rows']} rows) into Synapse.")
+            if load_summary.get("failed_months"):
+                logging.warning(f"Timer Orchestrator {instance_id}: {len(load_summary['failed_months'])} months failed to load into Synapse: {load_summary['failed_months']}")
 
-        # 3. Pause Synapse SQL Pool
+        # 5. Pause Synapse SQL Pool
         logging.info(f"Timer Orchestrator {instance_id}: Pausing Synapse SQL Pool.")
-        pause_status = yield context.call_activity("pause_synapse_activity", None)
+        pause_status = yield context.call_sub_orchestrator("synapse_pool_orchestrator", {"target_status": "Paused"})
         
         logging.info(f"Timer Orchestrator {instance_id}: Daily process completed. Synapse status: {pause_status}")
         return "Success"
     except Exception as e:
         error_message = f"Timer Orchestrator {instance_id}: Main orchestrator failed: {str(e)}"
         logging.error(error_message)
-        # Attempt to pause Synapse even if processing fails to avoid leaving it running
-        logging.info(f"Timer Orchestrator {instance_id}: Attempting to pause Synapse after failure.")
-        yield context.call_activity("pause_synapse_activity", None)
+        if synapse_resumed:
+            # Attempt to pause Synapse even if processing fails to avoid leaving it running
+            logging.info(f"Timer Orchestrator {instance_id}: Attempting to pause Synapse after failure.")
+            yield context.call_sub_orchestrator("synapse_pool_orchestrator", {"target_status": "Paused"})
         return error_message
@@ -0,0 +1,153 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from kline_storage import MS_PER_DAY
+
+def get_feature_columns(ema_spans: list, volatility_windows: list) -> list:
+    return (
+        ['trading_pair', 'open_time', 'close_time', 'close_price', 'log_return', 'vwap']
+        + [f'volatility_{window}' for window in volatility_windows]
+        + [f'ema_{span}' for span in ema_spans]
+    )
+
+def get_feature_schema(ema_spans: list, volatility_windows: list) -> "pa.Schema":
+    fields = [('trading_pair', pa.string()), ('open_time', pa.int64()), ('close_time', pa.int64())]
+    fields += [(name, pa.float64()) for name in get_feature_columns(ema_spans, volatility_windows)[3:]]
+    return pa.schema(fields)
+
+def new_feature_state(ema_spans: list, volatility_windows: list) -> dict:
+    """
+    State before a pair's first candle. Everything a feature needs from earlier candles
+    lives here, so each run only computes the candles after last_open_time:
+    the previous close (returns), the last len(window) - 1 returns (volatility, None for
+    a missing return so the state stays strict JSON), the running sums of the current
+    UTC day (VWAP) and each EMA's last value.
+    """
+    return {
+        "ema_spans": list(ema_spans),
+        "volatility_windows": list(volatility_windows),
+        "last_open_time": None,
+        "last_close": None,
+        "return_tail": [],
+        "vwap_day": None,
+        "vwap_quote_volume": 0.0,
+        "vwap_volume": 0.0,
+        "ema": {},
+    }
+
+def compute_log_returns(close: np.ndarray, last_close: float) -> np.ndarray:
+    """
+    ln(close / previous close); the previous close of the first candle comes from the state.
+    """
+    previous = np.empty_like(close)
+    previous[0] = np.nan if last_close is None else last_close
+    previous[1:] = close[:-1]
+    return np.log(close / previous)
+
+def rolling_std(values: np.ndarray, tail: np.ndarray, window: int) -> np.ndarray:
+    """
+    Sample standard deviation of each trailing `window` of values, with `tail` (the
+    values before the first one) completing the early windows. Windows that are short
+    or hold a NaN are NaN. Computed from cumulative sums, so the cost is linear in the
+    number of values whatever the window.
+    """
+    series = np.concatenate([tail, values])
+    valid = np.isfinite(series)
+    centred = np.where(valid, series, 0.0)
+    # Centring keeps the differences of the squared sums well away from cancellation.
+    if valid.any():
+        centred = np.where(valid, centred - centred[valid].mean(), 0.0)
+    sums = np.concatenate([[0.0], np.cumsum(centred)])
+    squares = np.concatenate([[0.0], np.cumsum(centred * centred)])
+    counts = np.concatenate([[0], np.cumsum(valid)])
+
+    ends = np.arange(len(tail) + 1, len(series) + 1)
+    starts = np.maximum(ends - window, 0)
+    total = sums[ends] - sums[starts]
+    variance = (squares[ends] - squares[starts] - total * total / window) / (window - 1)
+    complete = (ends - window >= 0) & (counts[ends] - counts[starts] == window)
+    return np.where(complete, np.sqrt(np.maximum(variance, 0.0)), np.nan)
+
+def session_vwap(open_time: np.ndarray, quote_volume: np.ndarray, volume: np.ndarray, state: dict) -> tuple:
+    """
+    Volume-weighted average price since the start of each candle's UTC day, continuing
+    the state's running sums when the first candle is on the same day. Returns the VWAPs
+    and the day's sums after the last candle.
+    """
+    day = open_time // MS_PER_DAY
+    day_start = np.concatenate([[True], day[1:] != day[:-1]])
+    session = np.cumsum(day_start) - 1
+    first = np.flatnonzero(day_start)
+
+    cumulative_quote = np.cumsum(quote_volume)
+    cumulative_volume = np.cumsum(volume)
+    session_quote = cumulative_quote - (cumulative_quote - quote_volume)[first][session]
+    session_volume = cumulative_volume - (cumulative_volume - volume)[first][session]
+    if state["vwap_day"] == int(day[0]):
+        same_day = session == 0
+        session_quote[same_day] += state["vwap_quote_volume"]
+        session_volume[same_day] += state["vwap_volume"]
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        vwap = np.where(session_volume > 0, session_quote / session_volume, np.nan)
+    return vwap, int(day[-1]), float(session_quote[-1]), float(session_volume[-1])
+
+def compute_ema(close: np.ndarray, span: int, last_ema: float) -> np.ndarray:
+    """
+    Exponential moving average with alpha = 2 / (span + 1). The state's last value is
+    prepended as the seed, so the recursion continues exactly where the last run stopped.
+    """
+    if last_ema is None:
+        return pd.Series(close).ewm(span=span, adjust=False).mean().to_numpy()
+    return pd.Series(np.concatenate([[last_ema], close])).ewm(span=span, adjust=False).mean().to_numpy()[1:]
+
+def compute_features(df_data: pd.DataFrame, state: dict, trading_pair: str) -> tuple:
+    """
+    Features of the candles in `df_data` (sorted 1m candles after state["last_open_time"])
+    and the state after the last of them. Returns (features frame, new state).
+    """
+    ema_spans = state["ema_spans"]
+    volatility_windows = state["volatility_windows"]
+    columns = get_feature_columns(ema_spans, volatility_windows)
+    if df_data.empty:
+        return pd.DataFrame(columns=columns), state
+
+    open_time = df_data['open_time'].to_numpy(dtype=np.int64)
+    close = df_data['close_price'].to_numpy(dtype=np.float64)
+    returns = compute_log_returns(close, state["last_close"])
+    # Missing returns are saved as null (None), which float64 reads back as NaN.
+    tail = np.array(state["return_tail"], dtype=np.float64)
+    vwap, vwap_day, vwap_quote_volume, vwap_volume = session_vwap(
+        open_time, df_data['quote_asset_volume'].to_numpy(dtype=np.float64), df_data['volume'].to_numpy(dtype=np.float64), state
+    )
+
+    features = {
+        'trading_pair': trading_pair,
+        'open_time': open_time,
+        'close_time': df_data['close_time'].to_numpy(dtype=np.int64),
+        'close_price': close,
+        'log_return': returns,
+        'vwap': vwap,
+    }
+    for window in volatility_windows:
+        features[f'volatility_{window}'] = rolling_std(returns, tail[-(window - 1):], window)
+    emas = {}
+    for span in ema_spans:
+        values = compute_ema(close, span, state["ema"].get(str(span)))
+        features[f'ema_{span}'] = values
+        emas[str(span)] = float(values[-1])
+
+    # The next run's longest window reaches this many returns back.
+    all_returns = np.concatenate([tail, returns])
+    tail_length = max(volatility_windows, default=1) - 1
+    new_state = {
+        **state,
+        "last_open_time": int(open_time[-1]),
+        "last_close": float(close[-1]),
+        "return_tail": [None if np.isnan(value) else value for value in all_returns[max(len(all_returns) - tail_length, 0):].tolist()],
+        "vwap_day": vwap_day,
+        "vwap_quote_volume": vwap_quote_volume,
+        "vwap_volume": vwap_volume,
+        "ema": emas,
+    }
+    return pd.DataFrame(features, columns=columns), new_state
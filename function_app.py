@@ -7,7 +7,15 @@ from http_starter import bp as http_starter_bp
 from daily_timer_trigger import bp as daily_timer_bp
 from hybrid_orchestrator import bp as hybrid_orchestrator_bp
 from binance_month_activity import bp as binance_month_activity_bp
+from binance_aggtrades_activity import bp as binance_aggtrades_activity_bp
+from kline_rollup import bp as kline_rollup_bp
+from kline_features import bp as kline_features_bp
+from kline_gaps import bp as kline_gaps_bp
+from kline_query import bp as kline_query_bp
 from log_manager import bp as log_manager_bp
+from partition_manifest import bp as partition_manifest_bp
+from pair_universe import bp as pair_universe_bp
+from synapse_load import bp as synapse_load_bp
 
 # --- CORRECTED LINE ---
 # Import the blueprint from your synapse_automation.py file
@@ -22,7 +30,15 @@ app.register_blueprint(http_starter_bp )
 app.register_blueprint(daily_timer_bp)
 app.register_blueprint(hybrid_orchestrator_bp)
 app.register_blueprint(binance_month_activity_bp)
+app.register_blueprint(binance_aggtrades_activity_bp)
+app.register_blueprint(kline_rollup_bp)
+app.register_blueprint(kline_features_bp)
+app.register_blueprint(kline_gaps_bp)
+app.register_blueprint(kline_query_bp)
 app.register_blueprint(log_manager_bp)
+app.register_blueprint(partition_manifest_bp)
+app.register_blueprint(pair_universe_bp)
+app.register_blueprint(synapse_load_bp)
 
 # --- CORRECTED LINE ---
 # Register the Synapse automation blueprint
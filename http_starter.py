@@ -2,6 +2,7 @@ import azure.functions as func
 import azure.durable_functions as df
 import logging
 import json
+import os
 
 bp = func.Blueprint()
 
@@ -10,12 +11,14 @@ bp = func.Blueprint()
 async def http_starter(req: func.HttpRequest, client: df.DurableOrchestrationClient ) -> func.HttpResponse:
     """
     Manual HTTP-triggered execution for on-demand processing of specific trading pairs.
-    Request body: {"trading_pair": "BTCUSDT"}
+    Request body: {"trading_pair": "BTCUSDT", "backfill_parallelism": 8}
+    backfill_parallelism is optional and defaults to the BACKFILL_PARALLELISM setting.
     """
     try:
         req_body = req.get_json()
         trading_pair = req_body.get('trading_pair')
-    except (ValueError, AttributeError):
+        backfill_parallelism = int(req_body.get('backfill_parallelism') or os.environ.get("BACKFILL_PARALLELISM", "1"))
+    except (ValueError, TypeError, AttributeError):
         return func.HttpResponse("Invalid JSON body. Please provide a body like {'trading_pair': 'BTCUSDT'}", status_code=400)
 
     if not trading_pair:
@@ -40,6 +43,88 @@ async def http_starter(req: func.HttpRequest, client: df.DurableOrchestrationCli
 
     # Start the new orchestration. This will overwrite the history of the previous completed/failed instance.
     logging.info(f"Starting new orchestration with ID = '{instance_id}' for trading pair '{trading_pair}'.")
-    instance_id = await client.start_new("hybrid_orchestrator", instance_id, {"trading_pair": trading_pair})
+    instance_id = await client.start_new("hybrid_orchestrator", instance_id, {"trading_pair": trading_pair, "backfill_parallelism": backfill_parallelism})
+
+    return client.create_check_status_response(req, instance_id)
+
+@bp.route(route="start-binance-repair", methods=["POST"])
+@bp.durable_client_input(client_name="client")
+async def repair_starter(req: func.HttpRequest, client: df.DurableOrchestrationClient) -> func.HttpResponse:
+    """
+    Check months of a trading pair for missing or duplicate minutes and refetch only the gaps.
+    Request body: {"trading_pair": "BTCUSDT", "start_timestamp": "2021-01-01T00:00:00Z", "end_timestamp": "2021-06-30T00:00:00Z"}
+    end_timestamp is optional and defaults to now.
+    """
+    try:
+        req_body = req.get_json()
+        trading_pair = req_body.get('trading_pair')
+        start_timestamp = req_body.get('start_timestamp')
+        end_timestamp = req_body.get('end_timestamp')
+    except (ValueError, TypeError, AttributeError):
+        return func.HttpResponse("Invalid JSON body. Please provide a body like {'trading_pair': 'BTCUSDT', 'start_timestamp': '2021-01-01T00:00:00Z'}", status_code=400)
+
+    if not trading_pair or not start_timestamp:
+        return func.HttpResponse("Please pass 'trading_pair' and 'start_timestamp' in the request body.", status_code=400)
+
+    instance_id = f"repair-{trading_pair}"
+    existing_instance = await client.get_status(instance_id)
+    if existing_instance and existing_instance.runtime_status not in [
+        df.OrchestrationRuntimeStatus.Completed,
+        df.OrchestrationRuntimeStatus.Failed,
+        df.OrchestrationRuntimeStatus.Terminated,
+    ]:
+        return func.HttpResponse(
+            f"A repair for {trading_pair} is already in a non-terminal state: {existing_instance.runtime_status} (ID: {instance_id}).",
+            status_code=409
+        )
+
+    logging.info(f"Starting repair orchestration with ID = '{instance_id}' for trading pair '{trading_pair}'.")
+    instance_id = await client.start_new("repair_orchestrator", instance_id, {
+        "trading_pair": trading_pair,
+        "start_timestamp": start_timestamp,
+        "end_timestamp": end_timestamp
+    })
+
+    return client.create_check_status_response(req, instance_id)
+
+@bp.route(route="start-binance-aggtrades", methods=["POST"])
+@bp.durable_client_input(client_name="client")
+async def aggtrades_starter(req: func.HttpRequest, client: df.DurableOrchestrationClient) -> func.HttpResponse:
+    """
+    Ingest the closed days of a trading pair's aggregate trades since its RAW_AGGTRADES watermark.
+    Request body: {"trading_pair": "BTCUSDT", "parallelism": 4, "start_timestamp": "2024-01-01T00:00:00Z", "max_days": 30}
+    start_timestamp is only used when the pair has no watermark yet (default: the last 7 closed days);
+    max_days defaults to the whole backlog.
+    """
+    try:
+        req_body = req.get_json()
+        trading_pair = req_body.get('trading_pair')
+        parallelism = int(req_body.get('parallelism') or os.environ.get("BACKFILL_PARALLELISM", "1"))
+        max_days = int(req_body.get('max_days') or 0)
+    except (ValueError, TypeError, AttributeError):
+        return func.HttpResponse("Invalid JSON body. Please provide a body like {'trading_pair': 'BTCUSDT'}", status_code=400)
+
+    if not trading_pair:
+        return func.HttpResponse("Please pass a 'trading_pair' in the request body.", status_code=400)
+
+    instance_id = f"aggtrades-{trading_pair}"
+    existing_instance = await client.get_status(instance_id)
+    if existing_instance and existing_instance.runtime_status not in [
+        df.OrchestrationRuntimeStatus.Completed,
+        df.OrchestrationRuntimeStatus.Failed,
+        df.OrchestrationRuntimeStatus.Terminated,
+    ]:
+        return func.HttpResponse(
+            f"An aggTrades ingestion for {trading_pair} is already in a non-terminal state: {existing_instance.runtime_status} (ID: {instance_id}).",
+            status_code=409
+        )
+
+    logging.info(f"Starting aggTrades orchestration with ID = '{instance_id}' for trading pair '{trading_pair}'.")
+    instance_id = await client.start_new("aggtrades_orchestrator", instance_id, {
+        "trading_pair": trading_pair,
+        "parallelism": parallelism,
+        "max_days": max_days,
+        "default_timestamp": req_body.get('start_timestamp')
+    })
 
     return client.create_check_status_response(req, instance_id)
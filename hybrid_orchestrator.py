@@ -7,6 +7,19 @@ from dateutil import parser
 
 bp = func.Blueprint()
 
+def get_missing_months(last_processed_dt: datetime, current_utc_now: datetime) -> list:
+    """
+    Start of every month from the one holding last_processed_dt up to, but not
+    including, the current month.
+    """
+    month = last_processed_dt.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    current_month = current_utc_now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    months = []
+    while month < current_month:
+        months.append(month)
+        month += relativedelta(months=1)
+    return months
+
 @bp.orchestration_trigger(context_name="context")
 def hybrid_orchestrator(context: df.DurableOrchestrationContext):
     """
@@ -14,6 +27,13 @@ def hybrid_orchestrator(context: df.DurableOrchestrationContext):
     """
     input_data = context.get_input()
     trading_pair = input_data.get("trading_pair")
+    # More than one month in flight switches historical months to the parallel backfill.
+    backfill_parallelism = input_data.get("backfill_parallelism", 1)
+    # When set, the current-month tracking update is returned to the caller to write in a batch
+    # and the per-month tracking writes are skipped; the partition manifest keeps the progress.
+    defer_tracking = input_data.get("defer_tracking", False)
+    # "manifest" plans from the blob partition manifest and only reads Synapse for pairs without one.
+    planning_source = input_data.get("planning_source", "synapse")
     instance_id = context.instance_id
     
     if not trading_pair:
@@ -23,9 +43,16 @@ def hybrid_orchestrator(context: df.DurableOrchestrationContext):
     logging.info(f"Orchestrator {instance_id}: Starting hybrid processing for {trading_pair}")
 
     try:
-        # 1. Fetch last processed timestamp from Synapse
-        logging.info(f"Orchestrator {instance_id}: Calling get_last_timestamp_activity for {trading_pair}")
-        last_processed_str = yield context.call_activity("get_last_timestamp_activity", trading_pair)
+        # 1. Fetch last processed timestamp from Synapse, unless the caller already read it
+        # (batched across pairs) or a previous generation passed it along.
+        last_processed_str = input_data.get("last_processed_timestamp")
+        if not last_processed_str and planning_source == "manifest":
+            logging.info(f"Orchestrator {instance_id}: Calling get_manifest_watermarks_activity for {trading_pair}")
+            manifest_watermarks = yield context.call_activity("get_manifest_watermarks_activity", [trading_pair])
+            last_processed_str = manifest_watermarks.get(trading_pair)
+        if not last_processed_str:
+            logging.info(f"Orchestrator {instance_id}: Calling get_last_timestamp_activity for {trading_pair}")
+            last_processed_str = yield context.call_activity("get_last_timestamp_activity", trading_pair)
         
         logging.info(f"Orchestrator {instance_id}: Received timestamp string: {last_processed_str}")
         last_processed_dt = parser.isoparse(last_processed_str)
@@ -39,8 +66,9 @@ def hybrid_orchestrator(context: df.DurableOrchestrationContext):
                             last_processed_dt.month == current_utc_now.month)
 
         if is_current_month:
-            # CASE: CURRENT MONTH REGENERATION
-            logging.info(f"Orchestrator {instance_id}: Logic - Current month regeneration for {trading_pair}")
+            # CASE: CURRENT MONTH INCREMENTAL APPEND
+            # Only candles closed since the last persisted close_time are fetched and appended.
+            logging.info(f"Orchestrator {instance_id}: Logic - Current month incremental append for {trading_pair}")
             
             start_of_month = last_processed_dt.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
             
@@ -48,25 +76,109 @@ def hybrid_orchestrator(context: df.DurableOrchestrationContext):
                 "trading_pair": trading_pair,
                 "start_timestamp": start_of_month.isoformat(),
                 "end_timestamp": current_utc_now.isoformat(),
-                "is_regeneration": True
+                "incremental": True
             }
             
-            logging.info(f"Orchestrator {instance_id}: Calling process_binance_month_activity for regeneration")
+            logging.info(f"Orchestrator {instance_id}: Calling process_binance_month_activity for incremental append")
             result = yield context.call_activity("process_binance_month_activity", params)
             
             if result and result.get("record_count", 0) >= 0:
-                logging.info(f"Orchestrator {instance_id}: Calling update_tracking_activity for {trading_pair}")
-                yield context.call_activity("update_tracking_activity", {
+                # Refresh only the tail buckets of the 5m..1d rollups that the new candles touched.
+                yield context.call_activity("rollup_month_activity", {
+                    "trading_pair": trading_pair,
+                    "start_timestamp": start_of_month.isoformat(),
+                    "incremental": True
+                })
+                # Features continue from the month's checkpoint, so only the new candles are computed.
+                yield context.call_activity("features_month_activity", {
+                    "trading_pair": trading_pair,
+                    "start_timestamp": start_of_month.isoformat(),
+                    "incremental": True
+                })
+                tracking_update = {
                     "trading_pair": trading_pair,
                     "last_processed_timestamp": current_utc_now.isoformat(),
                     "record_count": result["record_count"],
-                    "full_refresh": True
-                })
+                    "full_refresh": False
+                }
+                message = f"Successfully updated current month for {trading_pair}. Records: {result['record_count']} (appended {result.get('appended_count', 0)})"
+                if defer_tracking:
+                    logging.info(f"Orchestrator {instance_id}: Completed current month for {trading_pair}. Returning tracking update to caller.")
+                    return {"message": message, "tracking_update": tracking_update}
+
+                logging.info(f"Orchestrator {instance_id}: Calling update_tracking_activity for {trading_pair}")
+                yield context.call_activity("update_tracking_activity", tracking_update)
                 logging.info(f"Orchestrator {instance_id}: Completed current month for {trading_pair}. Terminating.")
-                return f"Successfully regenerated current month for {trading_pair}. Records: {result['record_count']}"
+                return message
             else:
-                logging.error(f"Orchestrator {instance_id}: Failed regeneration for {trading_pair} - Result: {result}")
-                return f"Failed regeneration for {trading_pair}"
+                logging.error(f"Orchestrator {instance_id}: Failed incremental append for {trading_pair} - Result: {result}")
+                return f"Failed incremental append for {trading_pair}"
+
+        elif backfill_parallelism > 1:
+            # CASE: PARALLEL BACKFILL
+            # Fan the missing months out with at most `backfill_parallelism` activities in flight,
+            # then advance the watermark once over the contiguous prefix of months that succeeded.
+            missing_months = get_missing_months(last_processed_dt, current_utc_now)
+            batch_months = missing_months[:input_data.get("backfill_batch_months", backfill_parallelism * 4)]
+            logging.info(f"Orchestrator {instance_id}: Logic - Parallel backfill of {len(batch_months)} of {len(missing_months)} missing months for {trading_pair} (parallelism {backfill_parallelism})")
+            if not batch_months:
+                # A watermark past the current month or a zero batch size; continuing as new would loop.
+                logging.warning(f"Orchestrator {instance_id}: No months to backfill for {trading_pair} from {last_processed_dt.isoformat()}.")
+                return f"Nothing to backfill for {trading_pair}."
+
+            results = [None] * len(batch_months)
+            in_flight = {}
+            next_index = 0
+            while next_index < len(batch_months) or in_flight:
+                while next_index < len(batch_months) and len(in_flight) < backfill_parallelism:
+                    params = {
+                        "trading_pair": trading_pair,
+                        "start_timestamp": batch_months[next_index].isoformat(),
+                        "is_regeneration": False,
+                        # Report failures in the result so one bad month doesn't hide the others.
+                        "return_errors": True
+                    }
+                    task = context.call_activity("process_binance_month_activity", params)
+                    in_flight[task] = next_index
+                    next_index += 1
+                finished = yield context.task_any(list(in_flight))
+                results[in_flight.pop(finished)] = finished.result
+
+            completed = 0
+            completed_records = 0
+            for result in results:
+                if not result or result.get("record_count", -1) < 0:
+                    break
+                completed += 1
+                completed_records += result["record_count"]
+
+            if completed:
+                watermark = batch_months[completed - 1] + relativedelta(months=1)
+                yield context.task_all([
+                    context.call_activity("rollup_month_activity", {"trading_pair": trading_pair, "start_timestamp": month.isoformat()})
+                    for month in batch_months[:completed]
+                ])
+                # Each month's features start from the previous month's checkpoint, so they run in order.
+                for month in batch_months[:completed]:
+                    yield context.call_activity("features_month_activity", {"trading_pair": trading_pair, "start_timestamp": month.isoformat()})
+
+            if completed and not defer_tracking:
+                logging.info(f"Orchestrator {instance_id}: Calling update_tracking_activity for {trading_pair} with watermark {watermark.isoformat()}")
+                yield context.call_activity("update_tracking_activity", {
+                    "trading_pair": trading_pair,
+                    "last_processed_timestamp": watermark.isoformat(),
+                    "record_count": completed_records,
+                    "full_refresh": False
+                })
+
+            if completed < len(batch_months):
+                failed_month = batch_months[completed]
+                logging.error(f"Orchestrator {instance_id}: Backfill stopped at {failed_month.year}-{failed_month.month:02d} for {trading_pair}: {results[completed]}")
+                return f"Backfilled {completed} months for {trading_pair}; failed at {failed_month.year}-{failed_month.month:02d}."
+
+            logging.info(f"Orchestrator {instance_id}: Backfilled {completed} months for {trading_pair}, continuing...")
+            context.continue_as_new({**input_data, "last_processed_timestamp": watermark.isoformat()})
+            return f"Backfilled {completed} months for {trading_pair}, continuing..."
 
         else:
             # CASE: PREVIOUS MONTH INCREMENTAL
@@ -85,16 +197,19 @@ def hybrid_orchestrator(context: df.DurableOrchestrationContext):
             result = yield context.call_activity("process_binance_month_activity", params)
             
             if result and result.get("record_count", 0) >= 0:
-                logging.info(f"Orchestrator {instance_id}: Calling update_tracking_activity for {trading_pair}")
-                yield context.call_activity("update_tracking_activity", {
-                    "trading_pair": trading_pair,
-                    "last_processed_timestamp": next_month_start.isoformat(),
-                    "record_count": result["record_count"],
-                    "full_refresh": False
-                })
+                yield context.call_activity("rollup_month_activity", {"trading_pair": trading_pair, "start_timestamp": last_processed_dt.isoformat()})
+                yield context.call_activity("features_month_activity", {"trading_pair": trading_pair, "start_timestamp": last_processed_dt.isoformat()})
+                if not defer_tracking:
+                    logging.info(f"Orchestrator {instance_id}: Calling update_tracking_activity for {trading_pair}")
+                    yield context.call_activity("update_tracking_activity", {
+                        "trading_pair": trading_pair,
+                        "last_processed_timestamp": next_month_start.isoformat(),
+                        "record_count": result["record_count"],
+                        "full_refresh": False
+                    })
                 
                 logging.info(f"Orchestrator {instance_id}: Continuing to next month for {trading_pair}")
-                context.continue_as_new({"trading_pair": trading_pair})
+                context.continue_as_new({**input_data, "last_processed_timestamp": next_month_start.isoformat()})
                 return f"Processed month {last_processed_dt.year}-{last_processed_dt.month:02d}, continuing..."
             else:
                 logging.error(f"Orchestrator {instance_id}: Failed to process month {last_processed_dt.year}-{last_processed_dt.month:02d}")
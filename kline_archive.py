@@ -0,0 +1,143 @@
+import contextlib
+import hashlib
+import io
+import logging
+import os
+import zipfile
+from itertools import islice
+from binance_client import iter_kline_pages
+from client_registry import get_container_client
+
+# Monthly kline dumps in the layout of Binance's public archive (data.binance.vision,
+# below data/spot/monthly/klines/), so a synced copy can be used as is:
+#   <root>/BTCUSDT/1m/BTCUSDT-1m-2021-01.zip and BTCUSDT-1m-2021-01.zip.CHECKSUM
+ARCHIVE_EXTENSIONS = (".zip", ".csv")
+
+# Archive lines decoded per page; one page is what the writer encodes at a time.
+ARCHIVE_LINES_PER_PAGE = 10_000
+
+class ArchiveChecksumError(Exception):
+    pass
+
+class LocalArchiveSource:
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def read(self, name: str) -> bytes:
+        try:
+            with open(os.path.join(self.directory, *name.split("/")), "rb") as archive_file:
+                return archive_file.read()
+        except FileNotFoundError:
+            return None
+
+    def __str__(self) -> str:
+        return self.directory
+
+class BlobArchiveSource:
+    def __init__(self, container_client, prefix: str):
+        self.container_client = container_client
+        self.prefix = prefix
+
+    def read(self, name: str) -> bytes:
+        from azure.core.exceptions import ResourceNotFoundError
+        try:
+            return self.container_client.get_blob_client(f"{self.prefix}{name}").download_blob().readall()
+        except ResourceNotFoundError:
+            return None
+
+    def __str__(self) -> str:
+        return f"{self.container_client.container_name}/{self.prefix}"
+
+def get_archive_source():
+    """
+    The archive location: KLINE_ARCHIVE_DIR, a local directory, or else
+    KLINE_ARCHIVE_BLOB_PREFIX in KLINE_ARCHIVE_CONTAINER (default raw). None if neither is set.
+    """
+    directory = os.environ.get("KLINE_ARCHIVE_DIR")
+    if directory:
+        return LocalArchiveSource(directory)
+    prefix = os.environ.get("KLINE_ARCHIVE_BLOB_PREFIX")
+    if prefix:
+        return BlobArchiveSource(get_container_client(os.environ.get("KLINE_ARCHIVE_CONTAINER", "raw")), prefix.rstrip("/") + "/")
+    return None
+
+def get_archive_name(trading_pair: str, interval: str, year: int, month: int) -> str:
+    return f"{trading_pair}/{interval}/{trading_pair}-{interval}-{year}-{month:02d}"
+
+def verify_checksum(data: bytes, checksum_file: bytes, name: str) -> None:
+    """
+    Compare against a .CHECKSUM file ("<sha256>  <file name>").
+    """
+    expected = checksum_file.decode("utf-8").split()[0].lower()
+    actual = hashlib.sha256(data).hexdigest()
+    if actual != expected:
+        raise ArchiveChecksumError(f"Checksum mismatch for {name}: expected {expected}, got {actual}")
+
+def load_month_archive(source, trading_pair: str, year: int, month: int, interval: str = "1m") -> tuple:
+    """
+    Read and verify the month's archive. Returns (file name, bytes), or None if the
+    source has no usable archive for the month: missing, without a CHECKSUM file (unless
+    KLINE_ARCHIVE_REQUIRE_CHECKSUM is false) or failing it.
+    """
+    require_checksum = os.environ.get("KLINE_ARCHIVE_REQUIRE_CHECKSUM", "true").lower() == "true"
+    base_name = get_archive_name(trading_pair, interval, year, month)
+    for extension in ARCHIVE_EXTENSIONS:
+        name = base_name + extension
+        data = source.read(name)
+        if data is None:
+            continue
+        checksum_file = source.read(f"{name}.CHECKSUM")
+        if checksum_file is None:
+            if require_checksum:
+                logging.warning(f"Kline archive: {name} in {source} has no CHECKSUM file. Not using it.")
+                return None
+        else:
+            try:
+                verify_checksum(data, checksum_file, name)
+            except ArchiveChecksumError as e:
+                logging.error(f"Kline archive: {str(e)}. Not using it.")
+                return None
+        return name, data
+    return None
+
+def iter_archive_pages(data: bytes, name: str, trading_pair: str, lines_per_page: int = ARCHIVE_LINES_PER_PAGE):
+    """
+    Decode an archive a page of lines at a time. A ZIP is decompressed as it is read,
+    so the whole CSV is never held in memory.
+    """
+    from kline_storage import KlinePage
+    with contextlib.ExitStack() as stack:
+        if name.endswith(".zip"):
+            archive = stack.enter_context(zipfile.ZipFile(io.BytesIO(data)))
+            member = next(member for member in archive.namelist() if member.endswith(".csv"))
+            stream = stack.enter_context(archive.open(member))
+        else:
+            stream = io.BytesIO(data)
+        while True:
+            lines = b"".join(islice(stream, lines_per_page))
+            if not lines:
+                return
+            yield KlinePage.from_csv(lines, trading_pair)
+
+def iter_archive_then_rest(archive_pages, trading_pair: str, start_ms: int, end_ms: int, interval: str = "1m", concurrency: int = 1, stats=None, counts: dict = None):
+    """
+    Yield the archive's pages, then page the REST API for whatever part of
+    [start_ms, end_ms) follows the archive's last candle. `counts` receives the
+    number of archive rows under "archive".
+    """
+    last_open_time = start_ms - 1
+    next_start = start_ms
+    archive_rows = 0
+    for page in archive_pages:
+        page = page.drop_through(last_open_time)
+        if not len(page):
+            continue
+        last_open_time = page.last_open_time
+        next_start = page.last_close_time + 1
+        archive_rows += len(page)
+        yield page
+    if counts is not None:
+        counts["archive"] = archive_rows
+    if next_start < end_ms:
+        logging.info(f"Kline archive: Fetching {trading_pair} from {next_start} to {end_ms} over REST; the archive stops before it")
+        yield from iter_kline_pages(trading_pair, next_start, end_ms, interval, concurrency, stats)
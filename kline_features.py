@@ -0,0 +1,168 @@
+import azure.functions as func
+import hashlib
+import io
+import json
+import logging
+import os
+from dateutil import parser
+from dateutil.relativedelta import relativedelta
+from client_registry import get_container_client
+
+bp = func.Blueprint()
+
+DEFAULT_EMA_SPANS = "12,26,200"
+DEFAULT_VOLATILITY_WINDOWS = "60,1440"
+
+# One day of 1m candles per row group, so readers can prune by day as in the 1m partitions.
+FEATURE_ROW_GROUP_SIZE = 1440
+
+def get_feature_settings(params: dict) -> tuple:
+    """
+    EMA spans and volatility windows (in 1m candles), from the activity params or the
+    FEATURE_EMA_SPANS and FEATURE_VOLATILITY_WINDOWS settings.
+    """
+    settings = []
+    for key, setting, default in (("ema_spans", "FEATURE_EMA_SPANS", DEFAULT_EMA_SPANS), ("volatility_windows", "FEATURE_VOLATILITY_WINDOWS", DEFAULT_VOLATILITY_WINDOWS)):
+        values = params.get(key) or os.environ.get(setting, default).split(",")
+        values = sorted({int(value) for value in values if str(value).strip()})
+        if any(value < 2 for value in values):
+            raise ValueError(f"Unsupported {key}: {values}. Every value must be at least 2 candles.")
+        settings.append(values)
+    return tuple(settings)
+
+def get_features_blob_path(trading_pair: str, year: int, month: int) -> str:
+    return f"binance/{trading_pair}/features/{year}/{month:02d}.parquet"
+
+def get_feature_state_path(trading_pair: str, year: int, month: int) -> str:
+    return f"binance/{trading_pair}/features/{year}/{month:02d}.state.json"
+
+def load_feature_state(blob_client) -> tuple:
+    """
+    Return (state, etag) of a month's checkpoint: the feature state after the last
+    candle computed for it. A month without one yields (None, None).
+    """
+    from azure.core.exceptions import ResourceNotFoundError
+    try:
+        download = blob_client.download_blob()
+    except ResourceNotFoundError:
+        return None, None
+    return json.loads(download.readall()), download.properties.etag
+
+def is_state_compatible(state: dict, ema_spans: list, volatility_windows: list) -> bool:
+    return state is not None and state.get("ema_spans") == ema_spans and state.get("volatility_windows") == volatility_windows
+
+def get_state_digest(state: dict) -> str:
+    return hashlib.sha256(json.dumps(state, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+def load_seed_state(container_client, trading_pair: str, previous_month, ema_spans: list, volatility_windows: list) -> dict:
+    """
+    The state a month's features start from: the previous month's checkpoint, or a cold
+    state if there is none with these settings.
+    """
+    from feature_engine import new_feature_state
+    state, _ = load_feature_state(container_client.get_blob_client(get_feature_state_path(trading_pair, previous_month.year, previous_month.month)))
+    if is_state_compatible(state, ema_spans, volatility_windows):
+        return state
+    logging.warning(f"Activity features_month_activity: No usable checkpoint for {trading_pair} {previous_month.year}-{previous_month.month:02d}. EMAs and windows start cold.")
+    return new_feature_state(ema_spans, volatility_windows)
+
+def encode_features(df_features: "pd.DataFrame", ema_spans: list, volatility_windows: list) -> bytes:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    from feature_engine import get_feature_schema
+    sink = io.BytesIO()
+    table = pa.Table.from_pandas(df_features, schema=get_feature_schema(ema_spans, volatility_windows), preserve_index=False)
+    pq.write_table(table, sink, compression="zstd", row_group_size=FEATURE_ROW_GROUP_SIZE, write_statistics=True)
+    return sink.getvalue()
+
+@bp.activity_trigger(input_name="params")
+def features_month_activity(params: dict) -> dict:
+    """
+    Derive returns, session VWAP, rolling volatility and EMAs from a month's 1m partition.
+    Each month keeps a checkpoint of the rolling state after its last computed candle.
+    With `incremental`, only the candles after the month's checkpoint are computed and
+    appended; otherwise the month is recomputed from the previous month's checkpoint,
+    unless neither that nor the 1m partition changed since. No earlier month is read.
+    """
+    trading_pair = params.get("trading_pair")
+    is_incremental = params.get("incremental", False)
+    logging.info(f"Activity features_month_activity: Starting for {trading_pair} with reference timestamp {params.get('start_timestamp')}")
+    import pandas as pd
+    import pyarrow.parquet as pq
+    from azure.core import MatchConditions
+    from azure.core.exceptions import ResourceNotFoundError
+    from feature_engine import compute_features
+    from kline_storage import format_digest, get_blob_path, get_output_format, get_write_conditions, read_partition_frame, read_partition_state
+
+    try:
+        start_of_month = parser.isoparse(params.get("start_timestamp")).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        previous_month = start_of_month - relativedelta(months=1)
+        output_format = get_output_format(params)
+        ema_spans, volatility_windows = get_feature_settings(params)
+        container_client = get_container_client("raw")
+
+        source_client = container_client.get_blob_client(get_blob_path(trading_pair, start_of_month.year, start_of_month.month, output_format))
+        source_state = read_partition_state(source_client, output_format, metadata_only=True)
+        if source_state is None:
+            logging.warning(f"Activity features_month_activity: No 1m partition for {trading_pair} in {start_of_month.year}-{start_of_month.month:02d}. Nothing to compute.")
+            return {"record_count": 0, "computed_count": 0}
+        source_digest = format_digest(source_state["content_digest"]) if source_state["content_digest"] is not None else None
+
+        state_client = container_client.get_blob_client(get_feature_state_path(trading_pair, start_of_month.year, start_of_month.month))
+        features_client = container_client.get_blob_client(get_features_blob_path(trading_pair, start_of_month.year, start_of_month.month))
+        checkpoint, checkpoint_etag = load_feature_state(state_client)
+        if not is_state_compatible(checkpoint, ema_spans, volatility_windows):
+            checkpoint = None
+        # A recomputed month is only current if it started from the same seed, so repairs carry forward.
+        seed = None if is_incremental else load_seed_state(container_client, trading_pair, previous_month, ema_spans, volatility_windows)
+        seed_digest = get_state_digest(seed) if seed is not None else (checkpoint or {}).get("seed_digest")
+        if (checkpoint is not None and source_digest is not None and checkpoint.get("source_digest") == source_digest
+                and checkpoint.get("seed_digest") == seed_digest):
+            logging.info(f"Activity features_month_activity: Features for {trading_pair} {start_of_month.year}-{start_of_month.month:02d} are up to date with the 1m partition.")
+            return {"record_count": checkpoint["record_count"], "computed_count": 0}
+
+        try:
+            features_etag = features_client.get_blob_properties().etag
+        except ResourceNotFoundError:
+            features_etag = None
+
+        resume = is_incremental and checkpoint is not None and features_etag is not None
+        if resume:
+            state = checkpoint
+            source_frame = read_partition_frame(source_client, output_format, source_state["etag"], state["last_open_time"] + 1)
+            if source_state["record_count"] != checkpoint["record_count"] + len(source_frame):
+                # Rows before the checkpoint changed (a repair or a regeneration).
+                logging.info(f"Activity features_month_activity: The 1m partition of {trading_pair} {start_of_month.year}-{start_of_month.month:02d} changed before the checkpoint. Recomputing the month.")
+                resume = False
+        if not resume:
+            if seed is None:
+                seed = load_seed_state(container_client, trading_pair, previous_month, ema_spans, volatility_windows)
+                seed_digest = get_state_digest(seed)
+            state = seed
+            source_frame = read_partition_frame(source_client, output_format, source_state["etag"])
+            if state["last_open_time"] is not None:
+                source_frame = source_frame[source_frame['open_time'] > state["last_open_time"]]
+        df_features, new_state = compute_features(source_frame.reset_index(drop=True), state, trading_pair)
+        logging.info(f"Activity features_month_activity: Computed features of {len(df_features)} candles for {trading_pair} {start_of_month.year}-{start_of_month.month:02d} (resumed: {resume})")
+
+        record_count = len(df_features)
+        if len(df_features):
+            if resume:
+                data = features_client.download_blob(etag=features_etag, match_condition=MatchConditions.IfNotModified).readall()
+                kept = pq.read_table(io.BytesIO(data), filters=[("open_time", "<=", state["last_open_time"])]).to_pandas()
+                df_features = pd.concat([kept, df_features], ignore_index=True)
+            record_count = len(df_features)
+            features_client.upload_blob(
+                encode_features(df_features, ema_spans, volatility_windows), overwrite=True,
+                metadata={"record_count": str(record_count), "last_open_time": str(new_state["last_open_time"])},
+                **get_write_conditions(None if features_etag is None else {"etag": features_etag})
+            )
+        elif resume:
+            record_count = checkpoint["record_count"]
+        # The checkpoint goes last: a run that stops in between resumes from the previous one.
+        payload = json.dumps({**new_state, "record_count": record_count, "source_digest": source_digest, "seed_digest": seed_digest}).encode("utf-8")
+        state_client.upload_blob(payload, overwrite=True, **get_write_conditions(None if checkpoint_etag is None else {"etag": checkpoint_etag}))
+        return {"record_count": record_count, "computed_count": len(source_frame)}
+    except Exception as e:
+        logging.error(f"Activity features_month_activity: Error computing features for {trading_pair}: {str(e)}")
+        raise
@@ -0,0 +1,184 @@
+import azure.functions as func
+import azure.durable_functions as df
+import logging
+from datetime import datetime, timezone
+from dateutil import parser
+from dateutil.relativedelta import relativedelta
+from binance_client import INTERVAL_MS, FetchStats, get_fetch_concurrency, iter_kline_pages
+from client_registry import get_container_client
+from partition_manifest import get_partition_key, update_manifest_partition
+
+bp = func.Blueprint()
+
+def find_gaps(open_times: "np.ndarray", start_ms: int, end_ms: int, interval: str = "1m") -> dict:
+    """
+    Compare open_times against the expected grid of [start_ms, end_ms). Returns the
+    missing ranges as [first_missing_open_time, last_missing_open_time] pairs, the
+    open_times that occur more than once and those that are off the grid.
+    """
+    import numpy as np
+    interval_ms = INTERVAL_MS[interval]
+    open_times = np.asarray(open_times, dtype=np.int64)
+    unique_times, counts = np.unique(open_times, return_counts=True)
+    duplicates = unique_times[counts > 1]
+    on_grid = ((unique_times - start_ms) % interval_ms == 0) & (unique_times >= start_ms) & (unique_times < end_ms)
+    off_grid = unique_times[~on_grid]
+    grid_times = unique_times[on_grid]
+
+    # Pad with one virtual candle either side so leading and trailing gaps fall out of the same diff.
+    bounded = np.concatenate(([start_ms - interval_ms], grid_times, [end_ms]))
+    steps = np.diff(bounded)
+    gap_index = np.nonzero(steps > interval_ms)[0]
+    gaps = [[int(bounded[i] + interval_ms), int(bounded[i + 1] - interval_ms)] for i in gap_index]
+
+    expected = (end_ms - start_ms) // interval_ms
+    return {
+        "expected_count": int(expected),
+        "missing_count": int(expected - len(grid_times)),
+        "gaps": gaps,
+        "duplicates": duplicates.tolist(),
+        "off_grid": off_grid.tolist(),
+    }
+
+@bp.activity_trigger(input_name="params")
+def repair_month_activity(params: dict) -> dict:
+    """
+    Check a month partition against the 1m grid and refetch only the missing windows.
+    The partition is rewritten with the merged rows (duplicates dropped) under an
+    ETag condition. Gaps Binance has no data for are reported as remaining.
+    """
+    trading_pair = params.get("trading_pair")
+    logging.info(f"Activity repair_month_activity: Starting for {trading_pair} with reference timestamp {params.get('start_timestamp')}")
+    import pandas as pd
+    from kline_storage import (
+        BlockBlobWriter, PartitionWriter, build_kline_frame, build_partition_metadata, format_digest,
+        get_blob_path, get_output_format, get_write_conditions, is_partition_unchanged, read_partition_frame,
+        read_partition_state
+    )
+
+    try:
+        start_of_month = parser.isoparse(params.get("start_timestamp")).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        start_ms = int(start_of_month.timestamp() * 1000)
+        month_end_ms = int((start_of_month + relativedelta(months=1)).timestamp() * 1000)
+        now_ms = int(datetime.now(timezone.utc).timestamp() * 1000)
+        # The current month is only checked up to the last closed candle.
+        closed_ms = now_ms - now_ms % 60_000
+        end_ms = min(month_end_ms, closed_ms)
+        is_complete = month_end_ms <= closed_ms
+
+        output_format = get_output_format(params)
+        container_client = get_container_client("raw")
+        blob_path = get_blob_path(trading_pair, start_of_month.year, start_of_month.month, output_format)
+        blob_client = container_client.get_blob_client(blob_path)
+
+        state = read_partition_state(blob_client, output_format)
+        typed = output_format == "parquet"
+        if state is not None:
+            existing = read_partition_frame(blob_client, output_format, state["etag"], typed=typed)
+        else:
+            existing = build_kline_frame([], trading_pair, typed=typed)
+        report = find_gaps(existing['open_time'].astype('int64').to_numpy(), start_ms, end_ms)
+        logging.info(f"Activity repair_month_activity: {blob_path} is missing {report['missing_count']} of {report['expected_count']} candles in {len(report['gaps'])} gaps, with {len(report['duplicates'])} duplicates")
+
+        result = {
+            "missing_count": report["missing_count"],
+            "gap_count": len(report["gaps"]),
+            "duplicate_count": len(report["duplicates"]),
+            "refetched_count": 0,
+        }
+        if not report["gaps"] and not report["duplicates"] and not report["off_grid"]:
+            return {**result, "remaining_gaps": []}
+
+        fetch_stats = FetchStats()
+        fetch_concurrency = get_fetch_concurrency(params)
+        refetched = []
+        for gap_start, gap_end in report["gaps"]:
+            refetched.extend(iter_kline_pages(trading_pair, gap_start, gap_end + INTERVAL_MS["1m"], concurrency=fetch_concurrency, stats=fetch_stats))
+        refetched_count = sum(len(page) for page in refetched)
+        result["refetched_count"] = refetched_count
+
+        # Refetched rows win over stored duplicates; off-grid rows are dropped.
+        merged = pd.concat([existing, build_kline_frame(refetched, trading_pair, typed=typed)], ignore_index=True)
+        open_times = merged['open_time'].astype('int64')
+        merged = merged[((open_times - start_ms) % INTERVAL_MS["1m"] == 0) & (open_times >= start_ms) & (open_times < end_ms)]
+        merged = merged.assign(_open_time=merged['open_time'].astype('int64'))
+        merged = merged.drop_duplicates(subset='_open_time', keep='last').sort_values('_open_time').drop(columns='_open_time')
+        remaining = find_gaps(merged['open_time'].astype('int64').to_numpy(), start_ms, end_ms)
+        result["remaining_gaps"] = remaining["gaps"]
+
+        if merged.empty:
+            logging.warning(f"Activity repair_month_activity: Binance has no data for {trading_pair} in {start_of_month.year}-{start_of_month.month:02d}")
+            return {**result, **fetch_stats.as_dict()}
+
+        # Binance often has nothing for a gap either; then the rows are unchanged and nothing is written.
+        sink = BlockBlobWriter(blob_client)
+        writer = PartitionWriter(sink, output_format)
+        writer.write_frame(merged)
+        writer.close()
+        result["written"] = not is_partition_unchanged(state, writer.record_count, writer.content_digest)
+        if not result["written"]:
+            sink.discard()
+            logging.info(f"Activity repair_month_activity: {blob_path} is unchanged after the refetch. Skipped the upload.")
+            return {**result, **fetch_stats.as_dict()}
+        sink.close(metadata=build_partition_metadata(writer.record_count, writer.first_open_time, writer.last_open_time, writer.last_close_time, writer.content_digest), **get_write_conditions(state))
+
+        update_manifest_partition(container_client, trading_pair, get_partition_key(start_of_month.year, start_of_month.month), {
+            "path": blob_path,
+            "format": output_format,
+            "record_count": writer.record_count,
+            "min_open_time": writer.first_open_time,
+            "max_open_time": writer.last_open_time,
+            "max_close_time": writer.last_close_time,
+            "size": sink.bytes_written,
+            "checksum": format_digest(writer.content_digest),
+            "missing_minutes": remaining["missing_count"],
+            "complete": is_complete
+        })
+
+        logging.info(f"Activity repair_month_activity: Repaired {blob_path} with {refetched_count} refetched candles; {remaining['missing_count']} minutes remain missing on Binance")
+        return {**result, **fetch_stats.as_dict()}
+    except Exception as e:
+        logging.error(f"Activity repair_month_activity: Error repairing {trading_pair}: {str(e)}")
+        raise
+
+@bp.orchestration_trigger(context_name="context")
+def repair_orchestrator(context: df.DurableOrchestrationContext):
+    """
+    Repair every month of a pair between start_timestamp and end_timestamp, then
+    rebuild the rollups of the months that changed and the features from the first of
+    them on, in order, since each month's features start from the previous month's.
+    Input: {"trading_pair": "BTCUSDT", "start_timestamp": "...", "end_timestamp": "...", "parallelism": 4}
+    """
+    input_data = context.get_input()
+    trading_pair = input_data.get("trading_pair")
+    parallelism = input_data.get("parallelism", 4)
+    instance_id = context.instance_id
+
+    month = parser.isoparse(input_data.get("start_timestamp")).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    end_dt = parser.isoparse(input_data["end_timestamp"]) if input_data.get("end_timestamp") else context.current_utc_datetime.replace(tzinfo=timezone.utc)
+    months = []
+    while month <= end_dt:
+        months.append(month)
+        month += relativedelta(months=1)
+    logging.info(f"Orchestrator {instance_id}: Repairing {len(months)} months for {trading_pair}")
+
+    results = []
+    for offset in range(0, len(months), parallelism):
+        chunk = months[offset:offset + parallelism]
+        results.extend((yield context.task_all([
+            context.call_activity("repair_month_activity", {"trading_pair": trading_pair, "start_timestamp": month.isoformat()})
+            for month in chunk
+        ])))
+
+    repaired = [month for month, result in zip(months, results) if result.get("written")]
+    if repaired:
+        yield context.task_all([
+            context.call_activity("rollup_month_activity", {"trading_pair": trading_pair, "start_timestamp": month.isoformat()})
+            for month in repaired
+        ])
+        for month in months[months.index(repaired[0]):]:
+            yield context.call_activity("features_month_activity", {"trading_pair": trading_pair, "start_timestamp": month.isoformat()})
+
+    summary = {f"{month.year}-{month.month:02d}": result for month, result in zip(months, results)}
+    logging.info(f"Orchestrator {instance_id}: Repaired {len(repaired)} of {len(months)} months for {trading_pair}")
+    return summary
@@ -0,0 +1,334 @@
+import azure.functions as func
+import io
+import json
+import logging
+import os
+import re
+import threading
+import time
+import telemetry
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from dateutil import parser
+from dateutil.relativedelta import relativedelta
+from binance_client import INTERVAL_MS
+from client_registry import get_container_client
+from kline_rollup import get_rollup_blob_path
+
+bp = func.Blueprint()
+
+# The pair ends up in blob paths, so only plain Binance symbols are accepted.
+TRADING_PAIR_PATTERN = re.compile(r"^[A-Z0-9]{2,20}$")
+
+DEFAULT_QUERY_COLUMNS = ['open_time', 'open_price', 'high_price', 'low_price', 'close_price', 'volume', 'close_time']
+
+# Partitions of one query are read side by side.
+QUERY_READ_CONCURRENCY = 8
+
+_cache = None
+_cache_lock = threading.Lock()
+
+class PartitionCache:
+    """
+    Byte-bounded LRU of decoded partition pieces (a Parquet row group, or a whole CSV
+    partition), shared by every query in this worker.
+
+    Pieces are keyed by blob path and ETag. Once a newer ETag is seen for a path, the
+    older pieces are dropped, so a rewritten partition is never served stale. The ETag
+    of a path is re-checked at most every `revalidate_seconds`.
+    """
+
+    def __init__(self, max_bytes: int, revalidate_seconds: float = 15):
+        self.max_bytes = max_bytes
+        self.revalidate_seconds = revalidate_seconds
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._etags = {}
+        self._lock = threading.Lock()
+
+    def known_etag(self, path: str) -> str:
+        """
+        The ETag last seen for `path` if it was checked recently enough, else None.
+        """
+        with self._lock:
+            etag, checked_at = self._etags.get(path, (None, 0.0))
+            return etag if time.monotonic() - checked_at < self.revalidate_seconds else None
+
+    def validate(self, path: str, etag: str) -> None:
+        with self._lock:
+            previous = self._etags.get(path, (None, 0.0))[0]
+            self._etags[path] = (etag, time.monotonic())
+            if previous is not None and previous != etag:
+                for key in [key for key in self._entries if key[0] == path and key[1] != etag]:
+                    self.current_bytes -= self._entries.pop(key)[1]
+
+    def invalidate(self, path: str) -> None:
+        with self._lock:
+            self._etags.pop(path, None)
+            for key in [key for key in self._entries if key[0] == path]:
+                self.current_bytes -= self._entries.pop(key)[1]
+
+    def get(self, key: tuple):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: tuple, value, nbytes: int) -> None:
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.current_bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (value, nbytes)
+            self.current_bytes += nbytes
+            while self.current_bytes > self.max_bytes:
+                self.current_bytes -= self._entries.popitem(last=False)[1][1]
+
+def get_partition_cache() -> PartitionCache:
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = PartitionCache(
+                int(float(os.environ.get("QUERY_CACHE_MAX_MB", "256")) * 2 ** 20),
+                float(os.environ.get("QUERY_CACHE_REVALIDATE_SECONDS", "15"))
+            )
+        return _cache
+
+class BlobRangeReader(io.RawIOBase):
+    """
+    Seekable, read-only view of one blob version. Every read is a ranged GET pinned to
+    `etag`, so the Parquet reader fetches only the footer and the row groups it needs.
+    """
+
+    def __init__(self, blob_client, size: int, etag: str):
+        from azure.core import MatchConditions
+        self.blob_client = blob_client
+        self.size = size
+        self.etag = etag
+        self.match_condition = MatchConditions.IfNotModified
+        self.position = 0
+        self.bytes_read = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self.position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            self.position = offset
+        elif whence == io.SEEK_CUR:
+            self.position += offset
+        else:
+            self.position = self.size + offset
+        return self.position
+
+    def readinto(self, buffer) -> int:
+        length = min(len(buffer), self.size - self.position)
+        if length <= 0:
+            return 0
+        data = self.blob_client.download_blob(offset=self.position, length=length, etag=self.etag, match_condition=self.match_condition).readall()
+        buffer[:len(data)] = data
+        self.position += len(data)
+        self.bytes_read += len(data)
+        return len(data)
+
+def parse_time_ms(value: str) -> int:
+    """
+    Epoch milliseconds, or an ISO 8601 timestamp (UTC unless it says otherwise).
+    """
+    if value.isdigit():
+        return int(value)
+    timestamp = parser.isoparse(value)
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return int(timestamp.timestamp() * 1000)
+
+def get_partition_paths(trading_pair: str, interval: str, start_ms: int, end_ms: int, output_format: str) -> list:
+    """
+    Blob paths of the month partitions that [start_ms, end_ms) touches.
+    """
+    from kline_storage import get_blob_path
+    month = datetime.fromtimestamp(start_ms / 1000, tz=timezone.utc).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    paths = []
+    while month.timestamp() * 1000 < end_ms:
+        if interval == "1m":
+            paths.append(get_blob_path(trading_pair, month.year, month.month, output_format))
+        else:
+            paths.append(get_rollup_blob_path(trading_pair, interval, month.year, month.month, output_format))
+        month += relativedelta(months=1)
+    return paths
+
+def frame_nbytes(df_data: "pd.DataFrame") -> int:
+    return int(df_data.memory_usage(index=True, deep=True).sum())
+
+def read_parquet_pieces(cache: PartitionCache, blob_client, path: str, etag: str, size: int, start_ms: int, end_ms: int) -> tuple:
+    """
+    Frames of the row groups whose open_time statistics overlap [start_ms, end_ms),
+    from the cache where possible and otherwise through ranged reads.
+    Returns (pieces, bytes downloaded).
+    """
+    import pyarrow.parquet as pq
+    from azure.core import MatchConditions
+    from kline_storage import COLUMN_DTYPES
+    parquet_file = None
+    reader = None
+
+    def open_parquet_file():
+        nonlocal parquet_file, reader
+        # Size is unknown when the ETag came from the cache; the reader needs it to find the footer.
+        blob_size = size if size is not None else blob_client.get_blob_properties(etag=etag, match_condition=MatchConditions.IfNotModified).size
+        reader = BlobRangeReader(blob_client, blob_size, etag)
+        # pre_buffer coalesces the column chunks of a row group into one ranged GET.
+        parquet_file = pq.ParquetFile(reader, pre_buffer=True)
+
+    row_groups = cache.get((path, etag, "row_groups"))
+    if row_groups is None:
+        open_parquet_file()
+        column_index = parquet_file.schema_arrow.get_field_index("open_time")
+        row_groups = []
+        for index in range(parquet_file.metadata.num_row_groups):
+            statistics = parquet_file.metadata.row_group(index).column(column_index).statistics
+            if statistics is not None and statistics.has_min_max:
+                row_groups.append((index, statistics.min, statistics.max))
+            else:
+                row_groups.append((index, None, None))
+        cache.put((path, etag, "row_groups"), row_groups, 64 * len(row_groups))
+
+    pieces = []
+    for index, min_open_time, max_open_time in row_groups:
+        if min_open_time is not None and (max_open_time < start_ms or min_open_time >= end_ms):
+            continue
+        piece = cache.get((path, etag, index))
+        if piece is None:
+            if parquet_file is None:
+                open_parquet_file()
+            piece = parquet_file.read_row_group(index).to_pandas().astype(COLUMN_DTYPES)
+            cache.put((path, etag, index), piece, frame_nbytes(piece))
+        pieces.append(piece)
+    return pieces, reader.bytes_read if reader is not None else 0
+
+def read_partition_pieces(cache: PartitionCache, container_client, path: str, output_format: str, start_ms: int, end_ms: int) -> tuple:
+    """
+    Decoded pieces of one partition covering [start_ms, end_ms), and the bytes downloaded
+    for them. A missing partition yields no pieces.
+    """
+    from azure.core.exceptions import ResourceModifiedError, ResourceNotFoundError
+    from kline_storage import read_partition_frame
+    blob_client = container_client.get_blob_client(path)
+    for attempt in range(2):
+        etag = cache.known_etag(path)
+        size = None
+        if etag is None:
+            try:
+                properties = blob_client.get_blob_properties()
+            except ResourceNotFoundError:
+                return [], 0
+            etag, size = properties.etag, properties.size
+            cache.validate(path, etag)
+        try:
+            if output_format == "parquet":
+                return read_parquet_pieces(cache, blob_client, path, etag, size, start_ms, end_ms)
+            piece = cache.get((path, etag, "all"))
+            if piece is None:
+                # CSV has no index to seek by, so the whole partition is read and kept.
+                piece = read_partition_frame(blob_client, output_format, etag)
+                cache.put((path, etag, "all"), piece, frame_nbytes(piece))
+                return [piece], size or 0
+            return [piece], 0
+        except ResourceModifiedError:
+            # Rewritten since the ETag was checked; forget it and read the new version.
+            cache.invalidate(path)
+        except ResourceNotFoundError:
+            # Deleted since its ETag was cached, e.g. by a repair or a rollup rewrite.
+            cache.invalidate(path)
+            return [], 0
+    raise RuntimeError(f"{path} kept changing while it was being read.")
+
+def query_klines(trading_pair: str, interval: str, start_ms: int, end_ms: int, columns: list, output_format: str) -> "pd.DataFrame":
+    import pandas as pd
+    from kline_storage import COLUMN_DTYPES
+    cache = get_partition_cache()
+    container_client = get_container_client("raw")
+    paths = get_partition_paths(trading_pair, interval, start_ms, end_ms, output_format)
+    with telemetry.span("read"):
+        with ThreadPoolExecutor(max_workers=min(QUERY_READ_CONCURRENCY, len(paths))) as executor:
+            partitions = list(executor.map(lambda path: read_partition_pieces(cache, container_client, path, output_format, start_ms, end_ms), paths))
+    telemetry.add("bytes_downloaded", sum(bytes_downloaded for _, bytes_downloaded in partitions))
+    pieces = [piece for partition_pieces, _ in partitions for piece in partition_pieces]
+    with telemetry.span("filter"):
+        selected = [piece.loc[(piece['open_time'] >= start_ms) & (piece['open_time'] < end_ms), columns] for piece in pieces]
+        if not selected:
+            return pd.DataFrame(columns=columns).astype({column: COLUMN_DTYPES[column] for column in columns})
+        return pd.concat(selected, ignore_index=True)
+
+@bp.route(route="klines", methods=["GET"])
+def query_klines_http(req: func.HttpRequest) -> func.HttpResponse:
+    """
+    Serve OHLCV from the lake.
+    Query: ?trading_pair=BTCUSDT&interval=1h&start=2024-01-01T00:00:00Z&end=2024-02-01T00:00:00Z
+    start/end take ISO 8601 or epoch milliseconds; end is exclusive and defaults to now.
+    Optional: columns=open_time,close_price (default OHLCV), format=json|csv, output_format=csv|parquet.
+    """
+    from kline_storage import FINAL_COLUMNS, get_output_format
+    try:
+        trading_pair = (req.params.get('trading_pair') or "").upper()
+        interval = req.params.get('interval', "1m")
+        start_ms = parse_time_ms(req.params['start'])
+        end_ms = parse_time_ms(req.params['end']) if req.params.get('end') else int(datetime.now(timezone.utc).timestamp() * 1000)
+        columns = [column.strip() for column in req.params.get('columns', ",".join(DEFAULT_QUERY_COLUMNS)).split(",") if column.strip()]
+        response_format = req.params.get('format', "json").lower()
+        output_format = get_output_format({"output_format": req.params.get('output_format')})
+    except (KeyError, ValueError, OverflowError) as e:
+        return func.HttpResponse(f"Invalid query: {str(e)}. Example: ?trading_pair=BTCUSDT&interval=1h&start=2024-01-01T00:00:00Z", status_code=400)
+
+    if not trading_pair:
+        return func.HttpResponse("Please pass a 'trading_pair' query parameter.", status_code=400)
+    if not TRADING_PAIR_PATTERN.match(trading_pair):
+        return func.HttpResponse(f"Invalid trading_pair '{trading_pair}'. Expected 2 to 20 letters or digits, e.g. BTCUSDT.", status_code=400)
+    if interval not in INTERVAL_MS:
+        return func.HttpResponse(f"Unsupported interval '{interval}'. Expected one of: {', '.join(INTERVAL_MS)}", status_code=400)
+    unknown = [column for column in columns if column not in FINAL_COLUMNS or column == 'trading_pair']
+    if unknown:
+        return func.HttpResponse(f"Unknown column(s): {', '.join(unknown)}", status_code=400)
+    if response_format not in ("json", "csv"):
+        return func.HttpResponse("format must be 'json' or 'csv'.", status_code=400)
+    if end_ms <= start_ms:
+        return func.HttpResponse("end must be after start.", status_code=400)
+    max_rows = int(os.environ.get("QUERY_MAX_ROWS", "1000000"))
+    if (end_ms - start_ms) // INTERVAL_MS[interval] > max_rows:
+        return func.HttpResponse(f"The range covers more than {max_rows} {interval} candles; narrow it or use a higher interval.", status_code=400)
+
+    with telemetry.invocation("query_klines_http", trading_pair=trading_pair, interval=interval, start_ms=start_ms, end_ms=end_ms) as invocation:
+        cache = get_partition_cache()
+        hits, misses = cache.hits, cache.misses
+        try:
+            df_data = query_klines(trading_pair, interval, start_ms, end_ms, columns, output_format)
+        except Exception as e:
+            logging.error(f"HTTP query_klines_http: Error querying {trading_pair} {interval}: {str(e)}")
+            raise
+        # Worker-wide counters, so concurrent queries can blur these slightly.
+        invocation.add("cache_hits", cache.hits - hits)
+        invocation.add("cache_misses", cache.misses - misses)
+        invocation.add("rows", len(df_data))
+        invocation.set(cache_bytes=cache.current_bytes)
+
+        with telemetry.span("serialize"):
+            if response_format == "csv":
+                return func.HttpResponse(df_data.to_csv(index=False), mimetype="text/csv")
+            body = '{"trading_pair":%s,"interval":%s,"columns":%s,"data":%s}' % (
+                json.dumps(trading_pair), json.dumps(interval), json.dumps(columns), df_data.to_json(orient="values")
+            )
+            return func.HttpResponse(body, mimetype="application/json")
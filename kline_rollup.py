@@ -0,0 +1,145 @@
+import azure.functions as func
+import azure.durable_functions as df
+import io
+import logging
+import os
+from dateutil import parser
+from binance_client import INTERVAL_MS
+from client_registry import get_container_client
+
+bp = func.Blueprint()
+
+DEFAULT_ROLLUP_INTERVALS = "5m,15m,1h,4h,1d"
+
+# How each 1m column folds into a higher-interval candle.
+ROLLUP_AGGREGATIONS = {
+    'open_price': 'first',
+    'high_price': 'max',
+    'low_price': 'min',
+    'close_price': 'last',
+    'volume': 'sum',
+    'close_time': 'last',
+    'quote_asset_volume': 'sum',
+    'number_of_trades': 'sum',
+    'taker_buy_base_asset_volume': 'sum',
+    'taker_buy_quote_asset_volume': 'sum',
+}
+
+def get_rollup_intervals(params: dict) -> list:
+    """
+    Intervals to derive, from the activity params or the ROLLUP_INTERVALS setting.
+    """
+    intervals = params.get("intervals") or os.environ.get("ROLLUP_INTERVALS", DEFAULT_ROLLUP_INTERVALS).split(",")
+    intervals = [interval.strip() for interval in intervals if interval.strip()]
+    unknown = [interval for interval in intervals if interval not in INTERVAL_MS or interval == "1m"]
+    if unknown:
+        raise ValueError(f"Unsupported rollup interval(s): {', '.join(unknown)}")
+    return intervals
+
+def get_rollup_blob_path(trading_pair: str, interval: str, year: int, month: int, output_format: str) -> str:
+    return f"binance/{trading_pair}/{interval}/{year}/{month:02d}.{output_format}"
+
+def resample_klines(df_data: "pd.DataFrame", interval: str, trading_pair: str) -> "pd.DataFrame":
+    """
+    Fold sorted 1m candles into `interval` candles aligned to the UTC epoch, as Binance
+    does. close_time is the last constituent's, so a still-growing tail bucket is
+    recognisable by a close_time short of its interval end.
+    """
+    import pandas as pd
+    from kline_storage import COLUMN_DTYPES, FINAL_COLUMNS
+    if df_data.empty:
+        return pd.DataFrame(columns=FINAL_COLUMNS).astype(COLUMN_DTYPES)
+    interval_ms = INTERVAL_MS[interval]
+    buckets = df_data['open_time'].to_numpy() // interval_ms * interval_ms
+    rolled = df_data.groupby(buckets, sort=True).agg(ROLLUP_AGGREGATIONS)
+    rolled.index.name = 'open_time'
+    rolled = rolled.reset_index().astype(COLUMN_DTYPES)
+    rolled['trading_pair'] = trading_pair
+    return rolled[FINAL_COLUMNS]
+
+def encode_rollup(df_data: "pd.DataFrame", output_format: str) -> bytes:
+    """
+    Rollup months are small, so each is written as a single Parquet row group.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    from kline_storage import PARQUET_SCHEMA
+    if output_format == "csv":
+        return df_data.to_csv(index=False).encode("utf-8")
+    sink = io.BytesIO()
+    pq.write_table(pa.Table.from_pandas(df_data, schema=PARQUET_SCHEMA, preserve_index=False), sink, compression="zstd", write_statistics=True)
+    return sink.getvalue()
+
+@bp.activity_trigger(input_name="params")
+def rollup_month_activity(params: dict) -> dict:
+    """
+    Derive higher-interval candles from a month's 1m partition.
+    With `incremental`, only the buckets from each rollup's last (possibly partial)
+    bucket onwards are recomputed; earlier buckets are kept as they are. Rollups whose
+    rows come out unchanged are not rewritten.
+    """
+    trading_pair = params.get("trading_pair")
+    is_incremental = params.get("incremental", False)
+    logging.info(f"Activity rollup_month_activity: Starting for {trading_pair} with reference timestamp {params.get('start_timestamp')}")
+    import pandas as pd
+    from kline_storage import (
+        build_partition_metadata, compute_row_digest, get_blob_path, get_output_format, get_write_conditions,
+        is_partition_unchanged, read_partition_frame, read_partition_state
+    )
+
+    try:
+        start_of_month = parser.isoparse(params.get("start_timestamp")).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        output_format = get_output_format(params)
+        intervals = get_rollup_intervals(params)
+        container_client = get_container_client("raw")
+
+        source_client = container_client.get_blob_client(get_blob_path(trading_pair, start_of_month.year, start_of_month.month, output_format))
+        source_state = read_partition_state(source_client, output_format)
+        if source_state is None:
+            logging.warning(f"Activity rollup_month_activity: No 1m partition for {trading_pair} in {start_of_month.year}-{start_of_month.month:02d}. Nothing to roll up.")
+            return {"intervals": {interval: 0 for interval in intervals}}
+
+        # Each rollup resumes at its last bucket, which may still have been growing when written.
+        targets = {}
+        for interval in intervals:
+            blob_client = container_client.get_blob_client(get_rollup_blob_path(trading_pair, interval, start_of_month.year, start_of_month.month, output_format))
+            state = read_partition_state(blob_client, output_format, metadata_only=not is_incremental)
+            targets[interval] = (blob_client, state, state if is_incremental else None)
+        tail_starts = [resume_state["last_open_time"] if resume_state else None for _, _, resume_state in targets.values()]
+        read_from = None if None in tail_starts else min(tail_starts)
+
+        source_frame = read_partition_frame(source_client, output_format, source_state["etag"], read_from)
+        logging.info(f"Activity rollup_month_activity: Rolling up {len(source_frame)} 1m candles for {trading_pair} into {', '.join(intervals)}")
+
+        record_counts = {}
+        skipped = []
+        for interval, (blob_client, state, resume_state) in targets.items():
+            if resume_state is None:
+                rolled = resample_klines(source_frame, interval, trading_pair)
+            else:
+                tail_start = resume_state["last_open_time"]
+                kept = read_partition_frame(blob_client, output_format, state["etag"])
+                kept = kept[kept['open_time'] < tail_start]
+                tail = resample_klines(source_frame[source_frame['open_time'] >= tail_start], interval, trading_pair)
+                rolled = pd.concat([kept, tail], ignore_index=True)
+
+            if rolled.empty:
+                record_counts[interval] = 0
+                continue
+            record_counts[interval] = len(rolled)
+            content_digest = compute_row_digest(rolled)
+            if is_partition_unchanged(state, len(rolled), content_digest):
+                skipped.append(interval)
+                continue
+            metadata = build_partition_metadata(
+                len(rolled), int(rolled['open_time'].iloc[0]), int(rolled['open_time'].iloc[-1]),
+                int(rolled['close_time'].iloc[-1]), content_digest
+            )
+            blob_client.upload_blob(encode_rollup(rolled, output_format), overwrite=True, metadata=metadata, **get_write_conditions(state))
+
+        written = [interval for interval in record_counts if record_counts[interval] and interval not in skipped]
+        logging.info(f"Activity rollup_month_activity: Rollups for {trading_pair} {start_of_month.year}-{start_of_month.month:02d}: {record_counts}; wrote {written or 'none'}, unchanged {skipped or 'none'}")
+        return {"intervals": record_counts, "written": written, "skipped": skipped}
+    except Exception as e:
+        logging.error(f"Activity rollup_month_activity: Error rolling up {trading_pair}: {str(e)}")
+        raise
@@ -0,0 +1,473 @@
+import base64
+import io
+import os
+import re
+import uuid
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+import telemetry
+from azure.core import MatchConditions
+from azure.core.exceptions import ResourceNotFoundError
+from azure.storage.blob import BlobBlock
+
+MS_PER_DAY = 86_400_000
+
+KLINE_COLUMNS = [
+    'open_time', 'open_price', 'high_price', 'low_price', 'close_price',
+    'volume', 'close_time', 'quote_asset_volume', 'number_of_trades',
+    'taker_buy_base_asset_volume', 'taker_buy_quote_asset_volume', 'ignore'
+]
+
+FINAL_COLUMNS = [
+    'trading_pair', 'open_time', 'open_price', 'high_price', 'low_price',
+    'close_price', 'volume', 'close_time', 'quote_asset_volume',
+    'number_of_trades', 'taker_buy_base_asset_volume', 'taker_buy_quote_asset_volume'
+]
+
+COLUMN_DTYPES = {
+    'open_time': 'int64',
+    'open_price': 'float64',
+    'high_price': 'float64',
+    'low_price': 'float64',
+    'close_price': 'float64',
+    'volume': 'float64',
+    'close_time': 'int64',
+    'quote_asset_volume': 'float64',
+    'number_of_trades': 'int32',
+    'taker_buy_base_asset_volume': 'float64',
+    'taker_buy_quote_asset_volume': 'float64',
+}
+
+PARQUET_SCHEMA = pa.schema([
+    ('trading_pair', pa.string()),
+    ('open_time', pa.int64()),
+    ('open_price', pa.float64()),
+    ('high_price', pa.float64()),
+    ('low_price', pa.float64()),
+    ('close_price', pa.float64()),
+    ('volume', pa.float64()),
+    ('close_time', pa.int64()),
+    ('quote_asset_volume', pa.float64()),
+    ('number_of_trades', pa.int32()),
+    ('taker_buy_base_asset_volume', pa.float64()),
+    ('taker_buy_quote_asset_volume', pa.float64()),
+])
+
+OUTPUT_FORMATS = ("csv", "parquet")
+
+# Block ids are a random per-writer prefix plus a zero-padded sequence number so that
+# appends never collide with blocks already committed. Azure requires every block id
+# in a blob to have the same length.
+BLOCK_ID_PREFIX_LENGTH = 16
+BLOCK_ID_LENGTH = len(base64.b64encode(b"0" * (BLOCK_ID_PREFIX_LENGTH + 8)))
+
+DIGEST_MODULUS = 2 ** 64
+
+def get_output_format(params: dict) -> str:
+    """
+    Resolve the partition format from the activity params, falling back to the
+    OUTPUT_FORMAT setting. CSV stays the default so existing readers keep working.
+    """
+    output_format = (params.get("output_format") or os.environ.get("OUTPUT_FORMAT", "csv")).lower()
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Unsupported output format '{output_format}'. Expected one of: {', '.join(OUTPUT_FORMATS)}")
+    return output_format
+
+def get_blob_path(trading_pair: str, year: int, month: int, output_format: str) -> str:
+    return f"binance/{trading_pair}/{year}/{month:02d}.{output_format}"
+
+CSV_HEADER = (",".join(FINAL_COLUMNS) + "\n").encode("utf-8")
+
+# The trailing "ignore" field of a kline and the "],[" that separates it from the next one.
+_ROW_BOUNDARY = re.compile(rb",[^,\]]*\],\[")
+
+# The trailing "ignore" field of an archive CSV line.
+_CSV_LAST_FIELD = re.compile(rb",[^,\n]*$", re.MULTILINE)
+
+class KlinePage:
+    """
+    Klines decoded straight from a response body without per-cell Python objects.
+
+    `values` holds the 12 kline fields as a float64 matrix parsed in one bulk call
+    (epoch milliseconds and trade counts are exact in float64). `rows` holds the same
+    klines as output CSV rows, cut from the body so prices keep Binance's exact strings.
+    """
+
+    def __init__(self, trading_pair: str, values: np.ndarray, rows: bytes):
+        self.trading_pair = trading_pair
+        self.values = values
+        self.rows = rows
+
+    @classmethod
+    def empty(cls, trading_pair: str) -> "KlinePage":
+        return cls(trading_pair, np.empty((0, len(KLINE_COLUMNS))), b"")
+
+    @classmethod
+    def from_body(cls, body: bytes, trading_pair: str) -> "KlinePage":
+        text = body.translate(None, b'" \t\r\n')
+        if len(text) <= 2:
+            return cls.empty(trading_pair)
+        values = np.fromstring(text.translate(None, b"[]"), sep=",")
+        if values.size % len(KLINE_COLUMNS):
+            raise ValueError(f"Malformed klines response for {trading_pair}: {values.size} values is not a multiple of {len(KLINE_COLUMNS)}")
+        prefix = trading_pair.encode("utf-8") + b","
+        rows = prefix + _ROW_BOUNDARY.sub(b"\n" + prefix, text[2:-2])
+        # Drop the last kline's "ignore" field, which has no row boundary after it.
+        rows = rows[:rows.rfind(b",")] + b"\n"
+        return cls(trading_pair, values.reshape(-1, len(KLINE_COLUMNS)), rows)
+
+    @classmethod
+    def from_csv(cls, data: bytes, trading_pair: str) -> "KlinePage":
+        """
+        Klines from lines of a Binance archive CSV (the 12 kline fields, no quotes).
+        Archives from 2025 on have open and close times in microseconds; those are cut
+        to milliseconds like every other partition.
+        """
+        lines = data.translate(None, b'" \t\r').strip(b"\n")
+        if lines[:1].isalpha():
+            # Newer archives start with a header line.
+            lines = lines.partition(b"\n")[2]
+        if not lines:
+            return cls.empty(trading_pair)
+        if len(lines[:lines.index(b",")]) > 13:
+            fields = [line.split(b",") for line in lines.split(b"\n")]
+            for line in fields:
+                line[0] = line[0][:-3]
+                line[6] = line[6][:-3]
+            lines = b"\n".join(b",".join(line) for line in fields)
+        values = np.fromstring(lines.replace(b"\n", b","), sep=",")
+        if values.size % len(KLINE_COLUMNS):
+            raise ValueError(f"Malformed kline archive for {trading_pair}: {values.size} values is not a multiple of {len(KLINE_COLUMNS)}")
+        prefix = trading_pair.encode("utf-8") + b","
+        rows = prefix + _CSV_LAST_FIELD.sub(b"", lines).replace(b"\n", b"\n" + prefix) + b"\n"
+        return cls(trading_pair, values.reshape(-1, len(KLINE_COLUMNS)), rows)
+
+    @classmethod
+    def concat(cls, pages: list, trading_pair: str) -> "KlinePage":
+        if not pages:
+            return cls.empty(trading_pair)
+        if len(pages) == 1:
+            return pages[0]
+        return cls(trading_pair, np.concatenate([page.values for page in pages]), b"".join(page.rows for page in pages))
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    @property
+    def last_open_time(self) -> int:
+        return int(self.values[-1, 0])
+
+    @property
+    def last_close_time(self) -> int:
+        return int(self.values[-1, 6])
+
+    def drop_through(self, open_time: int) -> "KlinePage":
+        """
+        Drop the leading klines with open_time <= `open_time` (overlap with the previous page).
+        """
+        dropped = int(np.searchsorted(self.values[:, 0], open_time, side="right"))
+        if not dropped:
+            return self
+        offset = 0
+        for _ in range(dropped):
+            offset = self.rows.index(b"\n", offset) + 1
+        return KlinePage(self.trading_pair, self.values[dropped:], self.rows[offset:])
+
+    def to_frame(self) -> pd.DataFrame:
+        """
+        Typed output frame. Each column is a contiguous slice of one transposed copy of `values`.
+        """
+        columns = np.ascontiguousarray(self.values[:, :len(COLUMN_DTYPES)].T)
+        df_data = pd.DataFrame({name: columns[index] for index, name in enumerate(KLINE_COLUMNS[:len(COLUMN_DTYPES)])}, copy=False)
+        df_data = df_data.astype(COLUMN_DTYPES, copy=False)
+        df_data.insert(0, 'trading_pair', self.trading_pair)
+        return df_data
+
+def build_kline_frame(pages: list, trading_pair: str, typed: bool = True) -> pd.DataFrame:
+    """
+    Build the output frame from decoded pages. With `typed`, prices and volumes are
+    float64 and times int64 epoch milliseconds; otherwise every value is kept as the
+    string Binance returned.
+    """
+    page = KlinePage.concat(pages, trading_pair)
+    if typed:
+        return page.to_frame()
+    return pd.read_csv(io.BytesIO(CSV_HEADER + page.rows), dtype=str)
+
+class BlockBlobWriter:
+    """
+    Write-only file object that stages everything written to it as blocks of a
+    block blob and commits the block list on close. Memory stays bounded by the
+    block size; readers keep seeing the previous blob until the commit. A caller
+    that finds the content unchanged can discard() it instead of committing; the
+    blocks staged so far are garbage-collected uncommitted.
+    """
+
+    def __init__(self, blob_client, block_size: int = None, committed_blocks: list = None):
+        self.blob_client = blob_client
+        self.block_size = block_size or int(os.environ.get("UPLOAD_BLOCK_SIZE_BYTES", str(4 * 1024 * 1024)))
+        # Blocks already in the blob that the commit keeps ahead of the new ones (appends).
+        self.committed_blocks = committed_blocks or []
+        self.block_ids = []
+        self._id_prefix = uuid.uuid4().hex[:BLOCK_ID_PREFIX_LENGTH]
+        self.bytes_written = 0
+        self.closed = False
+        self._buffer = bytearray()
+
+    def writable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self.bytes_written + len(self._buffer)
+
+    def write(self, data) -> int:
+        self._buffer.extend(data)
+        while len(self._buffer) >= self.block_size:
+            self._stage(bytes(self._buffer[:self.block_size]))
+            del self._buffer[:self.block_size]
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def _stage(self, chunk: bytes):
+        block_id = base64.b64encode(f"{self._id_prefix}{len(self.block_ids):08d}".encode()).decode()
+        with telemetry.span("upload"):
+            self.blob_client.stage_block(block_id=block_id, data=chunk)
+        telemetry.add("bytes_uploaded", len(chunk))
+        self.block_ids.append(BlobBlock(block_id=block_id))
+        self.bytes_written += len(chunk)
+
+    def close(self, metadata: dict = None, **commit_kwargs):
+        """
+        Stage the remaining buffer and commit. Extra keyword arguments (etag,
+        match_condition) are passed to commit_block_list for conditional commits.
+        """
+        if self.closed:
+            return
+        for offset in range(0, len(self._buffer), self.block_size):
+            self._stage(bytes(self._buffer[offset:offset + self.block_size]))
+        self._buffer.clear()
+        with telemetry.span("upload"):
+            self.blob_client.commit_block_list(self.committed_blocks + self.block_ids, metadata=metadata, **commit_kwargs)
+        self.closed = True
+
+    def discard(self):
+        """
+        Drop the buffer without committing; blocks staged so far expire uncommitted.
+        """
+        self._buffer.clear()
+        self.closed = True
+
+def get_write_conditions(state: dict) -> dict:
+    """
+    Conditions for replacing a partition read as `state`: commit only if it is unchanged
+    since, or, if there was none, only if nobody has created it in the meantime.
+    """
+    if state is None:
+        return {"etag": "*", "match_condition": MatchConditions.IfMissing}
+    return {"etag": state["etag"], "match_condition": MatchConditions.IfNotModified}
+
+def is_partition_unchanged(state: dict, record_count: int, content_digest: int) -> bool:
+    """
+    True if the persisted partition already holds exactly these rows, judged by its
+    record count and the digest of its typed rows.
+    """
+    return (state is not None and state.get("content_digest") is not None
+            and state["content_digest"] == content_digest and state.get("record_count") == record_count)
+
+def get_appendable_blocks(blob_client) -> list:
+    """
+    Return the committed blocks of an existing partition if new blocks can be
+    appended after them, or None when the blob was written some other way
+    (single-shot upload or a different block id scheme).
+    """
+    committed, _ = blob_client.get_block_list("committed")
+    if not committed or any(len(block.id) != BLOCK_ID_LENGTH for block in committed):
+        return None
+    return [BlobBlock(block_id=block.id) for block in committed]
+
+def compute_row_digest(df_data: pd.DataFrame) -> int:
+    """
+    Order-independent 64-bit digest of the typed kline rows: the wrapping sum of a
+    per-row hash. Appends extend it by adding the digest of the new rows, so the
+    digest of a partition never requires re-reading it.
+    """
+    typed = df_data[list(COLUMN_DTYPES)].astype(COLUMN_DTYPES)
+    row_hashes = pd.util.hash_pandas_object(typed, index=False).to_numpy()
+    return int(row_hashes.sum(dtype=np.uint64))
+
+def combine_digests(first: int, second: int) -> int:
+    return (first + second) % DIGEST_MODULUS
+
+def format_digest(digest: int) -> str:
+    return f"{digest:016x}"
+
+def build_partition_metadata(record_count: int, first_open_time: int, last_open_time: int, last_close_time: int, content_digest: int) -> dict:
+    return {
+        "record_count": str(record_count),
+        "first_open_time": str(first_open_time),
+        "last_open_time": str(last_open_time),
+        "last_close_time": str(last_close_time),
+        "content_digest": format_digest(content_digest),
+    }
+
+def read_partition_state(blob_client, output_format: str, metadata_only: bool = False) -> dict:
+    """
+    Describe the persisted partition: etag, size, record_count, first/last open time,
+    last close time and content digest. Returns None if the blob does not exist.
+    Partitions written before the metadata existed are inspected directly (CSV tail,
+    Parquet columns) unless `metadata_only`; fields that cannot be recovered are None.
+    """
+    try:
+        properties = blob_client.get_blob_properties()
+    except ResourceNotFoundError:
+        return None
+
+    state = {"etag": properties.etag, "size": properties.size}
+    metadata = properties.metadata or {}
+    state["first_open_time"] = int(metadata["first_open_time"]) if "first_open_time" in metadata else None
+    state["content_digest"] = int(metadata["content_digest"], 16) if "content_digest" in metadata else None
+    if "last_close_time" in metadata:
+        state["record_count"] = int(metadata["record_count"])
+        state["last_open_time"] = int(metadata["last_open_time"])
+        state["last_close_time"] = int(metadata["last_close_time"])
+        return state
+
+    if metadata_only:
+        state.update(record_count=None, last_open_time=None, last_close_time=None)
+        return state
+    if properties.size == 0:
+        return None
+
+    if output_format == "parquet":
+        parquet_file = pq.ParquetFile(io.BytesIO(blob_client.download_blob(etag=properties.etag, match_condition=MatchConditions.IfNotModified).readall()))
+        times = parquet_file.read(columns=["open_time", "close_time"])
+        state["record_count"] = parquet_file.metadata.num_rows
+        state["first_open_time"] = int(pc.min(times.column("open_time")).as_py())
+        state["last_open_time"] = int(pc.max(times.column("open_time")).as_py())
+        state["last_close_time"] = int(pc.max(times.column("close_time")).as_py())
+        return state
+
+    tail_length = min(properties.size, 4096)
+    tail = blob_client.download_blob(offset=properties.size - tail_length, length=tail_length).readall()
+    last_line = tail.decode("utf-8").strip().splitlines()[-1].split(",")
+    if last_line[0] == "trading_pair":
+        return None
+    state["record_count"] = None
+    state["last_open_time"] = int(last_line[FINAL_COLUMNS.index("open_time")])
+    state["last_close_time"] = int(last_line[FINAL_COLUMNS.index("close_time")])
+    return state
+
+def read_partition_frame(blob_client, output_format: str, etag: str, min_open_time: int = None, typed: bool = True) -> pd.DataFrame:
+    """
+    Read a partition, optionally only the rows with open_time >= min_open_time.
+    Parquet readers skip whole day row groups using the open_time statistics. Without
+    `typed`, CSV values are kept as the strings Binance returned.
+    """
+    data = blob_client.download_blob(etag=etag, match_condition=MatchConditions.IfNotModified).readall()
+    if output_format == "parquet":
+        filters = [("open_time", ">=", min_open_time)] if min_open_time is not None else None
+        df_data = pq.read_table(io.BytesIO(data), filters=filters).to_pandas()
+    else:
+        df_data = pd.read_csv(io.BytesIO(data), dtype=None if typed else str)
+        if min_open_time is not None:
+            df_data = df_data[df_data['open_time'].astype('int64') >= min_open_time]
+    if typed or output_format == "parquet":
+        df_data = df_data.astype(COLUMN_DTYPES)
+    return df_data.reset_index(drop=True)
+
+class PartitionWriter:
+    """
+    Incrementally encode kline frames into `sink` as CSV or Parquet.
+
+    Parquet rows are held back until their UTC day is complete so that every row
+    group covers exactly one day, which lets readers prune on open_time using the
+    row-group statistics.
+    """
+
+    def __init__(self, sink, output_format: str, compression: str = "zstd", include_header: bool = True):
+        self.sink = sink
+        self.output_format = output_format
+        self.record_count = 0
+        self.first_open_time = None
+        self.last_open_time = None
+        self.last_close_time = None
+        self.content_digest = 0
+        self._header_written = not include_header
+        self._pending_day = None
+        self._parquet_writer = None
+        if output_format == "parquet":
+            self._parquet_writer = pq.ParquetWriter(sink, PARQUET_SCHEMA, compression=compression, write_statistics=True)
+
+    def write_page(self, page: KlinePage):
+        """
+        Write decoded klines. CSV rows are copied from the response bodies as they are;
+        only the digest needs the typed values.
+        """
+        if not len(page):
+            return
+        if self._parquet_writer is not None:
+            self.write_frame(page.to_frame())
+            return
+        with telemetry.span("serialize"):
+            self._track(page.to_frame())
+            if not self._header_written:
+                self.sink.write(CSV_HEADER)
+                self._header_written = True
+            self.sink.write(page.rows)
+
+    def write_frame(self, df_data: pd.DataFrame):
+        if df_data.empty:
+            return
+        with telemetry.span("serialize"):
+            self._write_frame(df_data)
+
+    def _track(self, df_data: pd.DataFrame):
+        self.record_count += len(df_data)
+        if self.first_open_time is None:
+            self.first_open_time = int(df_data['open_time'].iloc[0])
+        self.last_open_time = int(df_data['open_time'].iloc[-1])
+        self.last_close_time = int(df_data['close_time'].iloc[-1])
+        self.content_digest = combine_digests(self.content_digest, compute_row_digest(df_data))
+
+    def _write_frame(self, df_data: pd.DataFrame):
+        self._track(df_data)
+        if self._parquet_writer is None:
+            self.sink.write(df_data.to_csv(index=False, header=not self._header_written).encode("utf-8"))
+            self._header_written = True
+            return
+
+        table = pa.Table.from_pandas(df_data, schema=PARQUET_SCHEMA, preserve_index=False)
+        if self._pending_day is not None:
+            table = pa.concat_tables([self._pending_day, table])
+        day_keys = table.column('open_time').to_numpy() // MS_PER_DAY
+        # Row offsets where a new UTC day starts; rows are already sorted by open_time.
+        boundaries = [0, *((day_keys[1:] != day_keys[:-1]).nonzero()[0] + 1), len(day_keys)]
+        for start, end in zip(boundaries[:-2], boundaries[1:-1]):
+            self._parquet_writer.write_table(table.slice(start, end - start))
+        self._pending_day = table.slice(boundaries[-2])
+
+    def close(self):
+        """
+        Flush the held-back day and the Parquet footer. The sink is left open for the caller.
+        """
+        if self._parquet_writer is not None:
+            with telemetry.span("serialize"):
+                self._flush_parquet()
+
+    def _flush_parquet(self):
+        if self._pending_day is not None and self._pending_day.num_rows:
+            self._parquet_writer.write_table(self._pending_day)
+        self._pending_day = None
+        self._parquet_writer.close()
+
+def encode_partition(df_data: pd.DataFrame, output_format: str) -> bytes:
+    sink = io.BytesIO()
+    writer = PartitionWriter(sink, output_format)
+    writer.write_frame(df_data)
+    writer.close()
+    return sink.getvalue()
@@ -0,0 +1,213 @@
+"""
+Run a historical backfill outside the Functions host.
+
+Every (pair, month) is one work item, processed on a local process pool by the same
+code as process_binance_month_activity and rollup_month_activity. Finished items are
+recorded in a checkpoint file, so an interrupted run picks up where it stopped. Settings
+(STORAGE_*, BINANCE_*, SYNAPSE_*) come from the environment as in the function app.
+
+    python local_runner.py --pairs BTCUSDT,ETHUSDT --start-month 2019-01 --workers 8 --update-tracking
+
+Each worker has its own rate limiter. They share Binance's per-IP count through the
+X-MBX-USED-WEIGHT-1M header, so together they stay within BINANCE_WEIGHT_LIMIT_PER_MINUTE.
+Pages fetched by a month that failed are kept in the page cache (PAGE_CACHE_DIR, a
+directory under the system temp dir unless set), which the workers share, so a rerun
+only fetches the pages that are still missing.
+
+With KLINE_ARCHIVE_DIR pointing at a copy of Binance's monthly kline dumps, months are
+imported from the archives and REST is only used for what they don't cover.
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timezone
+from dateutil.relativedelta import relativedelta
+
+DEFAULT_CHECKPOINT_PATH = ".local_runner_checkpoint.json"
+
+def get_item_key(trading_pair: str, month: datetime) -> str:
+    return f"{trading_pair}/{month.year}-{month.month:02d}"
+
+def build_work_items(trading_pairs: list, first_month: datetime, last_month: datetime) -> list:
+    """
+    (pair, month) items ordered month by month, so every pair advances together.
+    """
+    items = []
+    month = first_month
+    while month <= last_month:
+        items.extend((pair, month) for pair in trading_pairs)
+        month += relativedelta(months=1)
+    return items
+
+def load_checkpoint(path: str) -> dict:
+    if not os.path.exists(path):
+        return {"items": {}}
+    with open(path) as checkpoint_file:
+        return json.load(checkpoint_file)
+
+def save_checkpoint(path: str, checkpoint: dict) -> None:
+    # Written to a temporary file and renamed, so a crash never leaves a torn checkpoint.
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, "w") as checkpoint_file:
+        json.dump(checkpoint, checkpoint_file, indent=1, sort_keys=True)
+    os.replace(temporary_path, path)
+
+def init_worker(log_level: str) -> None:
+    logging.basicConfig(level=log_level, format="%(asctime)s %(processName)s %(levelname)s %(message)s")
+
+def run_work_item(trading_pair: str, month_iso: str, params: dict) -> dict:
+    """
+    Process one month in a worker process: the month activity, then its rollups.
+    """
+    # Imported in the worker; the parent only schedules and keeps the checkpoint.
+    from binance_month_activity import process_binance_month_activity
+    from kline_rollup import rollup_month_activity
+
+    started = time.perf_counter()
+    month_params = {"trading_pair": trading_pair, "start_timestamp": month_iso, "return_errors": True, **params}
+    result = process_binance_month_activity._function.get_user_function()(month_params)
+    if result.get("record_count", -1) >= 0 and not params.get("skip_rollups"):
+        try:
+            rollup_month_activity._function.get_user_function()({"trading_pair": trading_pair, "start_timestamp": month_iso, **params})
+        except Exception as e:
+            result = {"record_count": -1, "error": f"Rollup failed: {str(e)}"}
+    result["seconds"] = round(time.perf_counter() - started, 3)
+    return result
+
+def compute_watermarks(checkpoint: dict, trading_pairs: list, first_month: datetime, last_month: datetime) -> dict:
+    """
+    Per pair, the start of the first month from first_month on that is not done, or
+    None if not even first_month is. Only the contiguous prefix counts, like the orchestrator.
+    """
+    watermarks = {}
+    for pair in trading_pairs:
+        month = first_month
+        while month <= last_month and checkpoint["items"].get(get_item_key(pair, month), {}).get("status") == "done":
+            month += relativedelta(months=1)
+        watermarks[pair] = month if month > first_month else None
+    return watermarks
+
+def update_tracking(watermarks: dict, first_month: datetime) -> int:
+    """
+    Advance the tracking table to the local watermarks. A pair only moves forward, and
+    only if its current watermark falls inside the months this run loaded.
+    """
+    from dateutil import parser
+    from log_manager import get_last_timestamps_activity, update_tracking_batch_activity
+
+    advanced = {pair: watermark for pair, watermark in watermarks.items() if watermark is not None}
+    if not advanced:
+        return 0
+    current = get_last_timestamps_activity._function.get_user_function()(list(advanced))
+    updates = []
+    for pair, watermark in advanced.items():
+        current_watermark = parser.isoparse(current[pair])
+        if current_watermark < first_month:
+            logging.warning(f"Local runner: {pair} is tracked up to {current[pair]}, before --start-month. Leaving its watermark alone.")
+        elif current_watermark < watermark:
+            updates.append({"trading_pair": pair, "last_processed_timestamp": watermark.isoformat(), "record_count": 0, "full_refresh": False})
+    return update_tracking_batch_activity._function.get_user_function()(updates)
+
+def format_duration(seconds: float) -> str:
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h{minutes:02d}m{seconds:02d}s" if hours else f"{minutes}m{seconds:02d}s"
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--pairs", help="Comma-separated trading pairs (default: the pair universe, see pair_universe)")
+    parser.add_argument("--start-month", default="2021-01", help="First month to load (YYYY-MM)")
+    parser.add_argument("--end-month", help="Last month to load (YYYY-MM); defaults to the last complete month")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Worker processes")
+    parser.add_argument("--fetch-concurrency", type=int, help="Page fetches in flight per month (BINANCE_FETCH_CONCURRENCY)")
+    parser.add_argument("--output-format", choices=("csv", "parquet"), help="Partition format (OUTPUT_FORMAT)")
+    parser.add_argument("--skip-rollups", action="store_true", help="Don't derive the 5m..1d rollups")
+    parser.add_argument("--checkpoint", default=DEFAULT_CHECKPOINT_PATH, help="Checkpoint file for resuming")
+    parser.add_argument("--force", action="store_true", help="Reprocess items the checkpoint marks as done")
+    parser.add_argument("--update-tracking", action="store_true", help="Advance logging.TrackingTable when done")
+    parser.add_argument("--log-level", default="WARNING")
+    return parser.parse_args(argv)
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    init_worker(args.log_level)
+    # The function app only caches pages when configured; a long local backfill always does.
+    os.environ.setdefault("PAGE_CACHE_DIR", os.path.join(tempfile.gettempdir(), "binance_pages"))
+
+    current_month = datetime.now(timezone.utc).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    first_month = datetime.strptime(args.start_month, "%Y-%m").replace(tzinfo=timezone.utc)
+    last_month = datetime.strptime(args.end_month, "%Y-%m").replace(tzinfo=timezone.utc) if args.end_month else current_month - relativedelta(months=1)
+    if last_month >= current_month:
+        # The current month keeps growing; the timer appends to it incrementally.
+        last_month = current_month - relativedelta(months=1)
+
+    if args.pairs:
+        trading_pairs = [pair.strip().upper() for pair in args.pairs.split(",") if pair.strip()]
+    else:
+        from pair_universe import get_trading_pair_universe_activity
+        trading_pairs = get_trading_pair_universe_activity._function.get_user_function()({})
+
+    params = {key: value for key, value in {
+        "fetch_concurrency": args.fetch_concurrency,
+        "output_format": args.output_format,
+        "skip_rollups": args.skip_rollups,
+    }.items() if value}
+
+    checkpoint = load_checkpoint(args.checkpoint)
+    items = build_work_items(trading_pairs, first_month, last_month)
+    pending = [(pair, month) for pair, month in items
+               if args.force or checkpoint["items"].get(get_item_key(pair, month), {}).get("status") != "done"]
+    print(f"{len(trading_pairs)} pairs, {len(items)} months, {len(items) - len(pending)} already done, {len(pending)} to run on {args.workers} workers", flush=True)
+
+    started = time.perf_counter()
+    done = failed = records = 0
+    # spawn, not fork: children must build their own HTTP, blob and ODBC clients.
+    with ProcessPoolExecutor(max_workers=args.workers, mp_context=multiprocessing.get_context("spawn"),
+                             initializer=init_worker, initargs=(args.log_level,)) as executor:
+        futures = {executor.submit(run_work_item, pair, month.isoformat(), params): (pair, month) for pair, month in pending}
+        try:
+            for future in as_completed(futures):
+                pair, month = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    result = {"record_count": -1, "error": str(e)}
+                ok = result.get("record_count", -1) >= 0
+                checkpoint["items"][get_item_key(pair, month)] = {
+                    "status": "done" if ok else "failed",
+                    "record_count": result.get("record_count"),
+                    "written": result.get("written"),
+                    "error": result.get("error"),
+                    "seconds": result.get("seconds"),
+                    "finished_at": datetime.now(timezone.utc).isoformat(),
+                }
+                save_checkpoint(args.checkpoint, checkpoint)
+
+                done += ok
+                failed += not ok
+                records += max(result.get("record_count", 0), 0)
+                elapsed = time.perf_counter() - started
+                finished = done + failed
+                eta = elapsed / finished * (len(pending) - finished)
+                outcome = ("written" if result.get("written") else "unchanged") if ok else f"FAILED: {result.get('error')}"
+                print(f"[{finished:>{len(str(len(pending)))}}/{len(pending)}] {get_item_key(pair, month)} {max(result.get('record_count', 0), 0)} rows "
+                      f"in {result.get('seconds', 0):.1f}s ({outcome}) | {records / elapsed:,.0f} rows/s, ETA {format_duration(eta)}", flush=True)
+        except KeyboardInterrupt:
+            print("Interrupted; finished months are in the checkpoint. Rerun the same command to resume.", flush=True)
+            executor.shutdown(wait=False, cancel_futures=True)
+            return 130
+
+    print(f"Done: {done} months ({records:,} rows) in {format_duration(time.perf_counter() - started)}, {failed} failed", flush=True)
+    if args.update_tracking:
+        updated = update_tracking(compute_watermarks(checkpoint, trading_pairs, first_month, last_month), first_month)
+        print(f"Advanced the tracking table for {updated} pairs", flush=True)
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,21 +1,102 @@
 import azure.functions as func
 import azure.durable_functions as df
 import logging
-import pyodbc
-import os
 from datetime import datetime, timezone
 from dateutil import parser
+import telemetry
+from client_registry import sql_connection
 
 bp = func.Blueprint()
 
 # Default start date for new trading pairs: January 1st, 2021, 00:00:00 UTC
 DEFAULT_START_DATE = "2021-01-01T00:00:00Z"
 
+# Table_Name of the kline watermarks; other datasets track their pairs under their own name.
+RAW_INGESTION_TABLE = "RAW_INGESTION"
+
+# SQL Server caps a statement at 2100 parameters; this many rows (6 parameters each) or
+# pairs per statement keeps tracking reads and writes well below it.
+TRACKING_ROWS_PER_STATEMENT = 300
+
 def get_connection():
-    conn_str = os.getenv("SYNAPSE_CONNECTION_STRING")
-    if not conn_str:
-        raise ValueError("SYNAPSE_CONNECTION_STRING environment variable is not set.")
-    return pyodbc.connect(conn_str)
+    """
+    Pooled Synapse connection; committed and returned to the pool when the block exits.
+    """
+    return sql_connection()
+
+def format_timestamp(ts) -> str:
+    return ts.isoformat() if hasattr(ts, 'isoformat') else str(ts)
+
+def fetch_last_timestamps(cursor, trading_pairs: list, table_name: str = RAW_INGESTION_TABLE) -> dict:
+    """
+    Read the watermarks of many pairs, one query per TRACKING_ROWS_PER_STATEMENT pairs.
+    Pairs without a row are left out.
+    """
+    timestamps = {}
+    for offset in range(0, len(trading_pairs), TRACKING_ROWS_PER_STATEMENT):
+        chunk = trading_pairs[offset:offset + TRACKING_ROWS_PER_STATEMENT]
+        placeholders = ", ".join("?" for _ in chunk)
+        query = f"""
+        SELECT Trading_Pair, Last_Processed_Timestamp
+        FROM logging.TrackingTable
+        WHERE Table_Name = ? AND Trading_Pair IN ({placeholders})
+        """
+        cursor.execute(query, (table_name, *chunk))
+        timestamps.update({row[0]: format_timestamp(row[1]) for row in cursor.fetchall()})
+    return timestamps
+
+def merge_tracking_updates(cursor, updates: list) -> None:
+    """
+    Apply many tracking updates in one set-based MERGE. Rows are loaded into a session
+    temp table with INSERT ... SELECT ... UNION ALL, since the dedicated pool does not
+    accept multi-row VALUES lists. Updates carry an optional table_name (default RAW_INGESTION).
+    """
+    # MERGE rejects a source that matches the same target row twice; keep the last update per pair.
+    updates = list({(update.get("table_name", RAW_INGESTION_TABLE), update["trading_pair"]): update for update in updates}.values())
+    system_update_time = datetime.now(timezone.utc)
+    cursor.execute("""
+    CREATE TABLE #TrackingUpdates (
+        Table_Name NVARCHAR(50) NOT NULL,
+        Trading_Pair NVARCHAR(50) NOT NULL,
+        Last_Processed_Timestamp DATETIME2 NOT NULL,
+        Record_Count BIGINT NOT NULL,
+        System_Update_Time DATETIME2 NOT NULL,
+        Full_refresh BIT NOT NULL
+    )
+    WITH (DISTRIBUTION = ROUND_ROBIN, HEAP)
+    """)
+    try:
+        for offset in range(0, len(updates), TRACKING_ROWS_PER_STATEMENT):
+            chunk = updates[offset:offset + TRACKING_ROWS_PER_STATEMENT]
+            selects = " UNION ALL ".join("SELECT ?, ?, ?, ?, ?, ?" for _ in chunk)
+            values = []
+            for update in chunk:
+                values.extend((
+                    update.get("table_name", RAW_INGESTION_TABLE),
+                    update["trading_pair"],
+                    parser.isoparse(update["last_processed_timestamp"]),
+                    update.get("record_count", 0),
+                    system_update_time,
+                    1 if update.get("full_refresh", False) else 0
+                ))
+            cursor.execute(f"INSERT INTO #TrackingUpdates {selects}", tuple(values))
+
+        cursor.execute("""
+        MERGE logging.TrackingTable AS target
+        USING #TrackingUpdates AS source
+        ON target.Table_Name = source.Table_Name AND target.Trading_Pair = source.Trading_Pair
+        WHEN MATCHED THEN UPDATE SET
+            Last_Processed_Timestamp = source.Last_Processed_Timestamp,
+            Record_Count = source.Record_Count,
+            System_Update_Time = source.System_Update_Time,
+            Full_refresh = source.Full_refresh
+        WHEN NOT MATCHED BY TARGET THEN
+            INSERT (Table_Name, Trading_Pair, Last_Processed_Timestamp, Record_Count, System_Update_Time, Full_refresh)
+            VALUES (source.Table_Name, source.Trading_Pair, source.Last_Processed_Timestamp, source.Record_Count, source.System_Update_Time, source.Full_refresh);
+        """)
+    finally:
+        # The connection goes back to the pool, so don't leave the temp table behind.
+        cursor.execute("DROP TABLE #TrackingUpdates")
 
 @bp.activity_trigger(input_name="tradingPair")
 def get_last_timestamp_activity(tradingPair: str) -> str:
@@ -23,28 +104,67 @@ def get_last_timestamp_activity(tradingPair: str) -> str:
     Activity to fetch the last processed timestamp from Synapse tracking table.
     """
     logging.info(f"Activity get_last_timestamp_activity: Fetching timestamp for {tradingPair}")
-    try:
-        with get_connection() as conn:
-            with conn.cursor() as cursor:
-                query = """
-                SELECT Last_Processed_Timestamp 
-                FROM logging.TrackingTable 
-                WHERE Table_Name = 'RAW_INGESTION' AND Trading_Pair = ?
-                """
-                cursor.execute(query, (tradingPair,))
-                row = cursor.fetchone()
-                
-                if row:
-                    ts = row[0]
-                    logging.info(f"Activity get_last_timestamp_activity: Found timestamp {ts} for {tradingPair}")
-                    return ts.isoformat() if hasattr(ts, 'isoformat') else str(ts)
-                else:
-                    logging.info(f"Activity get_last_timestamp_activity: No record for {tradingPair}, using default {DEFAULT_START_DATE}")
-                    return DEFAULT_START_DATE
-    except Exception as e:
-        logging.error(f"Activity get_last_timestamp_activity: CRITICAL ERROR for {tradingPair}: {str(e)}")
-        # Re-raise the exception to ensure the orchestrator knows the activity failed.
-        raise
+    with telemetry.invocation("get_last_timestamp_activity", trading_pair=tradingPair) as invocation:
+        try:
+            with get_connection() as conn:
+                with conn.cursor() as cursor:
+                    timestamps = fetch_last_timestamps(cursor, [tradingPair])
+
+                    if tradingPair in timestamps:
+                        ts = timestamps[tradingPair]
+                        logging.info(f"Activity get_last_timestamp_activity: Found timestamp {ts} for {tradingPair}")
+                        return ts
+                    else:
+                        logging.info(f"Activity get_last_timestamp_activity: No record for {tradingPair}, using default {DEFAULT_START_DATE}")
+                        return DEFAULT_START_DATE
+        except Exception as e:
+            logging.error(f"Activity get_last_timestamp_activity: CRITICAL ERROR for {tradingPair}: {str(e)}")
+            # Re-raise the exception to ensure the orchestrator knows the activity failed.
+            raise
+
+@bp.activity_trigger(input_name="params")
+def get_table_timestamp_activity(params: dict) -> str:
+    """
+    Activity to fetch the watermark of a pair under another Table_Name than the klines,
+    e.g. {"trading_pair": "BTCUSDT", "table_name": "RAW_AGGTRADES"}. Without a record,
+    default_timestamp (or the default start date) is returned.
+    """
+    trading_pair = params.get("trading_pair")
+    table_name = params.get("table_name", RAW_INGESTION_TABLE)
+    default_timestamp = params.get("default_timestamp") or DEFAULT_START_DATE
+    logging.info(f"Activity get_table_timestamp_activity: Fetching {table_name} timestamp for {trading_pair}")
+    with telemetry.invocation("get_table_timestamp_activity", trading_pair=trading_pair, table_name=table_name):
+        try:
+            with get_connection() as conn:
+                with conn.cursor() as cursor:
+                    timestamps = fetch_last_timestamps(cursor, [trading_pair], table_name)
+            return timestamps.get(trading_pair, default_timestamp)
+        except Exception as e:
+            logging.error(f"Activity get_table_timestamp_activity: CRITICAL ERROR for {trading_pair}: {str(e)}")
+            raise
+
+@bp.activity_trigger(input_name="tradingPairs")
+def get_last_timestamps_activity(tradingPairs: list) -> dict:
+    """
+    Activity to fetch the last processed timestamps of many trading pairs in one query.
+    Pairs without a tracking record get the default start date.
+    """
+    logging.info(f"Activity get_last_timestamps_activity: Fetching timestamps for {len(tradingPairs)} pairs")
+    if not tradingPairs:
+        return {}
+    with telemetry.invocation("get_last_timestamps_activity") as invocation:
+        try:
+            with get_connection() as conn:
+                with conn.cursor() as cursor:
+                    timestamps = fetch_last_timestamps(cursor, tradingPairs)
+            invocation.add("rows", len(timestamps))
+            missing = [pair for pair in tradingPairs if pair not in timestamps]
+            if missing:
+                logging.info(f"Activity get_last_timestamps_activity: No record for {', '.join(missing)}, using default {DEFAULT_START_DATE}")
+            return {pair: timestamps.get(pair, DEFAULT_START_DATE) for pair in tradingPairs}
+        except Exception as e:
+            logging.error(f"Activity get_last_timestamps_activity: CRITICAL ERROR: {str(e)}")
+            raise
 
 @bp.activity_trigger(input_name="params")
 def update_tracking_activity(params: dict) -> bool:
@@ -53,42 +173,39 @@ def update_tracking_activity(params: dict) -> bool:
     """
     trading_pair = params.get("trading_pair")
     last_processed_timestamp_str = params.get("last_processed_timestamp")
-    record_count = params.get("record_count", 0)
-    full_refresh = params.get("full_refresh", False)
-    
+
     logging.info(f"Activity update_tracking_activity: Updating {trading_pair} to {last_processed_timestamp_str}")
-    
-    try:
-        last_processed_timestamp = parser.isoparse(last_processed_timestamp_str)
-        
-        with get_connection() as conn:
-            with conn.cursor() as cursor:
-                cursor.execute("SELECT COUNT(*) FROM logging.TrackingTable WHERE Table_Name = 'RAW_INGESTION' AND Trading_Pair = ?", (trading_pair,))
-                exists = cursor.fetchone()[0] > 0
-                
-                system_update_time = datetime.now(timezone.utc)
-                
-                if exists:
-                    query = """
-                    UPDATE logging.TrackingTable
-                    SET Last_Processed_Timestamp = ?,
-                        Record_Count = ?,
-                        System_Update_Time = ?,
-                        Full_refresh = ?
-                    WHERE Table_Name = 'RAW_INGESTION' AND Trading_Pair = ?
-                    """
-                    cursor.execute(query, (last_processed_timestamp, record_count, system_update_time, 1 if full_refresh else 0, trading_pair))
-                else:
-                    query = """
-                    INSERT INTO logging.TrackingTable (Table_Name, Trading_Pair, Last_Processed_Timestamp, Record_Count, System_Update_Time, Full_refresh)
-                    VALUES ('RAW_INGESTION', ?, ?, ?, ?, ?)
-                    """
-                    cursor.execute(query, (trading_pair, last_processed_timestamp, record_count, system_update_time, 1 if full_refresh else 0))
-                
-                conn.commit()
-                logging.info(f"Activity update_tracking_activity: Successfully updated tracking table for {trading_pair} to {last_processed_timestamp}")
-                return True
-    except Exception as e:
-        logging.error(f"Activity update_tracking_activity: CRITICAL ERROR updating tracking table for {trading_pair}: {str(e)}")
-        # Re-raise the exception.
-        raise
+
+    with telemetry.invocation("update_tracking_activity", trading_pair=trading_pair) as invocation:
+        try:
+            with get_connection() as conn:
+                with conn.cursor() as cursor:
+                    merge_tracking_updates(cursor, [params])
+                    invocation.add("rows", 1)
+                    logging.info(f"Activity update_tracking_activity: Successfully updated tracking table for {trading_pair} to {last_processed_timestamp_str}")
+                    return True
+        except Exception as e:
+            logging.error(f"Activity update_tracking_activity: CRITICAL ERROR updating tracking table for {trading_pair}: {str(e)}")
+            # Re-raise the exception.
+            raise
+
+@bp.activity_trigger(input_name="updates")
+def update_tracking_batch_activity(updates: list) -> int:
+    """
+    Activity to upsert the tracking records of many trading pairs in a single transaction.
+    Each update has the same shape as the update_tracking_activity input.
+    """
+    logging.info(f"Activity update_tracking_batch_activity: Applying {len(updates)} tracking updates")
+    if not updates:
+        return 0
+    with telemetry.invocation("update_tracking_batch_activity") as invocation:
+        try:
+            with get_connection() as conn:
+                with conn.cursor() as cursor:
+                    merge_tracking_updates(cursor, updates)
+            invocation.add("rows", len(updates))
+            logging.info(f"Activity update_tracking_batch_activity: Successfully applied {len(updates)} tracking updates")
+            return len(updates)
+        except Exception as e:
+            logging.error(f"Activity update_tracking_batch_activity: CRITICAL ERROR applying tracking updates: {str(e)}")
+            raise
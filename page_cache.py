@@ -0,0 +1,251 @@
+import logging
+import os
+import threading
+import time
+import zlib
+
+# Closed kline pages kept across retries and reruns, so a month that failed partway
+# through refetches only the pages it never got. The SDKs behind the blob tier are
+# imported on first use, like in client_registry.
+
+# A page is only cached once its last candle closed at least this long ago; until then
+# Binance may still be publishing it.
+SETTLE_MS = 60_000
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_page_key(symbol: str, interval: str, start_ms: int, end_ms: int) -> str:
+    """
+    A page is fully determined by its request window, so the window is the key.
+    """
+    return f"{symbol}/{interval}/{start_ms}-{end_ms}"
+
+def is_page_closed(interval_ms: int, end_ms: int, now_ms: int = None) -> bool:
+    """
+    Whether every candle a request for [.., end_ms] can return has closed and settled.
+    """
+    if now_ms is None:
+        now_ms = int(time.time() * 1000)
+    return end_ms + interval_ms + SETTLE_MS <= now_ms
+
+class DiskPageStore:
+    """
+    Pages as files under `directory`, evicted least recently used first once they
+    take more than `max_bytes`. A hit touches the file's mtime. Files are written to a
+    temporary name and renamed, so processes sharing the directory never read a torn page.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.current_bytes = None
+        self._lock = threading.Lock()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, *key.split("/")) + ".json.z"
+
+    def get(self, key: str) -> bytes:
+        path = self._path(key)
+        try:
+            with open(path, "rb") as page_file:
+                data = page_file.read()
+            os.utime(path)
+            return data
+        except FileNotFoundError:
+            return None
+
+    def delete(self, key: str) -> None:
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def discard(self, symbol: str, interval: str, start_ms: int, end_ms: int) -> int:
+        """
+        Delete the pages whose window starts in [start_ms, end_ms).
+        """
+        folder = os.path.join(self.directory, symbol, interval)
+        try:
+            names = os.listdir(folder)
+        except FileNotFoundError:
+            return 0
+        deleted = 0
+        for name in names:
+            window_start = name.split("-", 1)[0]
+            if window_start.isdigit() and start_ms <= int(window_start) < end_ms:
+                try:
+                    os.remove(os.path.join(folder, name))
+                    deleted += 1
+                except FileNotFoundError:
+                    pass
+        if deleted:
+            with self._lock:
+                # Recounted on the next put.
+                self.current_bytes = None
+        return deleted
+
+    def put(self, key: str, data: bytes) -> None:
+        if len(data) > self.max_bytes:
+            return
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporary_path, "wb") as page_file:
+            page_file.write(data)
+        os.replace(temporary_path, path)
+        with self._lock:
+            if self.current_bytes is None:
+                self.current_bytes = self._scan()[1]
+            else:
+                self.current_bytes += len(data)
+            if self.current_bytes > self.max_bytes:
+                self._evict()
+
+    def _scan(self) -> tuple:
+        files = []
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+        return files, sum(size for _, size, _ in files)
+
+    def _evict(self) -> None:
+        # Rescanned rather than tracked, since other processes may share the directory.
+        # Evicts down to 90% so the next few puts don't each trigger a scan.
+        files, total = self._scan()
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes * 0.9:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        self.current_bytes = total
+
+class BlobPageStore:
+    """
+    Pages staged as blobs under `prefix`, shared by every worker, so a retry that
+    lands on another instance still finds them. Staged pages are deleted once their
+    month is committed.
+    """
+
+    def __init__(self, container_client, prefix: str):
+        self.container_client = container_client
+        self.prefix = prefix
+
+    def get(self, key: str) -> bytes:
+        from azure.core.exceptions import ResourceNotFoundError
+        try:
+            return self.container_client.get_blob_client(f"{self.prefix}{key}").download_blob().readall()
+        except ResourceNotFoundError:
+            return None
+
+    def put(self, key: str, data: bytes) -> None:
+        self.container_client.get_blob_client(f"{self.prefix}{key}").upload_blob(data, overwrite=True)
+
+    def delete(self, key: str) -> None:
+        from azure.core.exceptions import ResourceNotFoundError
+        try:
+            self.container_client.delete_blob(f"{self.prefix}{key}")
+        except ResourceNotFoundError:
+            pass
+
+    def discard(self, symbol: str, interval: str, start_ms: int, end_ms: int) -> int:
+        """
+        Delete the staged pages whose window starts in [start_ms, end_ms).
+        """
+        from azure.core.exceptions import ResourceNotFoundError
+        folder = f"{self.prefix}{symbol}/{interval}/"
+        deleted = 0
+        for blob in self.container_client.list_blobs(name_starts_with=folder):
+            window_start = int(blob.name[len(folder):].split("-", 1)[0])
+            if start_ms <= window_start < end_ms:
+                try:
+                    self.container_client.delete_blob(blob.name)
+                    deleted += 1
+                except ResourceNotFoundError:
+                    pass
+        return deleted
+
+class PageCache:
+    """
+    Raw klines response bodies of closed pages, compressed, looked up in each store in
+    turn. A hit in a later store is copied into the earlier ones. The cache never fails
+    a fetch: store errors and corrupt entries are logged and treated as misses.
+    """
+
+    def __init__(self, stores: list):
+        self.stores = stores
+
+    def get(self, key: str) -> bytes:
+        for index, store in enumerate(self.stores):
+            try:
+                data = store.get(key)
+                if data is None:
+                    continue
+                body = zlib.decompress(data)
+            except zlib.error as e:
+                # A truncated or corrupt entry is a miss; drop it so it is fetched and cached again.
+                logging.warning(f"Page cache: Discarding corrupt {key} in {type(store).__name__}: {str(e)}")
+                self._delete(store, key)
+                continue
+            except Exception as e:
+                logging.warning(f"Page cache: Could not read {key} from {type(store).__name__}: {str(e)}")
+                continue
+            for earlier in self.stores[:index]:
+                self._put(earlier, key, data)
+            return body
+        return None
+
+    def put(self, key: str, body: bytes) -> None:
+        data = zlib.compress(body, 1)
+        for store in self.stores:
+            self._put(store, key, data)
+
+    def _put(self, store, key: str, data: bytes) -> None:
+        try:
+            store.put(key, data)
+        except Exception as e:
+            logging.warning(f"Page cache: Could not write {key} to {type(store).__name__}: {str(e)}")
+
+    def _delete(self, store, key: str) -> None:
+        try:
+            store.delete(key)
+        except Exception as e:
+            logging.warning(f"Page cache: Could not delete {key} from {type(store).__name__}: {str(e)}")
+
+    def discard(self, symbol: str, interval: str, start_ms: int, end_ms: int) -> None:
+        """
+        Drop the pages of a committed window from every store; only a rewrite would read them again.
+        """
+        for store in self.stores:
+            try:
+                store.discard(symbol, interval, start_ms, end_ms)
+            except Exception as e:
+                logging.warning(f"Page cache: Could not discard pages of {symbol} from {type(store).__name__}: {str(e)}")
+
+def get_page_cache() -> PageCache:
+    """
+    Process-wide cache: if PAGE_CACHE_DIR is set, a local directory bounded by
+    PAGE_CACHE_MAX_MB, and if PAGE_CACHE_BLOB_PREFIX is set, a staging prefix in the raw
+    container. Both are opt-in; returns None when neither is set.
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            stores = []
+            directory = os.environ.get("PAGE_CACHE_DIR", "")
+            if directory:
+                stores.append(DiskPageStore(directory, int(float(os.environ.get("PAGE_CACHE_MAX_MB", "256")) * 2 ** 20)))
+            blob_prefix = os.environ.get("PAGE_CACHE_BLOB_PREFIX", "")
+            if blob_prefix:
+                from client_registry import get_container_client
+                stores.append(BlobPageStore(get_container_client("raw"), blob_prefix.rstrip("/") + "/"))
+            _cache = PageCache(stores)
+        return _cache if _cache.stores else None
@@ -0,0 +1,110 @@
+import azure.functions as func
+import json
+import logging
+import os
+import time
+import telemetry
+from binance_client import FetchStats, fetch_24h_quote_volumes, fetch_exchange_info
+from client_registry import get_container_client
+
+bp = func.Blueprint()
+
+# Trimmed copy of exchangeInfo shared by every run, so the universe costs one request a day at most.
+EXCHANGE_INFO_CACHE_PATH = "binance/_exchange_info.json"
+
+# The pairs ingested unless TRADING_PAIRS or UNIVERSE_SOURCE=exchange_info says otherwise.
+DEFAULT_TRADING_PAIRS = "BTCUSDT,ETHUSDT,SOLUSDT,LINKUSDT,MATICUSDT"
+
+UNIVERSE_SOURCES = ("static", "exchange_info")
+
+def get_setting_list(name: str, default: str = "") -> list:
+    return [value.strip().upper() for value in os.environ.get(name, default).split(",") if value.strip()]
+
+def select_trading_pairs(exchange_info: dict, quote_assets: list, statuses: list, excluded: list = (), max_pairs: int = 0) -> list:
+    """
+    Spot symbols quoted in one of `quote_assets` whose status is one of `statuses`, sorted.
+    With max_pairs, only that many are kept, the highest 24h quote volume first.
+    """
+    pairs = [
+        symbol["symbol"] for symbol in exchange_info.get("symbols", [])
+        if symbol.get("quoteAsset") in quote_assets
+        and symbol.get("status") in statuses
+        and symbol.get("isSpotTradingAllowed", True)
+        and symbol["symbol"] not in excluded
+    ]
+    if max_pairs:
+        quote_volumes = exchange_info.get("quote_volumes") or {}
+        pairs = sorted(pairs, key=lambda pair: (-quote_volumes.get(pair, 0.0), pair))[:max_pairs]
+    return sorted(pairs)
+
+def load_exchange_info(container_client, max_age_seconds: float, with_volumes: bool = False) -> dict:
+    """
+    Return the cached exchangeInfo, refreshing it from Binance once it is older than
+    max_age_seconds. A stale cache is still used if the refresh fails. With `with_volumes`
+    the cache also carries each symbol's 24h quote volume, and one without them is refreshed.
+    """
+    from azure.core.exceptions import ResourceNotFoundError
+    blob_client = container_client.get_blob_client(EXCHANGE_INFO_CACHE_PATH)
+    cached = None
+    try:
+        cached = json.loads(blob_client.download_blob().readall())
+    except ResourceNotFoundError:
+        pass
+    if cached is not None and time.time() - cached["fetched_at"] < max_age_seconds and (not with_volumes or cached.get("quote_volumes")):
+        return cached
+
+    try:
+        stats = FetchStats()
+        exchange_info = fetch_exchange_info(stats)
+        quote_volumes = fetch_24h_quote_volumes(stats) if with_volumes else None
+        stats.add_to_telemetry()
+    except Exception as e:
+        if cached is None:
+            raise
+        logging.warning(f"Pair universe: Could not refresh exchangeInfo, using the copy from {cached['fetched_at']}: {str(e)}")
+        return cached
+
+    # Only the fields the filter needs; the full document is several MB.
+    trimmed = {
+        "fetched_at": time.time(),
+        "symbols": [
+            {key: symbol.get(key) for key in ("symbol", "status", "baseAsset", "quoteAsset", "isSpotTradingAllowed")}
+            for symbol in exchange_info.get("symbols", [])
+        ],
+        "quote_volumes": quote_volumes
+    }
+    blob_client.upload_blob(json.dumps(trimmed).encode("utf-8"), overwrite=True)
+    return trimmed
+
+@bp.activity_trigger(input_name="params")
+def get_trading_pair_universe_activity(params: dict) -> list:
+    """
+    Activity to resolve the trading pairs to ingest. By default (UNIVERSE_SOURCE=static)
+    that is TRADING_PAIRS, or the five default pairs if it is unset. With
+    UNIVERSE_SOURCE=exchange_info the pairs come from the cached exchangeInfo filtered by
+    UNIVERSE_QUOTE_ASSETS and UNIVERSE_STATUSES, minus UNIVERSE_EXCLUDE, and capped at
+    the UNIVERSE_MAX_PAIRS with the highest 24h quote volume.
+    """
+    source = os.environ.get("UNIVERSE_SOURCE", "static").lower()
+    if source not in UNIVERSE_SOURCES:
+        raise ValueError(f"Unsupported UNIVERSE_SOURCE '{source}'. Expected one of: {', '.join(UNIVERSE_SOURCES)}")
+    configured = get_setting_list("TRADING_PAIRS")
+    if configured or source == "static":
+        pairs = configured or get_setting_list("TRADING_PAIRS", DEFAULT_TRADING_PAIRS)
+        logging.info(f"Activity get_trading_pair_universe_activity: Using {len(pairs)} {'configured' if configured else 'default'} pairs")
+        return pairs
+
+    with telemetry.invocation("get_trading_pair_universe_activity") as invocation:
+        try:
+            quote_assets = get_setting_list("UNIVERSE_QUOTE_ASSETS", "USDT")
+            statuses = get_setting_list("UNIVERSE_STATUSES", "TRADING")
+            max_age_seconds = float(os.environ.get("EXCHANGE_INFO_CACHE_HOURS", "24")) * 3600
+            max_pairs = int(os.environ.get("UNIVERSE_MAX_PAIRS", "0"))
+            exchange_info = load_exchange_info(get_container_client("raw"), max_age_seconds, with_volumes=bool(max_pairs))
+            pairs = select_trading_pairs(exchange_info, quote_assets, statuses, get_setting_list("UNIVERSE_EXCLUDE"), max_pairs)
+            invocation.add("pairs", len(pairs))
+            logging.info(f"Activity get_trading_pair_universe_activity: {len(pairs)} {'/'.join(quote_assets)} pairs with status {'/'.join(statuses)}")
+            return pairs
+        except Exception as e:
+            logging.error(f"Activity get_trading_pair_universe_activity: Error resolving the pair universe: {str(e)}")
+            raise
@@ -0,0 +1,105 @@
+import azure.functions as func
+import azure.durable_functions as df
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from dateutil.relativedelta import relativedelta
+from client_registry import get_container_client
+
+bp = func.Blueprint()
+
+# Conditional writes that lose a race re-read the manifest and try again.
+MAX_UPDATE_ATTEMPTS = 10
+
+MANIFEST_READ_CONCURRENCY = 16
+
+def get_manifest_path(trading_pair: str) -> str:
+    return f"binance/{trading_pair}/_manifest.json"
+
+def get_partition_key(year: int, month: int) -> str:
+    return f"{year}/{month:02d}"
+
+def load_manifest(container_client, trading_pair: str) -> tuple:
+    """
+    Return (manifest, etag). A pair without a manifest yields an empty manifest and a None etag.
+    """
+    from azure.core.exceptions import ResourceNotFoundError
+    blob_client = container_client.get_blob_client(get_manifest_path(trading_pair))
+    try:
+        download = blob_client.download_blob()
+    except ResourceNotFoundError:
+        return {"trading_pair": trading_pair, "partitions": {}}, None
+    return json.loads(download.readall()), download.properties.etag
+
+def update_manifest_partition(container_client, trading_pair: str, partition_key: str, entry: dict) -> dict:
+    """
+    Record `entry` under `partition_key` with an ETag-conditional write, so concurrent
+    month activities for the same pair never overwrite each other's entries.
+    """
+    from azure.core import MatchConditions
+    from azure.core.exceptions import ResourceExistsError, ResourceModifiedError
+    blob_client = container_client.get_blob_client(get_manifest_path(trading_pair))
+    for attempt in range(MAX_UPDATE_ATTEMPTS):
+        manifest, etag = load_manifest(container_client, trading_pair)
+        current = {key: value for key, value in manifest["partitions"].get(partition_key, {}).items() if key != "updated_at"}
+        if etag is not None and current == entry:
+            # Reruns that change nothing don't rewrite the manifest either.
+            return manifest
+        manifest["partitions"][partition_key] = {**entry, "updated_at": datetime.now(timezone.utc).isoformat()}
+        payload = json.dumps(manifest, sort_keys=True).encode("utf-8")
+        try:
+            if etag is None:
+                blob_client.upload_blob(payload, if_none_match="*")
+            else:
+                blob_client.upload_blob(payload, overwrite=True, etag=etag, match_condition=MatchConditions.IfNotModified)
+            return manifest
+        except (ResourceExistsError, ResourceModifiedError):
+            logging.info(f"Partition manifest: Concurrent update of {trading_pair} manifest, retrying ({attempt + 1}/{MAX_UPDATE_ATTEMPTS})")
+    raise RuntimeError(f"Could not update the {trading_pair} manifest after {MAX_UPDATE_ATTEMPTS} attempts.")
+
+def compute_manifest_watermark(manifest: dict, current_utc_now: datetime) -> str:
+    """
+    Watermark in the same form as the tracking table: the start of the first month that
+    is missing or incomplete, counting from the earliest recorded partition, or just after
+    the last closed candle once every historical month is complete. None if nothing has
+    been recorded yet.
+    """
+    partitions = manifest.get("partitions", {})
+    if not partitions:
+        return None
+
+    first_year, first_month = (int(part) for part in min(partitions).split("/"))
+    month = datetime(first_year, first_month, 1, tzinfo=timezone.utc)
+    current_month = current_utc_now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    while month < current_month:
+        entry = partitions.get(get_partition_key(month.year, month.month))
+        if not entry or not entry.get("complete"):
+            return month.isoformat()
+        month += relativedelta(months=1)
+
+    entry = partitions.get(get_partition_key(current_month.year, current_month.month))
+    if entry and entry.get("max_close_time") is not None:
+        return datetime.fromtimestamp((entry["max_close_time"] + 1) / 1000, tz=timezone.utc).isoformat()
+    return current_month.isoformat()
+
+@bp.activity_trigger(input_name="tradingPairs")
+def get_manifest_watermarks_activity(tradingPairs: list) -> dict:
+    """
+    Activity to plan from the blob manifests alone, without the SQL pool.
+    Returns {pair: watermark}; pairs without a manifest map to None.
+    """
+    logging.info(f"Activity get_manifest_watermarks_activity: Reading manifests for {len(tradingPairs)} pairs")
+    try:
+        container_client = get_container_client("raw")
+        current_utc_now = datetime.now(timezone.utc)
+        # One blob read per pair; with hundreds of pairs the round trips dominate, so overlap them.
+        with ThreadPoolExecutor(max_workers=MANIFEST_READ_CONCURRENCY) as executor:
+            manifests = executor.map(lambda trading_pair: load_manifest(container_client, trading_pair)[0], tradingPairs)
+            watermarks = {trading_pair: compute_manifest_watermark(manifest, current_utc_now) for trading_pair, manifest in zip(tradingPairs, manifests)}
+        for trading_pair, watermark in watermarks.items():
+            logging.info(f"Activity get_manifest_watermarks_activity: {trading_pair} watermark {watermark}")
+        return watermarks
+    except Exception as e:
+        logging.error(f"Activity get_manifest_watermarks_activity: Error reading manifests: {str(e)}")
+        raise
@@ -1,10 +1,11 @@
 import azure.functions as func
 import azure.durable_functions as df
 import logging
-import time
 import os
-import requests
-from azure.identity import DefaultAzureCredential
+import time
+from datetime import timedelta
+import telemetry
+from client_registry import get_access_token, get_http_session
 
 bp = func.Blueprint()
 
@@ -26,100 +27,126 @@ def get_synapse_management_url():
     return f"https://management.azure.com/subscriptions/{subscription_id}/resourceGroups/{resource_group}/providers/Microsoft.Synapse/workspaces/{workspace_name}/sqlPools/{sql_pool_name}?api-version=2021-06-01"
 
 def get_auth_token():
-    credential = DefaultAzureCredential()
-    token = credential.get_token("https://management.azure.com/.default")
-    return token.token
+    # Cached credential and token, refreshed shortly before expiry.
+    return get_access_token()
+
+# The action to request for each target status, and the status it has to start from.
+POOL_TRANSITIONS = {
+    "Online": ("resume", "Paused"),
+    "Paused": ("pause", "Online"),
+}
+
+def call_management_api(method: str, url: str, headers: dict):
+    """
+    Send a management API request, recording it against the current telemetry invocation.
+    """
+    started = time.perf_counter()
+    with telemetry.span("management_api"):
+        response = get_http_session().request(method, url, headers=headers)
+    invocation = telemetry.current_invocation()
+    if invocation is not None:
+        invocation.add("requests")
+        invocation.add("bytes_downloaded", len(response.content))
+        invocation.latency.observe(time.perf_counter() - started)
+    response.raise_for_status()
+    return response
+
+def get_pool_status(url: str, headers: dict) -> str:
+    response = call_management_api("GET", url, headers)
+    return response.json().get("properties", {}).get("status")
+
+@bp.activity_trigger(input_name="dummy")
+def get_synapse_status_activity(dummy: str) -> str:
+    """
+    Return the current status of the Synapse Dedicated SQL Pool without waiting.
+    """
+    with telemetry.invocation("get_synapse_status_activity"):
+        try:
+            headers = {"Authorization": f"Bearer {get_auth_token()}", "Content-Type": "application/json"}
+            status = get_pool_status(get_synapse_management_url(), headers)
+            logging.info(f"Activity get_synapse_status_activity: Current status is {status}")
+            return status
+        except Exception as e:
+            logging.error(f"Activity get_synapse_status_activity: Error reading Synapse status: {str(e)}")
+            raise
+
+def request_pool_transition(target_status: str, activity_name: str) -> str:
+    """
+    Send a resume or pause request if the pool is not already heading to `target_status`,
+    recorded as one telemetry invocation of `activity_name`. Returns immediately with the
+    status observed before the request.
+    """
+    action, required_status = POOL_TRANSITIONS[target_status]
+    with telemetry.invocation(activity_name, target_status=target_status) as invocation:
+        try:
+            url = get_synapse_management_url()
+            action_url = f"{url.split('?')[0]}/{action}?api-version=2021-06-01"
+            headers = {"Authorization": f"Bearer {get_auth_token()}", "Content-Type": "application/json"}
+            status = get_pool_status(url, headers)
+            logging.info(f"Activity {activity_name}: Current status is {status}, target {target_status}")
+            if status == required_status:
+                logging.info(f"Activity {activity_name}: Sending {action} request.")
+                call_management_api("POST", action_url, headers)
+                invocation.set(action=action)
+            return status
+        except Exception as e:
+            logging.error(f"Activity {activity_name}: Error requesting {action}: {str(e)}")
+            raise
+
+@bp.activity_trigger(input_name="targetStatus")
+def request_synapse_transition_activity(targetStatus: str) -> str:
+    """
+    Send a resume or pause request if the pool is not already heading to `targetStatus`.
+    Returns immediately with the status observed before the request.
+    """
+    return request_pool_transition(targetStatus, "request_synapse_transition_activity")
 
+# Kept under their old names so orchestrations started before synapse_pool_orchestrator
+# replaced them still find their activities. They no longer wait for the transition.
 @bp.activity_trigger(input_name="dummy")
 def resume_synapse_activity(dummy: str) -> str:
     """
-    Resume the Synapse Dedicated SQL Pool and poll until Online.
+    Request a resume and return the status observed before it.
     """
-    logging.info("Activity resume_synapse_activity: Starting resume process.")
-    url = get_synapse_management_url()
-    resume_url = f"{url.split('?')[0]}/resume?api-version=2021-06-01"
-    
-    try:
-        token = get_auth_token()
-        headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
-        
-        # Check current status first
-        response = requests.get(url, headers=headers)
-        response.raise_for_status() # raise an exception for HTTP errors
-        status = response.json().get("properties", {}).get("status")
-        logging.info(f"Activity resume_synapse_activity: Current status is {status}")
-        
-        if status == "Online":
-            logging.info("Activity resume_synapse_activity: Synapse is already Online.")
-            return "Online"
-            
-        if status == "Paused":
-            logging.info("Activity resume_synapse_activity: Sending resume request.")
-            resume_response = requests.post(resume_url, headers=headers)
-            resume_response.raise_for_status()
-            
-        # Poll for status
-        for i in range(20):
-            time.sleep(30)
-            response = requests.get(url, headers=headers)
-            response.raise_for_status()
-            status = response.json().get("properties", {}).get("status")
-            logging.info(f"Activity resume_synapse_activity: Polling attempt {i+1}, status: {status}")
-            
-            if status == "Online":
-                logging.info("Activity resume_synapse_activity: Synapse is now Online.")
-                return "Online"
-        
-        logging.error(f"Activity resume_synapse_activity: Synapse did not become Online after polling. Final status: {status}")
-        return status
-        
-    except Exception as e:
-        logging.error(f"Activity resume_synapse_activity: Error resuming Synapse: {str(e)}")
-        raise
+    return request_pool_transition("Online", "resume_synapse_activity")
 
 @bp.activity_trigger(input_name="dummy")
 def pause_synapse_activity(dummy: str) -> str:
     """
-    Pause the Synapse Dedicated SQL Pool and poll until Paused.
+    Request a pause and return the status observed before it.
     """
-    logging.info("Activity pause_synapse_activity: Starting pause process.")
-    url = get_synapse_management_url()
-    pause_url = f"{url.split('?')[0]}/pause?api-version=2021-06-01"
-    
-    try:
-        token = get_auth_token()
-        headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
-        
-        # Check current status first
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()
-        status = response.json().get("properties", {}).get("status")
-        logging.info(f"Activity pause_synapse_activity: Current status is {status}")
-        
-        if status == "Paused":
-            logging.info("Activity pause_synapse_activity: Synapse is already Paused.")
-            return "Paused"
-            
-        if status == "Online":
-            logging.info("Activity pause_synapse_activity: Sending pause request.")
-            pause_response = requests.post(pause_url, headers=headers)
-            pause_response.raise_for_status()
-            
-        # Poll for status
-        for i in range(20):
-            time.sleep(30)
-            response = requests.get(url, headers=headers)
-            response.raise_for_status()
-            status = response.json().get("properties", {}).get("status")
-            logging.info(f"Activity pause_synapse_activity: Polling attempt {i+1}, status: {status}")
-            
-            if status == "Paused":
-                logging.info("Activity pause_synapse_activity: Synapse is now Paused.")
-                return "Paused"
-        
-        logging.error(f"Activity pause_synapse_activity: Synapse did not become Paused after polling. Final status: {status}")
-        return status
-        
-    except Exception as e:
-        logging.error(f"Activity pause_synapse_activity: Error pausing Synapse: {str(e)}")
-        raise
\ No newline at end of file
+    return request_pool_transition("Paused", "pause_synapse_activity")
+
+@bp.orchestration_trigger(context_name="context")
+def synapse_pool_orchestrator(context: df.DurableOrchestrationContext):
+    """
+    Drive the pool to the target status and wait for it with durable timers, so no
+    activity worker sits in time.sleep while Synapse transitions. If the pool settles
+    in the status the transition starts from (e.g. a pause finishing while it should
+    resume), the request is sent again.
+    Input: {"target_status": "Online" | "Paused", "max_wait_seconds": 900}
+    """
+    input_data = context.get_input() or {}
+    target_status = input_data.get("target_status", "Online")
+    required_status = POOL_TRANSITIONS[target_status][1]
+    max_wait_seconds = input_data.get("max_wait_seconds", 900)
+    instance_id = context.instance_id
+
+    status = yield context.call_activity("request_synapse_transition_activity", target_status)
+    deadline = context.current_utc_datetime + timedelta(seconds=max_wait_seconds)
+    delay_seconds = 15
+    while status != target_status:
+        if context.current_utc_datetime >= deadline:
+            logging.error(f"Synapse Orchestrator {instance_id}: Pool did not become {target_status} within {max_wait_seconds}s. Final status: {status}")
+            return status
+        fire_at = min(context.current_utc_datetime + timedelta(seconds=delay_seconds), deadline)
+        yield context.create_timer(fire_at)
+        delay_seconds = min(delay_seconds * 2, 120)
+        status = yield context.call_activity("get_synapse_status_activity", None)
+        logging.info(f"Synapse Orchestrator {instance_id}: Status {status}, waiting for {target_status}")
+        if status == required_status:
+            logging.info(f"Synapse Orchestrator {instance_id}: Pool is {status}; requesting {target_status} again.")
+            status = yield context.call_activity("request_synapse_transition_activity", target_status)
+
+    logging.info(f"Synapse Orchestrator {instance_id}: Pool is {target_status}.")
+    return status
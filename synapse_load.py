@@ -0,0 +1,316 @@
+import azure.functions as func
+import azure.durable_functions as df
+import hashlib
+import json
+import logging
+import os
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from dateutil.relativedelta import relativedelta
+import telemetry
+from client_registry import get_container_client, sql_connection
+from partition_manifest import MANIFEST_READ_CONCURRENCY, MAX_UPDATE_ATTEMPTS, load_manifest
+
+bp = func.Blueprint()
+
+# What each month of the fact table was last loaded from, so only months whose
+# partitions changed since are reloaded.
+LOAD_LOG_PATH = "binance/_synapse_loads.json"
+
+STAGE_SCHEMA = "stage"
+
+SQL_TYPES = {"int64": "BIGINT", "int32": "INT", "float64": "FLOAT"}
+
+def get_fact_table() -> str:
+    return os.environ.get("SYNAPSE_KLINES_TABLE", "dbo.Klines_1m")
+
+def get_month_key(year: int, month: int) -> int:
+    return year * 100 + month
+
+def next_month_key(month_key: int) -> int:
+    return month_key + 1 if month_key % 100 < 12 else (month_key // 100 + 1) * 100 + 1
+
+def get_column_definitions() -> str:
+    from kline_storage import COLUMN_DTYPES
+    columns = ["trading_pair NVARCHAR(50) NOT NULL"]
+    columns.extend(f"{name} {SQL_TYPES[dtype]}{' NOT NULL' if name == 'open_time' else ''}" for name, dtype in COLUMN_DTYPES.items())
+    return ", ".join(columns)
+
+def get_column_list() -> str:
+    from kline_storage import FINAL_COLUMNS
+    return ", ".join(FINAL_COLUMNS)
+
+def build_month_plan(manifests: dict) -> dict:
+    """
+    Group the partitions of every pair by month: {month_key: {"files": {format: [pair]},
+    "record_count": n, "fingerprint": ...}}. The fingerprint changes whenever any pair's
+    partition of the month does.
+    """
+    months = {}
+    for trading_pair, manifest in sorted(manifests.items()):
+        for partition_key, entry in manifest.get("partitions", {}).items():
+            if not entry.get("path") or not entry.get("record_count"):
+                continue
+            year, month = (int(part) for part in partition_key.split("/"))
+            plan = months.setdefault(get_month_key(year, month), {"files": {}, "record_count": 0, "versions": []})
+            plan["files"].setdefault(entry["format"], []).append(trading_pair)
+            plan["record_count"] += entry["record_count"]
+            plan["versions"].append(f"{trading_pair}:{entry['format']}:{entry['record_count']}:{entry.get('checksum') or entry.get('updated_at')}")
+    for plan in months.values():
+        plan["fingerprint"] = hashlib.sha256("\n".join(plan.pop("versions")).encode("utf-8")).hexdigest()
+    return months
+
+def load_load_log(container_client) -> tuple:
+    from azure.core.exceptions import ResourceNotFoundError
+    try:
+        download = container_client.get_blob_client(LOAD_LOG_PATH).download_blob()
+    except ResourceNotFoundError:
+        return {"months": {}}, None
+    return json.loads(download.readall()), download.properties.etag
+
+def record_month_loaded(container_client, month_key: int, entry: dict) -> None:
+    """
+    ETag-conditional read-modify-write, since months load side by side.
+    """
+    from azure.core import MatchConditions
+    from azure.core.exceptions import ResourceExistsError, ResourceModifiedError
+    blob_client = container_client.get_blob_client(LOAD_LOG_PATH)
+    for attempt in range(MAX_UPDATE_ATTEMPTS):
+        load_log, etag = load_load_log(container_client)
+        load_log["months"][str(month_key)] = {**entry, "loaded_at": datetime.now(timezone.utc).isoformat()}
+        payload = json.dumps(load_log, sort_keys=True).encode("utf-8")
+        try:
+            if etag is None:
+                blob_client.upload_blob(payload, if_none_match="*")
+            else:
+                blob_client.upload_blob(payload, overwrite=True, etag=etag, match_condition=MatchConditions.IfNotModified)
+            return
+        except (ResourceExistsError, ResourceModifiedError):
+            logging.info(f"Synapse load: Concurrent update of the load log, retrying ({attempt + 1}/{MAX_UPDATE_ATTEMPTS})")
+    raise RuntimeError(f"Could not update the load log after {MAX_UPDATE_ATTEMPTS} attempts.")
+
+def list_lake_pairs(container_client) -> list:
+    """
+    Every pair folder under binance/. Folders starting with "_" hold shared state, not pairs.
+    """
+    return sorted(
+        prefix.name.split("/")[1] for prefix in container_client.walk_blobs(name_starts_with="binance/", delimiter="/")
+        if prefix.name.endswith("/") and not prefix.name.split("/")[1].startswith("_")
+    )
+
+def get_partition_boundaries(cursor, table: str) -> list:
+    cursor.execute("""
+    SELECT CAST(prv.value AS INT)
+    FROM sys.tables AS t
+    JOIN sys.indexes AS i ON i.object_id = t.object_id AND i.index_id <= 1
+    JOIN sys.partition_schemes AS ps ON ps.data_space_id = i.data_space_id
+    JOIN sys.partition_range_values AS prv ON prv.function_id = ps.function_id
+    WHERE t.object_id = OBJECT_ID(?)
+    ORDER BY prv.boundary_id
+    """, (table,))
+    return [row[0] for row in cursor.fetchall()]
+
+def get_partition_number(boundaries: list, month_key: int) -> int:
+    # RANGE RIGHT: partition n holds [boundary n-1, boundary n).
+    return bisect_right(boundaries, month_key) + 1
+
+def build_partition_clause(boundaries: list) -> str:
+    return f"PARTITION (month_key RANGE RIGHT FOR VALUES ({', '.join(str(boundary) for boundary in boundaries)}))"
+
+def get_copy_credential(container_client) -> str:
+    """
+    CREDENTIAL clause for COPY INTO, from SYNAPSE_COPY_IDENTITY: the pool's managed identity
+    (default) or "Shared Access Signature". A SAS is generated per load, read and list only
+    on the container and expiring after SYNAPSE_COPY_SAS_MINUTES, because COPY INTO only
+    takes an inline secret and its text ends up in the pool's request history.
+    """
+    identity = os.environ.get("SYNAPSE_COPY_IDENTITY", "Managed Identity")
+    if identity == "Managed Identity":
+        return "IDENTITY = 'Managed Identity'"
+    if identity != "Shared Access Signature":
+        raise ValueError(f"Unsupported SYNAPSE_COPY_IDENTITY '{identity}'. Expected 'Managed Identity' or 'Shared Access Signature'.")
+    from azure.storage.blob import ContainerSasPermissions, generate_container_sas
+    account_key = getattr(container_client.credential, "account_key", None)
+    if not account_key:
+        raise ValueError("SYNAPSE_COPY_IDENTITY 'Shared Access Signature' needs a storage client authorized with the account key to sign it.")
+    expiry = datetime.now(timezone.utc) + relativedelta(minutes=int(os.environ.get("SYNAPSE_COPY_SAS_MINUTES", "60")))
+    sas_token = generate_container_sas(
+        container_client.account_name, container_client.container_name, account_key=account_key,
+        permission=ContainerSasPermissions(read=True, list=True), expiry=expiry
+    )
+    return f"IDENTITY = 'Shared Access Signature', SECRET = '{sas_token}'"
+
+def build_copy_statement(table: str, urls: list, output_format: str, credential: str) -> str:
+    """
+    One COPY INTO for every file of one format. The files are written by this pipeline,
+    so their URLs are safe to inline.
+    """
+    options = "FILE_TYPE = 'PARQUET'" if output_format == "parquet" else "FILE_TYPE = 'CSV', FIRSTROW = 2"
+    locations = ", ".join(f"'{url}'" for url in urls)
+    return f"COPY INTO {table} ({get_column_list()}) FROM {locations} WITH ({options}, CREDENTIAL = ({credential}))"
+
+@bp.activity_trigger(input_name="params")
+def plan_synapse_loads_activity(params: dict) -> list:
+    """
+    Activity to list the months of the lake that the fact table does not hold yet:
+    months whose partitions changed since they were last loaded, oldest first.
+    """
+    logging.info(f"Activity plan_synapse_loads_activity: Planning loads into {get_fact_table()}")
+    with telemetry.invocation("plan_synapse_loads_activity") as invocation:
+        try:
+            container_client = get_container_client("raw")
+            # Every pair in the lake: a month partition is swapped in whole, so it must hold every pair.
+            trading_pairs = list_lake_pairs(container_client)
+            with ThreadPoolExecutor(max_workers=MANIFEST_READ_CONCURRENCY) as executor:
+                manifests = dict(zip(trading_pairs, executor.map(lambda trading_pair: load_manifest(container_client, trading_pair)[0], trading_pairs)))
+            load_log, _ = load_load_log(container_client)
+            loads = [
+                {"month_key": month_key, **plan}
+                for month_key, plan in sorted(build_month_plan(manifests).items())
+                if load_log["months"].get(str(month_key), {}).get("fingerprint") != plan["fingerprint"]
+            ]
+            invocation.add("months", len(loads))
+            logging.info(f"Activity plan_synapse_loads_activity: {len(loads)} months of {len(trading_pairs)} pairs need loading")
+            return loads
+        except Exception as e:
+            logging.error(f"Activity plan_synapse_loads_activity: Error planning loads: {str(e)}")
+            raise
+
+@bp.activity_trigger(input_name="params")
+def prepare_synapse_fact_activity(params: dict) -> list:
+    """
+    Activity to create the fact table and its staging schema if missing, and split
+    in month boundaries up to the month after the newest one to load. The last
+    partition is always kept empty, which is what lets a columnstore split it.
+    Input: {"first_month_key": 202101, "last_month_key": 202406}
+    """
+    table = get_fact_table()
+    first_boundary = int(os.environ.get("SYNAPSE_FACT_FIRST_MONTH", "2017-07").replace("-", ""))
+    last_boundary = next_month_key(params["last_month_key"])
+    with telemetry.invocation("prepare_synapse_fact_activity") as invocation:
+        try:
+            if params["first_month_key"] < first_boundary:
+                raise ValueError(f"Month {params['first_month_key']} is before SYNAPSE_FACT_FIRST_MONTH ({first_boundary}); it has no partition of its own in {table}")
+            with sql_connection() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute(f"IF SCHEMA_ID('{STAGE_SCHEMA}') IS NULL EXEC('CREATE SCHEMA {STAGE_SCHEMA}')")
+                    boundaries = get_partition_boundaries(cursor, table)
+                    if not boundaries:
+                        month_key = first_boundary
+                        while month_key <= last_boundary:
+                            boundaries.append(month_key)
+                            month_key = next_month_key(month_key)
+                        logging.info(f"Activity prepare_synapse_fact_activity: Creating {table} with {len(boundaries)} month partitions")
+                        cursor.execute(f"""
+                        CREATE TABLE {table} ({get_column_definitions()}, month_key INT NOT NULL)
+                        WITH (DISTRIBUTION = HASH(trading_pair), CLUSTERED COLUMNSTORE INDEX, {build_partition_clause(boundaries)})
+                        """)
+                    month_key = next_month_key(boundaries[-1])
+                    while boundaries[-1] < last_boundary:
+                        cursor.execute(f"ALTER TABLE {table} SPLIT RANGE ({month_key})")
+                        boundaries.append(month_key)
+                        invocation.add("splits")
+                        month_key = next_month_key(month_key)
+            return boundaries
+        except Exception as e:
+            logging.error(f"Activity prepare_synapse_fact_activity: Error preparing {table}: {str(e)}")
+            raise
+
+@bp.activity_trigger(input_name="params")
+def load_month_to_synapse_activity(params: dict) -> dict:
+    """
+    Activity to replace one month of the fact table with the month's partitions:
+    COPY INTO a heap staging table, CTAS it into a table partitioned like the fact
+    table, then SWITCH that partition in with TRUNCATE_TARGET. The fact table holds
+    either the old month or the new one, never both, so reruns never duplicate rows.
+    Input: one entry of plan_synapse_loads_activity plus "boundaries" and "return_errors".
+    """
+    from kline_storage import get_blob_path
+    month_key = params["month_key"]
+    table = get_fact_table()
+    load_table = f"{STAGE_SCHEMA}.Klines_Load_{month_key}"
+    switch_table = f"{STAGE_SCHEMA}.Klines_Switch_{month_key}"
+    logging.info(f"Activity load_month_to_synapse_activity: Loading {month_key} ({params['record_count']} rows) into {table}")
+    with telemetry.invocation("load_month_to_synapse_activity", month_key=month_key) as invocation:
+        try:
+            container_client = get_container_client("raw")
+            year, month = divmod(month_key, 100)
+            partition_number = get_partition_number(params["boundaries"], month_key)
+            with sql_connection() as conn:
+                # CTAS and partition switches can't run inside a user transaction.
+                conn.autocommit = True
+                try:
+                    with conn.cursor() as cursor:
+                        for staging_table in (load_table, switch_table):
+                            cursor.execute(f"IF OBJECT_ID('{staging_table}') IS NOT NULL DROP TABLE {staging_table}")
+                        cursor.execute(f"CREATE TABLE {load_table} ({get_column_definitions()}) WITH (DISTRIBUTION = ROUND_ROBIN, HEAP)")
+                        with telemetry.span("copy"):
+                            credential = get_copy_credential(container_client)
+                            for output_format, trading_pairs in params["files"].items():
+                                urls = [f"{container_client.url}/{get_blob_path(trading_pair, year, month, output_format)}" for trading_pair in trading_pairs]
+                                cursor.execute(build_copy_statement(load_table, urls, output_format, credential))
+                        cursor.execute(f"SELECT COUNT_BIG(*) FROM {load_table}")
+                        loaded = cursor.fetchone()[0]
+                        if loaded != params["record_count"]:
+                            raise RuntimeError(f"COPY loaded {loaded} rows for {month_key}, the manifests list {params['record_count']}; leaving {table} untouched")
+                        with telemetry.span("switch"):
+                            cursor.execute(f"""
+                            CREATE TABLE {switch_table}
+                            WITH (DISTRIBUTION = HASH(trading_pair), CLUSTERED COLUMNSTORE INDEX, {build_partition_clause(params['boundaries'])})
+                            AS SELECT {get_column_list()}, CAST({month_key} AS INT) AS month_key FROM {load_table}
+                            """)
+                            cursor.execute(f"ALTER TABLE {switch_table} SWITCH PARTITION {partition_number} TO {table} PARTITION {partition_number} WITH (TRUNCATE_TARGET = ON)")
+                        for staging_table in (load_table, switch_table):
+                            cursor.execute(f"DROP TABLE {staging_table}")
+                finally:
+                    conn.autocommit = False
+
+            record_month_loaded(container_client, month_key, {"fingerprint": params["fingerprint"], "record_count": loaded})
+            invocation.add("rows", loaded)
+            logging.info(f"Activity load_month_to_synapse_activity: Switched {loaded} rows into partition {partition_number} ({month_key}) of {table}")
+            return {"month_key": month_key, "record_count": loaded}
+        except Exception as e:
+            logging.error(f"Activity load_month_to_synapse_activity: Error loading {month_key}: {str(e)}")
+            if params.get("return_errors", False):
+                invocation.status = "error"
+                invocation.set(error=str(e))
+                return {"month_key": month_key, "record_count": -1, "error": str(e)}
+            raise
+
+@bp.orchestration_trigger(context_name="context")
+def synapse_load_orchestrator(context: df.DurableOrchestrationContext):
+    """
+    Load every changed month of the lake into the fact table. The pool must be Online.
+    A month that fails keeps its old fingerprint in the load log, so the next run retries it;
+    the other months still load, and the failures are listed in the summary.
+    Input: {"parallelism": 4}
+    """
+    input_data = context.get_input() or {}
+    parallelism = input_data.get("parallelism", 4)
+    instance_id = context.instance_id
+
+    loads = yield context.call_activity("plan_synapse_loads_activity", {})
+    if not loads:
+        logging.info(f"Synapse Load Orchestrator {instance_id}: The fact table is up to date.")
+        return {"loaded_months": 0, "loaded_rows": 0, "failed_months": {}}
+
+    boundaries = yield context.call_activity("prepare_synapse_fact_activity", {
+        "first_month_key": loads[0]["month_key"],
+        "last_month_key": loads[-1]["month_key"]
+    })
+    logging.info(f"Synapse Load Orchestrator {instance_id}: Loading {len(loads)} months, {parallelism} at a time.")
+    results = []
+    for offset in range(0, len(loads), parallelism):
+        results.extend((yield context.task_all([
+            context.call_activity("load_month_to_synapse_activity", {**load, "boundaries": boundaries, "return_errors": True})
+            for load in loads[offset:offset + parallelism]
+        ])))
+
+    loaded = [result for result in results if result["record_count"] >= 0]
+    failed_months = {str(result["month_key"]): result["error"] for result in results if result["record_count"] < 0}
+    loaded_rows = sum(result["record_count"] for result in loaded)
+    if failed_months:
+        logging.error(f"Synapse Load Orchestrator {instance_id}: {len(failed_months)} months failed to load and are retried next run: {', '.join(failed_months)}")
+    logging.info(f"Synapse Load Orchestrator {instance_id}: Loaded {len(loaded)} months ({loaded_rows} rows).")
+    return {"loaded_months": len(loaded), "loaded_rows": loaded_rows, "failed_months": failed_months}
@@ -0,0 +1,179 @@
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+try:
+    import resource
+except ImportError:
+    # Unix only; local development on Windows runs without the memory fields.
+    resource = None
+
+# Upper bounds (ms) of the request latency histogram buckets; the last bucket is open-ended.
+LATENCY_BUCKETS_MS = (50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+_current = contextvars.ContextVar("telemetry_invocation", default=None)
+_export_lock = threading.Lock()
+
+class LatencyHistogram:
+    """
+    Fixed-bucket request latency histogram, safe to update from fetch worker threads.
+    """
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float) -> None:
+        milliseconds = seconds * 1000
+        index = next((i for i, bound in enumerate(LATENCY_BUCKETS_MS) if milliseconds <= bound), len(LATENCY_BUCKETS_MS))
+        with self._lock:
+            self.counts[index] += 1
+            self.total_seconds += seconds
+            self.max_seconds = max(self.max_seconds, seconds)
+
+    def merge(self, other: "LatencyHistogram") -> None:
+        with self._lock:
+            self.counts = [mine + theirs for mine, theirs in zip(self.counts, other.counts)]
+            self.total_seconds += other.total_seconds
+            self.max_seconds = max(self.max_seconds, other.max_seconds)
+
+    def as_dict(self) -> dict:
+        count = sum(self.counts)
+        labels = [f"le_{bound}ms" for bound in LATENCY_BUCKETS_MS] + [f"gt_{LATENCY_BUCKETS_MS[-1]}ms"]
+        return {
+            "count": count,
+            "mean_ms": round(self.total_seconds * 1000 / count, 2) if count else 0.0,
+            "max_ms": round(self.max_seconds * 1000, 2),
+            "buckets": dict(zip(labels, self.counts)),
+        }
+
+def _current_rss_mb() -> float:
+    # Resident set size now, from /proc on Linux; None where that is not available.
+    try:
+        with open("/proc/self/statm") as statm:
+            return round(int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20, 1)
+    except (OSError, AttributeError, ValueError):
+        return None
+
+def _worker_peak_rss_mb() -> float:
+    # ru_maxrss is KiB on Linux; it is the worker's high-water mark, not just this invocation's.
+    if resource is None:
+        return None
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+class Invocation:
+    """
+    Spans, counters and a latency histogram for one function invocation. Span times
+    are exclusive: a nested span's time is charged to it and not to its parent.
+    """
+
+    def __init__(self, function_name: str, **attributes):
+        self.function_name = function_name
+        self.attributes = dict(attributes)
+        self.spans = {}
+        self.counters = {}
+        self.latency = LatencyHistogram()
+        # Set to "error" by functions that report failures in their result instead of raising.
+        self.status = "ok"
+        self.started_at = datetime.now(timezone.utc)
+        self._started = time.perf_counter()
+        self._rss_start_mb = _current_rss_mb()
+        self._span_stack = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, stage: str):
+        self._span_stack.append(0.0)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            child_time = self._span_stack.pop()
+            with self._lock:
+                self.spans[stage] = self.spans.get(stage, 0.0) + elapsed - child_time
+            if self._span_stack:
+                self._span_stack[-1] += elapsed
+
+    def add(self, counter: str, value=1) -> None:
+        with self._lock:
+            self.counters[counter] = self.counters.get(counter, 0) + value
+
+    def set(self, **attributes) -> None:
+        self.attributes.update(attributes)
+
+    def as_record(self, status: str, error: str = None) -> dict:
+        record = {
+            "function": self.function_name,
+            "started_at": self.started_at.isoformat(),
+            "duration_seconds": round(time.perf_counter() - self._started, 4),
+            "status": status,
+            **self.attributes,
+            "spans_seconds": {stage: round(seconds, 4) for stage, seconds in self.spans.items()},
+            "counters": {name: round(value, 4) if isinstance(value, float) else value for name, value in self.counters.items()},
+            "rss_start_mb": self._rss_start_mb,
+            "rss_end_mb": _current_rss_mb(),
+            "worker_peak_rss_mb": _worker_peak_rss_mb(),
+        }
+        if sum(self.latency.counts):
+            record["request_latency"] = self.latency.as_dict()
+        if error is not None:
+            record["error"] = error
+        return record
+
+def export_record(record: dict) -> None:
+    """
+    Log the record as one JSON line and, if TELEMETRY_JSONL_PATH is set, append it there.
+    """
+    line = json.dumps(record, default=str)
+    logging.info(f"Telemetry: {line}")
+    path = os.environ.get("TELEMETRY_JSONL_PATH")
+    if path:
+        with _export_lock:
+            with open(path, "a") as export_file:
+                export_file.write(line + "\n")
+
+@contextmanager
+def invocation(function_name: str, **attributes):
+    """
+    Collect telemetry for the enclosed function body and emit one record when it exits,
+    whether it returns or raises.
+    """
+    current = Invocation(function_name, **attributes)
+    token = _current.set(current)
+    try:
+        yield current
+    except Exception as e:
+        export_record(current.as_record("error", str(e)))
+        raise
+    else:
+        export_record(current.as_record(current.status))
+    finally:
+        _current.reset(token)
+
+def current_invocation() -> Invocation:
+    return _current.get()
+
+@contextmanager
+def span(stage: str):
+    """
+    Time `stage` against the current invocation; a no-op outside of one.
+    """
+    current = _current.get()
+    if current is None:
+        yield
+        return
+    with current.span(stage):
+        yield
+
+def add(counter: str, value=1) -> None:
+    current = _current.get()
+    if current is not None:
+        current.add(counter, value)
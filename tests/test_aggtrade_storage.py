@@ -0,0 +1,37 @@
+import json
+import numpy as np
+import pytest
+from aggtrade_storage import AGGTRADE_FIELDS, AggTradePage
+
+TRADES = [
+    {"a": 3000000000 + index, "p": f"{60000 + index / 7:.8f}", "q": f"{0.001 * (index + 1):.8f}", "f": 5000000000 + 2 * index,
+     "l": 5000000000 + 2 * index + 1, "T": 1704067200000 + 7 * index, "m": index % 2 == 1, "M": True}
+    for index in range(50)
+]
+
+@pytest.mark.parametrize("separators", [(",", ":"), (", ", ": ")])
+def test_from_body_matches_json_decode(separators):
+    page = AggTradePage.from_body(json.dumps(TRADES, separators=separators).encode("utf-8"))
+    assert len(page) == len(TRADES)
+    for name, (key, dtype) in AGGTRADE_FIELDS.items():
+        expected = np.array([trade[key] for trade in TRADES], dtype=dtype)
+        assert page.columns[name].dtype == expected.dtype
+        np.testing.assert_array_equal(page.columns[name], expected)
+    assert page.first_id == 3000000000
+    assert page.last_id == 3000000049
+
+def test_from_body_empty():
+    page = AggTradePage.from_body(b"[]")
+    assert len(page) == 0
+    assert page.columns['transact_time'].dtype == np.int64
+
+def test_from_body_rejects_missing_fields():
+    with pytest.raises(ValueError):
+        AggTradePage.from_body(b'[{"a":1,"T":2}]')
+
+def test_drop_from_time_keeps_earlier_trades():
+    page = AggTradePage.from_body(json.dumps(TRADES).encode("utf-8"))
+    kept = page.drop_from_time(1704067200000 + 7 * 10)
+    assert len(kept) == 10
+    assert kept.last_id == 3000000009
+    assert page.drop_from_time(1704067200000 + 7 * 50) is page
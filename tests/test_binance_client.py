@@ -0,0 +1,63 @@
+import numpy as np
+from binance_client import INTERVAL_MS, PAGE_LIMIT, build_page_windows
+
+START_MS = 1704067200000  # 2024-01-01T00:00:00Z
+
+def test_page_windows_cover_range_without_overlap():
+    end_ms = START_MS + 31 * 24 * 60 * 60_000
+    windows = build_page_windows(START_MS, end_ms)
+    assert windows[0][0] == START_MS
+    assert windows[-1][1] == end_ms - 1
+    for (_, previous_end), (next_start, _) in zip(windows, windows[1:]):
+        assert next_start == previous_end + 1
+    assert all(end - start + 1 <= PAGE_LIMIT * INTERVAL_MS["1m"] for start, end in windows)
+    assert len(windows) == -(-31 * 24 * 60 // PAGE_LIMIT)
+
+def test_page_windows_short_and_empty_ranges():
+    assert build_page_windows(START_MS, START_MS + 5 * 60_000) == [(START_MS, START_MS + 5 * 60_000 - 1)]
+    assert build_page_windows(START_MS, START_MS) == []
+
+def test_page_windows_follow_interval_and_limit():
+    windows = build_page_windows(START_MS, START_MS + 10 * INTERVAL_MS["1h"], interval="1h", limit=4)
+    assert [end - start + 1 for start, end in windows] == [4 * INTERVAL_MS["1h"], 4 * INTERVAL_MS["1h"], 2 * INTERVAL_MS["1h"]]
+
+def fake_fetch(available: set, page_size: int, calls: list):
+    """
+    A klines endpoint holding the open times in `available`, returning at most page_size per request.
+    """
+    from kline_storage import KLINE_COLUMNS, KlinePage
+
+    def fetch(session, symbol, interval, start_ms, end_ms, limit=PAGE_LIMIT, stats=None):
+        calls.append((start_ms, end_ms))
+        open_times = sorted(time for time in available if start_ms <= time <= end_ms)[:page_size]
+        values = np.array([[time, 1, 1, 1, 1, 1, time + 59_999, 1, 1, 1, 1, 0] for time in open_times], dtype=np.float64).reshape(-1, len(KLINE_COLUMNS))
+        rows = b"".join(f"{symbol},{time}\n".encode() for time in open_times)
+        return KlinePage(symbol, values, rows)
+    return fetch
+
+def test_window_fetches_the_rest_after_a_short_page(monkeypatch):
+    import binance_client
+    calls = []
+    available = {START_MS + minute * 60_000 for minute in range(PAGE_LIMIT)}
+    monkeypatch.setattr(binance_client, "fetch_klines_page", fake_fetch(available, 600, calls))
+    page = binance_client.fetch_window_pages(None, "BTCUSDT", "1m", START_MS, START_MS + PAGE_LIMIT * 60_000 - 1)
+    assert len(page) == PAGE_LIMIT
+    assert calls == [(START_MS, START_MS + PAGE_LIMIT * 60_000 - 1), (START_MS + 600 * 60_000, START_MS + PAGE_LIMIT * 60_000 - 1)]
+
+def test_window_stops_at_a_trailing_gap(monkeypatch):
+    import binance_client
+    calls = []
+    available = {START_MS + minute * 60_000 for minute in range(700)}
+    monkeypatch.setattr(binance_client, "fetch_klines_page", fake_fetch(available, PAGE_LIMIT, calls))
+    page = binance_client.fetch_window_pages(None, "BTCUSDT", "1m", START_MS, START_MS + PAGE_LIMIT * 60_000 - 1)
+    assert len(page) == 700
+    assert len(calls) == 2
+
+def test_full_window_takes_one_request(monkeypatch):
+    import binance_client
+    calls = []
+    available = {START_MS + minute * 60_000 for minute in range(2 * PAGE_LIMIT)}
+    monkeypatch.setattr(binance_client, "fetch_klines_page", fake_fetch(available, PAGE_LIMIT, calls))
+    page = binance_client.fetch_window_pages(None, "BTCUSDT", "1m", START_MS, START_MS + PAGE_LIMIT * 60_000 - 1)
+    assert len(page) == PAGE_LIMIT
+    assert len(calls) == 1
@@ -0,0 +1,87 @@
+import json
+import numpy as np
+import pandas as pd
+import pytest
+from feature_engine import compute_ema, compute_features, new_feature_state, rolling_std, session_vwap
+
+START_MS = 1704150000000  # 2024-01-01T23:00:00Z, so the candles cross midnight
+
+def make_candles(count: int, seed: int = 3) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    open_time = START_MS + np.arange(count, dtype=np.int64) * 60_000
+    close = 100 * np.exp(np.cumsum(rng.normal(0, 0.001, count)))
+    volume = rng.uniform(1, 10, count)
+    return pd.DataFrame({
+        'open_time': open_time,
+        'close_time': open_time + 59_999,
+        'close_price': close,
+        'volume': volume,
+        'quote_asset_volume': volume * close,
+    })
+
+def test_rolling_std_matches_pandas():
+    values = np.random.default_rng(1).normal(size=200)
+    expected = pd.Series(values).rolling(20).std().to_numpy()
+    np.testing.assert_allclose(rolling_std(values, np.array([]), 20), expected, rtol=1e-9, equal_nan=True)
+
+def test_rolling_std_tail_completes_early_windows():
+    values = np.random.default_rng(2).normal(size=100)
+    expected = pd.Series(values).rolling(10).std().to_numpy()[40:]
+    np.testing.assert_allclose(rolling_std(values[40:], values[31:40], 10), expected, rtol=1e-9)
+
+def test_rolling_std_nan_blanks_its_windows():
+    values = np.arange(10, dtype=np.float64)
+    values[4] = np.nan
+    result = rolling_std(values, np.array([]), 3)
+    # Windows ending at 2 and 3 are complete; the three windows holding index 4 are not.
+    assert np.isnan(result[:2]).all()
+    assert np.isfinite(result[2:4]).all()
+    assert np.isnan(result[4:7]).all()
+    assert np.isfinite(result[7:]).all()
+
+def test_ema_seeded_from_state_continues_the_recursion():
+    close = np.random.default_rng(4).uniform(90, 110, 300)
+    expected = pd.Series(close).ewm(span=26, adjust=False).mean().to_numpy()
+    head = compute_ema(close[:120], 26, None)
+    tail = compute_ema(close[120:], 26, float(head[-1]))
+    np.testing.assert_allclose(np.concatenate([head, tail]), expected, rtol=1e-12)
+
+def test_session_vwap_restarts_each_utc_day():
+    candles = make_candles(120)
+    vwap, day, quote, volume = session_vwap(candles['open_time'].to_numpy(), candles['quote_asset_volume'].to_numpy(), candles['volume'].to_numpy(), new_feature_state([12], [60]))
+    midnight = 60  # START_MS is one hour before midnight
+    first_day = candles.iloc[:midnight]
+    assert vwap[midnight - 1] == pytest.approx(first_day['quote_asset_volume'].sum() / first_day['volume'].sum())
+    assert vwap[midnight] == pytest.approx(candles['close_price'].iloc[midnight])
+    assert volume == pytest.approx(candles['volume'].iloc[midnight:].sum())
+
+@pytest.mark.parametrize("split", [1, 59, 60, 61, 500])
+def test_incremental_features_match_a_single_pass(split):
+    candles = make_candles(1500)
+    state = new_feature_state([12, 200], [60, 1440])
+    full, full_state = compute_features(candles, state, "BTCUSDT")
+
+    head, head_state = compute_features(candles.iloc[:split].reset_index(drop=True), state, "BTCUSDT")
+    tail, tail_state = compute_features(candles.iloc[split:].reset_index(drop=True), head_state, "BTCUSDT")
+    pd.testing.assert_frame_equal(pd.concat([head, tail], ignore_index=True), full, rtol=1e-9)
+    assert tail_state["last_open_time"] == full_state["last_open_time"]
+    assert len(tail_state["return_tail"]) == 1439
+    np.testing.assert_allclose(tail_state["return_tail"], full_state["return_tail"], rtol=1e-9)
+
+def test_features_of_no_candles_keep_the_state():
+    state = new_feature_state([12], [60])
+    frame, new_state = compute_features(make_candles(0), state, "BTCUSDT")
+    assert frame.empty
+    assert new_state is state
+
+def test_state_is_strict_json_and_round_trips():
+    candles = make_candles(100)
+    candles.loc[50, 'close_price'] = np.nan
+    _, state = compute_features(candles, new_feature_state([12], [60]), "BTCUSDT")
+    saved = json.dumps(state, allow_nan=False)
+    assert state["return_tail"][9:11] == [None, None]  # the returns into and out of the NaN close
+
+    more = make_candles(200).iloc[100:].reset_index(drop=True)
+    from_saved, _ = compute_features(more, json.loads(saved), "BTCUSDT")
+    from_memory, _ = compute_features(more, state, "BTCUSDT")
+    pd.testing.assert_frame_equal(from_saved, from_memory)
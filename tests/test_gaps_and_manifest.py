@@ -0,0 +1,62 @@
+from datetime import datetime, timezone
+import numpy as np
+from kline_gaps import find_gaps
+from partition_manifest import compute_manifest_watermark
+
+START_MS = 1704067200000  # 2024-01-01T00:00:00Z
+END_MS = START_MS + 10 * 60_000
+
+def grid(*minutes) -> np.ndarray:
+    return np.array([START_MS + minute * 60_000 for minute in minutes], dtype=np.int64)
+
+def test_complete_grid_has_no_gaps():
+    result = find_gaps(grid(*range(10)), START_MS, END_MS)
+    assert result == {"expected_count": 10, "missing_count": 0, "gaps": [], "duplicates": [], "off_grid": []}
+
+def test_leading_inner_and_trailing_gaps():
+    result = find_gaps(grid(2, 3, 5, 6, 7), START_MS, END_MS)
+    minute = lambda index: START_MS + index * 60_000
+    assert result["gaps"] == [[minute(0), minute(1)], [minute(4), minute(4)], [minute(8), minute(9)]]
+    assert result["missing_count"] == 5
+
+def test_duplicates_and_off_grid_times():
+    open_times = np.concatenate([grid(*range(10)), grid(3, 3), [START_MS + 30_000, END_MS, START_MS - 60_000]])
+    result = find_gaps(open_times, START_MS, END_MS)
+    assert result["duplicates"] == [START_MS + 3 * 60_000]
+    assert result["off_grid"] == [START_MS - 60_000, START_MS + 30_000, END_MS]
+    assert result["gaps"] == []
+    assert result["missing_count"] == 0
+
+def test_empty_month_is_one_gap():
+    result = find_gaps(np.array([], dtype=np.int64), START_MS, END_MS)
+    assert result["gaps"] == [[START_MS, END_MS - 60_000]]
+    assert result["missing_count"] == 10
+
+NOW = datetime(2024, 4, 15, 12, tzinfo=timezone.utc)
+
+def test_watermark_without_partitions_is_none():
+    assert compute_manifest_watermark({}, NOW) is None
+    assert compute_manifest_watermark({"partitions": {}}, NOW) is None
+
+def test_watermark_stops_at_first_incomplete_month():
+    manifest = {"partitions": {
+        "2024/01": {"complete": True},
+        "2024/02": {"complete": False},
+        "2024/03": {"complete": True},
+    }}
+    assert compute_manifest_watermark(manifest, NOW) == datetime(2024, 2, 1, tzinfo=timezone.utc).isoformat()
+
+def test_watermark_stops_at_first_missing_month():
+    manifest = {"partitions": {"2024/01": {"complete": True}, "2024/03": {"complete": True}}}
+    assert compute_manifest_watermark(manifest, NOW) == datetime(2024, 2, 1, tzinfo=timezone.utc).isoformat()
+
+def test_watermark_follows_the_current_month():
+    last_close = int(datetime(2024, 4, 15, 10, 59, 59, 999000, tzinfo=timezone.utc).timestamp() * 1000)
+    manifest = {"partitions": {
+        "2024/02": {"complete": True},
+        "2024/03": {"complete": True},
+        "2024/04": {"complete": False, "max_close_time": last_close},
+    }}
+    assert compute_manifest_watermark(manifest, NOW) == datetime(2024, 4, 15, 11, tzinfo=timezone.utc).isoformat()
+    del manifest["partitions"]["2024/04"]
+    assert compute_manifest_watermark(manifest, NOW) == datetime(2024, 4, 1, tzinfo=timezone.utc).isoformat()
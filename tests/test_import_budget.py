@@ -0,0 +1,13 @@
+import os
+import pytest
+from benchmarks.import_budget import MODULES, measure_import
+
+# Allowed cold import time of each blueprint module, function_app included.
+BUDGET_MS = float(os.environ.get("IMPORT_BUDGET_MS", "600"))
+
+@pytest.mark.parametrize("module", MODULES)
+def test_import_budget(module):
+    result = measure_import(module, repeat=3)
+    print(f"{module}: {result['ms']:.1f} ms")
+    assert not result["loaded"], f"{module} imports {', '.join(result['loaded'])} at index time"
+    assert result["ms"] <= BUDGET_MS, f"{module} takes {result['ms']:.0f} ms to import, over the {BUDGET_MS:.0f} ms budget"
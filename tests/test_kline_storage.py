@@ -0,0 +1,98 @@
+import io
+import json
+import numpy as np
+import pandas as pd
+import pytest
+from kline_storage import FINAL_COLUMNS, KlinePage, PartitionWriter, build_kline_frame, combine_digests, compute_row_digest
+
+START_MS = 1704067200000  # 2024-01-01T00:00:00Z
+
+def make_body(count: int, start_ms: int = START_MS) -> bytes:
+    klines = []
+    for index in range(count):
+        open_time = start_ms + index * 60_000
+        klines.append([open_time, f"{100 + index}.10000000", "101.50000000", "99.25000000", f"{100 + index}.20000000", "12.00000000",
+                       open_time + 59_999, "1210.50000000", 42 + index, "6.00000000", "605.25000000", "0"])
+    return json.dumps(klines).encode("utf-8")
+
+def test_from_body_matches_json_decode():
+    body = make_body(3)
+    page = KlinePage.from_body(body, "BTCUSDT")
+    expected = np.array(json.loads(body), dtype=np.float64)
+    assert len(page) == 3
+    np.testing.assert_array_equal(page.values, expected)
+    assert page.last_open_time == START_MS + 2 * 60_000
+    assert page.last_close_time == START_MS + 2 * 60_000 + 59_999
+
+def test_from_body_rows_keep_binance_strings():
+    page = KlinePage.from_body(make_body(2), "BTCUSDT")
+    lines = page.rows.decode("utf-8").splitlines()
+    assert lines[0] == f"BTCUSDT,{START_MS},100.10000000,101.50000000,99.25000000,100.20000000,12.00000000,{START_MS + 59_999},1210.50000000,42,6.00000000,605.25000000"
+    assert len(lines) == 2
+    assert len(lines[1].split(",")) == len(FINAL_COLUMNS)
+
+@pytest.mark.parametrize("body", [b"[]", b"[ ]\n"])
+def test_from_body_empty(body):
+    page = KlinePage.from_body(body, "BTCUSDT")
+    assert len(page) == 0
+    assert page.rows == b""
+
+def test_from_body_rejects_malformed():
+    with pytest.raises(ValueError):
+        KlinePage.from_body(b"[[1,2,3]]", "BTCUSDT")
+
+def test_drop_through_removes_overlap():
+    page = KlinePage.from_body(make_body(5), "BTCUSDT")
+    trimmed = page.drop_through(START_MS + 60_000)
+    assert len(trimmed) == 3
+    assert trimmed.values[0, 0] == START_MS + 2 * 60_000
+    assert trimmed.rows == b"".join(page.rows.splitlines(keepends=True)[2:])
+    assert page.drop_through(START_MS - 1) is page
+    assert len(page.drop_through(START_MS + 10 * 60_000)) == 0
+
+def test_typed_frame_matches_csv_frame():
+    page = KlinePage.from_body(make_body(4), "BTCUSDT")
+    typed = build_kline_frame([page], "BTCUSDT")
+    raw = build_kline_frame([page], "BTCUSDT", typed=False)
+    assert list(raw.columns) == FINAL_COLUMNS
+    assert typed['open_time'].tolist() == raw['open_time'].astype('int64').tolist()
+    assert typed['close_price'].tolist() == raw['close_price'].astype('float64').tolist()
+
+def test_row_digest_is_order_independent():
+    frame = build_kline_frame([KlinePage.from_body(make_body(10), "BTCUSDT")], "BTCUSDT")
+    shuffled = frame.sample(frac=1, random_state=7).reset_index(drop=True)
+    assert compute_row_digest(frame) == compute_row_digest(shuffled)
+    changed = frame.copy()
+    changed.loc[3, 'close_price'] += 0.01
+    assert compute_row_digest(changed) != compute_row_digest(frame)
+
+@pytest.mark.parametrize("output_format", ["csv", "parquet"])
+def test_incremental_digest_matches_full_rewrite(output_format):
+    pages = [KlinePage.from_body(make_body(1000, START_MS + offset * 60_000), "BTCUSDT") for offset in (0, 1000, 2000)]
+
+    full = PartitionWriter(io.BytesIO(), output_format)
+    full.write_frame(build_kline_frame(pages, "BTCUSDT"))
+    full.close()
+
+    # An append run digests only the new pages and adds them to the stored digest.
+    first = PartitionWriter(io.BytesIO(), output_format)
+    first.write_page(pages[0])
+    first.close()
+    appended = PartitionWriter(io.BytesIO(), output_format, include_header=False)
+    for page in pages[1:]:
+        appended.write_page(page)
+    appended.close()
+
+    assert combine_digests(first.content_digest, appended.content_digest) == full.content_digest
+    assert first.record_count + appended.record_count == full.record_count == 3000
+
+def test_csv_partition_round_trips():
+    pages = [KlinePage.from_body(make_body(3), "BTCUSDT")]
+    sink = io.BytesIO()
+    writer = PartitionWriter(sink, "csv")
+    for page in pages:
+        writer.write_page(page)
+    writer.close()
+    frame = pd.read_csv(io.BytesIO(sink.getvalue()))
+    assert list(frame.columns) == FINAL_COLUMNS
+    assert compute_row_digest(frame) == writer.content_digest
@@ -0,0 +1,103 @@
+import datetime
+from binance_client import KLINES_WEIGHT, PAGE_LIMIT
+from daily_timer_trigger import estimate_backlog_weight, plan_pair_schedule, run_pair_window
+from pair_universe import select_trading_pairs
+
+NOW = datetime.datetime(2024, 3, 1, tzinfo=datetime.timezone.utc)
+
+def minutes_ago(minutes: int) -> str:
+    return (NOW - datetime.timedelta(minutes=minutes)).isoformat()
+
+def test_backlog_weight_is_one_page_per_limit_minutes():
+    assert estimate_backlog_weight(NOW.isoformat(), NOW) == 0
+    assert estimate_backlog_weight(minutes_ago(1), NOW) == KLINES_WEIGHT
+    assert estimate_backlog_weight(minutes_ago(PAGE_LIMIT), NOW) == KLINES_WEIGHT
+    assert estimate_backlog_weight(minutes_ago(PAGE_LIMIT + 1), NOW) == 2 * KLINES_WEIGHT
+    # A watermark in the future is no backlog.
+    assert estimate_backlog_weight((NOW + datetime.timedelta(hours=1)).isoformat(), NOW) == 0
+
+def test_schedule_admits_largest_backlog_first_within_budget():
+    watermarks = {"AAA": minutes_ago(5 * PAGE_LIMIT), "BBB": minutes_ago(2 * PAGE_LIMIT), "CCC": minutes_ago(PAGE_LIMIT)}
+    scheduled, deferred, left = plan_pair_schedule(watermarks, NOW, weight_budget=7 * KLINES_WEIGHT)
+    assert scheduled == [("AAA", 5 * KLINES_WEIGHT), ("BBB", 2 * KLINES_WEIGHT)]
+    assert deferred == ["CCC"]
+    assert left == 0
+
+def test_schedule_skips_a_pair_that_does_not_fit_but_admits_smaller_ones():
+    watermarks = {"AAA": minutes_ago(5 * PAGE_LIMIT), "BBB": minutes_ago(4 * PAGE_LIMIT), "CCC": minutes_ago(PAGE_LIMIT)}
+    scheduled, deferred, left = plan_pair_schedule(watermarks, NOW, weight_budget=6 * KLINES_WEIGHT)
+    assert [pair for pair, _ in scheduled] == ["AAA", "CCC"]
+    assert deferred == ["BBB"]
+    assert left == 0
+
+def test_schedule_guarantees_progress_of_largest_backlog():
+    watermarks = {"AAA": minutes_ago(50 * PAGE_LIMIT), "BBB": minutes_ago(PAGE_LIMIT)}
+    scheduled, deferred, left = plan_pair_schedule(watermarks, NOW, weight_budget=KLINES_WEIGHT)
+    assert scheduled == [("AAA", 50 * KLINES_WEIGHT)]
+    assert deferred == ["BBB"]
+    assert left < 0
+
+    scheduled, deferred, _ = plan_pair_schedule(watermarks, NOW, weight_budget=KLINES_WEIGHT, guarantee_progress=False)
+    assert scheduled == [("BBB", KLINES_WEIGHT)]
+    assert deferred == ["AAA"]
+
+def test_schedule_orders_ties_by_pair():
+    watermarks = {"BBB": minutes_ago(PAGE_LIMIT), "AAA": minutes_ago(PAGE_LIMIT)}
+    scheduled, deferred, _ = plan_pair_schedule(watermarks, NOW, weight_budget=100)
+    assert [pair for pair, _ in scheduled] == ["AAA", "BBB"]
+    assert deferred == []
+
+EXCHANGE_INFO = {
+    "symbols": [
+        {"symbol": "BTCUSDT", "quoteAsset": "USDT", "status": "TRADING"},
+        {"symbol": "ETHUSDT", "quoteAsset": "USDT", "status": "TRADING"},
+        {"symbol": "DOGEUSDT", "quoteAsset": "USDT", "status": "TRADING"},
+        {"symbol": "OLDUSDT", "quoteAsset": "USDT", "status": "BREAK"},
+        {"symbol": "MARGINUSDT", "quoteAsset": "USDT", "status": "TRADING", "isSpotTradingAllowed": False},
+        {"symbol": "ETHBTC", "quoteAsset": "BTC", "status": "TRADING"},
+    ],
+    "quote_volumes": {"BTCUSDT": 9e9, "ETHUSDT": 5e9, "DOGEUSDT": 1e8},
+}
+
+def test_select_pairs_filters_quote_status_and_exclusions():
+    assert select_trading_pairs(EXCHANGE_INFO, ["USDT"], ["TRADING"]) == ["BTCUSDT", "DOGEUSDT", "ETHUSDT"]
+    assert select_trading_pairs(EXCHANGE_INFO, ["USDT", "BTC"], ["TRADING"], excluded=["DOGEUSDT"]) == ["BTCUSDT", "ETHBTC", "ETHUSDT"]
+
+def test_select_pairs_caps_by_quote_volume():
+    assert select_trading_pairs(EXCHANGE_INFO, ["USDT"], ["TRADING"], max_pairs=2) == ["BTCUSDT", "ETHUSDT"]
+
+class FakeTask:
+    def __init__(self, name, value):
+        self.name = name
+        self.result = value
+
+class FakeContext:
+    """
+    Completes sub-orchestrations in the order they were started.
+    """
+
+    def __init__(self):
+        self.started = []
+
+    def call_sub_orchestrator(self, name, pair_input):
+        self.started.append(pair_input)
+        return FakeTask(name, f"done {pair_input}")
+
+    def task_any(self, tasks):
+        assert tasks, "task_any([]) never completes"
+        return tasks[0]
+
+def drive(generator):
+    value = None
+    try:
+        while True:
+            value = generator.send(value)
+    except StopIteration as stop:
+        return stop.value
+
+def test_pair_window_returns_results_in_input_order():
+    context = FakeContext()
+    companion = FakeTask("companion", "Online")
+    results, companion_result = drive(run_pair_window(context, ["A", "B", "C"], 2, companion))
+    assert results == ["done A", "done B", "done C"]
+    assert companion_result == "Online"